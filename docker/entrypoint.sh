@@ -46,5 +46,12 @@ echo "Collecting static files..."
 DJANGO_SETTINGS_MODULE=core.settings python manage.py collectstatic --noinput
 
 # Start Gunicorn
+# SERVER_MODE=asgi serves core.asgi through uvicorn workers so the async
+# endpoints can keep many upstream Groq calls in flight per process.
+if [[ "${SERVER_MODE:-wsgi}" == "asgi" ]]; then
+    echo "Starting Gunicorn (ASGI)..."
+    exec gunicorn core.asgi:application --config gunicorn.conf.py --bind 0.0.0.0:8000 --workers 3 --worker-class uvicorn.workers.UvicornWorker --access-logfile - --error-logfile -
+fi
+
 echo "Starting Gunicorn..."
-exec gunicorn core.wsgi:application --bind 0.0.0.0:8000 --workers 3 --access-logfile - --error-logfile -
+exec gunicorn core.wsgi:application --config gunicorn.conf.py --bind 0.0.0.0:8000 --workers 3 --access-logfile - --error-logfile -
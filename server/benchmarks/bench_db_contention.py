@@ -0,0 +1,178 @@
+"""Benchmark: ChatMessage write/read throughput under concurrent writer processes.
+
+Run from the server directory:
+
+    python benchmarks/bench_db_contention.py [--writers 3] [--readers 2] [--writes 200]
+
+Each profile gets a fresh SQLite file. Writer processes save exchanges with
+record_exchange, like gunicorn workers after a Groq call, while reader
+processes page through the history. "default" is SQLite's rollback journal
+with a 5 s timeout (Django's previous configuration), "tuned" is the WAL
+profile from core/settings.py. With DATABASE_ENGINE=postgresql in the
+environment only the configured PostgreSQL database is measured.
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+PROFILES = {
+    'default': {'SQLITE_TUNING': 'False', 'SQLITE_BUSY_TIMEOUT': '5', 'DATABASE_CONN_MAX_AGE': '0'},
+    'tuned': {'SQLITE_TUNING': 'True'},
+}
+
+RESPONSE = {
+    'status': 'success',
+    'data': {
+        'summary': 'Benchmark response',
+        'data': {
+            'table_name': 'Startup Information',
+            'companies': [
+                {
+                    'company_name': f'Company {i}',
+                    'location': 'Berlin, Germany',
+                    'industry': 'Fintech',
+                    'funding_stage': 'Series A',
+                    'funding_amount': '$12M',
+                    'established_year': '2019',
+                    'investors': 'Investor A, Investor B',
+                }
+                for i in range(10)
+            ],
+        },
+        'key_insights': [],
+    },
+}
+
+
+def setup_django(env):
+    os.environ.update(env)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    import django
+    django.setup()
+
+
+def migrate(env):
+    setup_django(env)
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+
+def writer(env, writes, start, results):
+    setup_django(env)
+    from django.db import OperationalError
+    from chat.storage import record_exchange
+
+    latencies, errors = [], 0
+    start.wait()
+    for i in range(writes):
+        began = time.perf_counter()
+        try:
+            record_exchange(f'benchmark message {os.getpid()} {i}', RESPONSE)
+        except OperationalError:
+            # "database is locked" once the busy timeout runs out
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - began)
+    results.put(('write', latencies, errors))
+
+
+def reader(env, reads, start, results):
+    setup_django(env)
+    from django.db import OperationalError
+    from chat.views import history_page
+
+    latencies, errors = [], 0
+    start.wait()
+    for _ in range(reads):
+        began = time.perf_counter()
+        try:
+            history_page({'limit': '50', 'summary': '1'})
+        except OperationalError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - began)
+    results.put(('read', latencies, errors))
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run_profile(env, args):
+    context = multiprocessing.get_context('spawn')
+    process = context.Process(target=migrate, args=(env,))
+    process.start()
+    process.join()
+
+    start = context.Event()
+    results = context.Queue()
+    processes = [
+        context.Process(target=writer, args=(env, args.writes, start, results))
+        for _ in range(args.writers)
+    ] + [
+        context.Process(target=reader, args=(env, args.reads, start, results))
+        for _ in range(args.readers)
+    ]
+    for process in processes:
+        process.start()
+    # Let every process finish django.setup() before starting the clock
+    time.sleep(args.warmup)
+    began = time.perf_counter()
+    start.set()
+
+    outcome = {'write': ([], 0), 'read': ([], 0)}
+    for _ in processes:
+        kind, latencies, errors = results.get()
+        outcome[kind] = (outcome[kind][0] + latencies, outcome[kind][1] + errors)
+    elapsed = time.perf_counter() - began
+    for process in processes:
+        process.join()
+    return outcome, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=3)
+    parser.add_argument('--readers', type=int, default=2)
+    parser.add_argument('--writes', type=int, default=200, help='exchanges saved per writer')
+    parser.add_argument('--reads', type=int, default=200, help='history pages read per reader')
+    parser.add_argument('--warmup', type=float, default=2.0, help='seconds to wait for processes to start')
+    args = parser.parse_args()
+
+    os.chdir(SERVER_DIR)
+    if os.getenv('DATABASE_ENGINE', 'sqlite').lower() in ('postgres', 'postgresql'):
+        profiles = {'postgresql': {}}
+    else:
+        profiles = PROFILES
+
+    print(f'{"profile":<12}{"writes/s":>10}{"p50 ms":>9}{"p99 ms":>9}{"errors":>8}'
+          f'{"reads/s":>10}{"p50 ms":>9}{"p99 ms":>9}{"errors":>8}')
+    with tempfile.TemporaryDirectory() as directory:
+        for name, env in profiles.items():
+            env = dict(env)
+            if name in PROFILES:
+                env['SQLITE_PATH'] = os.path.join(directory, f'{name}.sqlite3')
+            outcome, elapsed = run_profile(env, args)
+            row = f'{name:<12}'
+            for kind in ('write', 'read'):
+                latencies, errors = outcome[kind]
+                row += (
+                    f'{len(latencies) / elapsed:>10.1f}'
+                    f'{statistics.median(latencies) * 1e3 if latencies else 0.0:>9.1f}'
+                    f'{percentile(latencies, 0.99) * 1e3:>9.1f}{errors:>8}'
+                )
+            print(row)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""Benchmark: company entity resolution with the blocking index vs. a full scan.
+
+Run from the server directory:
+
+    python benchmarks/bench_entities.py [--companies 100000] [--queries 20000] [--scan-sample 200]
+
+Builds an EntityResolver over a synthetic set of distinct company names,
+then resolves variants of them: formatting variants (case, punctuation,
+legal forms and generic suffixes such as "Software Pvt Ltd"), which the
+canonical name catches, and one-letter typos, which only the edit
+similarity can. Unseen names measure false matches. "candidates" are the
+names the blocking index hands over for scoring, out of all of them. The
+full scan scores a sample of the typo queries against every name, which
+is what matching without the index costs.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+CONSONANTS = ['b', 'c', 'd', 'f', 'g', 'h', 'j', 'k', 'l', 'm', 'n', 'p', 'r', 's', 't', 'v', 'w', 'x', 'z',
+              'br', 'ch', 'cr', 'dr', 'fl', 'gr', 'kr', 'pl', 'pr', 'sh', 'sk', 'st', 'th', 'tr', 'zh']
+VOWELS = ['a', 'e', 'i', 'o', 'u', 'y', 'ai', 'ea', 'io', 'oo', 'ou']
+# Words many startup names share, which make for long trigram postings
+WORDS = ['pay', 'tech', 'health', 'cart', 'bank', 'hub', 'ai', 'box', 'ify', 'loop', 'mint', 'go', 'hq', 'cloud']
+SUFFIXES = ['Pvt Ltd', 'Private Limited', 'Inc.', 'Software Pvt Ltd', 'Technologies', 'Labs', 'GmbH', 'Corp.']
+
+
+def make_names(count, rng, exclude=()):
+    """``count`` names with distinct canonical forms (spaces removed), not in ``exclude``"""
+    from chat.entities import canonical_name
+    seen = set(exclude)
+    names = []
+    while len(names) < count:
+        name = ''.join(rng.choice(CONSONANTS) + rng.choice(VOWELS) for _ in range(rng.randint(2, 4)))
+        if rng.random() < 0.4:
+            name += rng.choice(WORDS)
+        name = name.capitalize()
+        if rng.random() < 0.2:
+            name += ' ' + rng.choice(WORDS).capitalize()
+        canonical = canonical_name(name).replace(' ', '')
+        if canonical in seen:
+            continue
+        seen.add(canonical)
+        names.append(name)
+    return names
+
+
+def formatted(name, rng):
+    choice = rng.randrange(4)
+    if choice == 0:
+        return f'{name} {rng.choice(SUFFIXES)}'
+    if choice == 1:
+        return name.upper()
+    if choice == 2:
+        return f'The {name.lower()}'
+    return f'{name}, {rng.choice(SUFFIXES)}'
+
+
+def typo(name, rng):
+    index = rng.randrange(1, len(name) - 1)
+    choice = rng.randrange(3)
+    if choice == 0:
+        return name[:index] + name[index + 1:]
+    if choice == 1:
+        return name[:index] + name[index + 1] + name[index] + name[index + 2:]
+    return name[:index] + rng.choice('aeiou') + name[index:]
+
+
+def scan(resolver, name):
+    """Best match by scoring every indexed name, as matching without blocking would"""
+    from chat.entities import MIN_FUZZY_LENGTH, canonical_name, edit_distance
+    compact = canonical_name(name).replace(' ', '')
+    edits = resolver.max_edits(len(compact))
+    best, best_score = None, 0.0
+    if len(compact) < MIN_FUZZY_LENGTH or not edits:
+        return resolver._exact.get(compact)
+    for key, other in zip(resolver._keys, resolver._names):
+        distance = edit_distance(compact, other, edits)
+        if distance > edits:
+            continue
+        score = 1 - distance / max(len(compact), len(other))
+        if score > best_score or (score == best_score and best is not None and key < best):
+            best, best_score = key, score
+    return best if best_score >= resolver.threshold else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--companies', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=20000)
+    parser.add_argument('--scan-sample', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    os.environ.update({'DJANGO_SETTINGS_MODULE': 'core.settings', 'METRICS_DIR': ''})
+    os.environ.setdefault('GROQ_API_KEY', 'benchmark')
+    import django
+    django.setup()
+    from chat.entities import EntityResolver, canonical_name
+
+    rng = random.Random(args.seed)
+    names = make_names(args.companies, rng)
+    keys = [canonical_name(name) for name in names]
+    unseen = make_names(args.queries // 4, rng, exclude=[key.replace(' ', '') for key in keys])
+
+    resolver = EntityResolver()
+    started = time.perf_counter()
+    for key, name in zip(keys, names):
+        resolver.add(key, name)
+    build = time.perf_counter() - started
+    print(
+        f'{len(resolver)} companies indexed in {build:.2f}s, '
+        f'{len(resolver._blocks)} blocking keys, threshold {resolver.threshold}'
+    )
+
+    picks = [rng.randrange(len(names)) for _ in range(args.queries)]
+    sets = {
+        'formatted': [(formatted(names[index], rng), keys[index]) for index in picks[::2]],
+        'typo': [(typo(names[index], rng), keys[index]) for index in picks[1::2]],
+        'unseen': [(name, None) for name in unseen],
+    }
+
+    print(f'{"queries":<10}{"count":>8}{"us/query":>10}{"candidates":>12}{"correct":>9}{"wrong":>7}{"missed":>8}')
+    for label, queries in sets.items():
+        started = time.perf_counter()
+        found = [resolver.match(name)[0] for name, _ in queries]
+        seconds = time.perf_counter() - started
+        candidates = statistics.mean(
+            len(resolver.candidates(compact, resolver.max_edits(len(compact))))
+            for compact in (canonical_name(name).replace(' ', '') for name, _ in queries)
+        )
+        correct = sum(1 for key, (_, expected) in zip(found, queries) if key is not None and key == expected)
+        wrong = sum(1 for key, (_, expected) in zip(found, queries) if key is not None and key != expected)
+        missed = sum(1 for key, (_, expected) in zip(found, queries) if key is None and expected is not None)
+        print(
+            f'{label:<10}{len(queries):>8}{seconds / len(queries) * 1e6:>10.1f}{candidates:>12.1f}'
+            f'{correct:>9}{wrong:>7}{missed:>8}'
+        )
+
+    sample = sets['typo'][:args.scan_sample]
+    started = time.perf_counter()
+    scanned = [scan(resolver, name) for name, _ in sample]
+    seconds = time.perf_counter() - started
+    indexed = [resolver.match(name)[0] for name, _ in sample]
+    agree = sum(1 for a, b in zip(scanned, indexed) if a == b)
+    print(
+        f'full scan: {seconds / len(sample) * 1e3:.1f} ms/query over {len(resolver._keys)} names, '
+        f'same answer as the index for {agree}/{len(sample)} queries'
+    )
+
+
+if __name__ == '__main__':
+    main()
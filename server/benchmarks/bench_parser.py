@@ -0,0 +1,108 @@
+"""Microbenchmark: tolerant one-pass parser vs. the previous cleanup chain.
+
+Run from the server directory:
+
+    python benchmarks/bench_parser.py [--companies 60] [--repeat 200]
+
+Each case is a synthetic completion of roughly 4k tokens (about 16 KB).
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat.parsing import ResponseParseError, extract_json  # noqa: E402
+
+
+def legacy_parse(response_text):
+    """The replace()/find()/json.loads chain previously in GroqService.get_response"""
+    response_text = response_text.replace('\\_', '_')
+    response_text = response_text.replace('\\n', ' ')
+    response_text = response_text.replace('\n', ' ')
+    response_text = response_text.replace('\"', '"')
+    response_text = response_text.replace('\\', '')
+    response_text = response_text.replace('```json', '').replace('```', '')
+
+    response_text = response_text.replace('\\_', '_')
+    response_text = response_text.replace('\\n', '\n')
+    response_text = response_text.replace('\n', ' ')
+
+    response_text = response_text.strip('`')
+    if response_text.startswith('json'):
+        response_text = response_text[4:].strip()
+
+    try:
+        start_idx = response_text.find('{')
+        end_idx = response_text.rfind('}')
+        if start_idx != -1 and end_idx != -1:
+            response_text = response_text[start_idx:end_idx + 1].strip()
+            response_text = ' '.join(response_text.split())
+        return json.loads(response_text)
+    except json.JSONDecodeError:
+        last_brace = response_text.rindex('}')
+        return json.loads(response_text[:last_brace + 1])
+
+
+def build_completion(companies):
+    rows = [
+        {
+            'company_name': f'Company {i} Technologies',
+            'industry': 'Fintech / Payments',
+            'funding_stage': 'Series B',
+            'funding_amount': f'${i * 3 + 5}M',
+            'established_year': str(2005 + i % 18),
+            'investors': 'Sequoia Capital, Accel, Tiger Global, Y Combinator',
+            'location': 'Bangalore, India',
+            'description': 'Provides payment infrastructure and lending APIs for small businesses.',
+        }
+        for i in range(companies)
+    ]
+    body = json.dumps({
+        'summary': 'Overview of notable fintech startups in Bangalore.\nFunding is concentrated in later stages.',
+        'data': {'table_name': 'Startup Information', 'companies': rows},
+    }, indent=4)
+    return f'Here is the data you asked for:\n```json\n{body}\n```'
+
+
+def cases(companies):
+    clean = build_completion(companies)
+    escaped = clean.replace('company_name', 'company\\_name').replace('funding_amount', 'funding\\_amount')
+    truncated = clean[:int(len(clean) * 0.8)]
+    return {
+        'clean': clean,
+        'escaped underscores': escaped,
+        'truncated at 80%': truncated,
+    }
+
+
+def run_case(parse, text):
+    try:
+        data = parse(text)
+        return len(data.get('data', {}).get('companies', []))
+    except (json.JSONDecodeError, ResponseParseError, ValueError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--companies', type=int, default=60)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f'{"case":<22}{"size":>8}{"legacy (us)":>14}{"rows":>6}{"new (us)":>12}{"rows":>6}{"speedup":>9}')
+    for name, text in cases(args.companies).items():
+        legacy = timeit.timeit(lambda: run_case(legacy_parse, text), number=args.repeat) / args.repeat
+        new = timeit.timeit(lambda: run_case(extract_json, text), number=args.repeat) / args.repeat
+        legacy_rows = run_case(legacy_parse, text)
+        new_rows = run_case(extract_json, text)
+        print(
+            f'{name:<22}{len(text):>8}{legacy * 1e6:>14.1f}{str(legacy_rows):>6}'
+            f'{new * 1e6:>12.1f}{str(new_rows):>6}{legacy / new:>8.1f}x'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Benchmark: compiled query analyzer vs. the previous per-call keyword scan.
+
+Run from the server directory:
+
+    python benchmarks/bench_query_analysis.py [--repeat 200]
+
+Uses the prompts in benchmarks/prompts.txt. The previous implementation is
+reproduced below, including its per-request double call of
+extract_relevant_fields.
+"""
+import argparse
+import os
+import sys
+import timeit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from chat.query_analysis import QueryAnalyzer  # noqa: E402
+
+
+def legacy_extract_relevant_fields(message):
+    field_mappings = {
+        'company_name': ['company', 'startup', 'business', 'organization', 'companies'],
+        'location': ['location', 'based in', 'from', 'in', 'where'],
+        'funding_amount': ['funding', 'raised', 'investment', 'money'],
+        'investors': ['investors', 'backed by', 'invested by', 'VC', 'VCs', 'venture capital'],
+        'industry': ['industry', 'sector', 'field', 'domain'],
+        'established_year': ['year', 'established', 'founded', 'started'],
+        'funding_stage': ['stage', 'series', 'round']
+    }
+    message = message.lower()
+    relevant_fields = set()
+    relevant_fields.add('company_name')
+    for field_name, keywords in field_mappings.items():
+        if any(keyword in message for keyword in keywords):
+            relevant_fields.add(field_name)
+    return relevant_fields
+
+
+def legacy_analyze(message):
+    def extract_custom_column(message):
+        import re
+        pattern = r'include\s+([^\s].*?)\s+as\s+([^\s].*?)(?=\.|$)'
+        match = re.search(pattern, message)
+        if match:
+            return {'content': match.group(1).strip(), 'name': match.group(2).strip()}
+        return None
+
+    def extract_location_query(message):
+        import re
+        pattern = r'(?:in|at|from)\s+([^.]+)(?=\.|$)'
+        match = re.search(pattern, message)
+        if match:
+            return match.group(1).strip()
+        return None
+
+    custom_column = extract_custom_column(message)
+    location = extract_location_query(message)
+    fields = legacy_extract_relevant_fields(message)
+    # get_response called extract_relevant_fields a second time for parsing
+    legacy_extract_relevant_fields(message)
+    return fields, location, custom_column
+
+
+def load_prompts():
+    with open(os.path.join(BENCH_DIR, 'prompts.txt')) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    prompts = load_prompts()
+    analyzer = QueryAnalyzer()
+
+    def run_legacy():
+        for prompt in prompts:
+            legacy_analyze(prompt)
+
+    def run_compiled():
+        for prompt in prompts:
+            analyzer.analyze(prompt)
+
+    legacy = timeit.timeit(run_legacy, number=args.repeat) / (args.repeat * len(prompts))
+    compiled = timeit.timeit(run_compiled, number=args.repeat) / (args.repeat * len(prompts))
+    print(f'{len(prompts)} prompts')
+    print(f'legacy:   {legacy * 1e6:8.2f} us/query')
+    print(f'compiled: {compiled * 1e6:8.2f} us/query  ({legacy / compiled:.1f}x)')
+
+    print()
+    print('Differences in detected fields and location:')
+    for prompt in prompts:
+        legacy_fields, legacy_location, _ = legacy_analyze(prompt)
+        analysis = analyzer.analyze(prompt)
+        if set(analysis.fields) != legacy_fields or analysis.location != legacy_location:
+            print(f'  {prompt}')
+            for field in sorted(legacy_fields - analysis.fields):
+                print(f'    - {field}')
+            for field in sorted(analysis.fields - legacy_fields):
+                print(f'    + {field}')
+            if analysis.location != legacy_location:
+                print(f'    location: {legacy_location!r} -> {analysis.location!r}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""Benchmark: full-text history search with FTS5 vs. icontains scans.
+
+Run from the server directory:
+
+    python benchmarks/bench_search.py [--messages 1000000] [--rows 10] [--db /tmp/bench_search.sqlite3]
+
+Fills a separate SQLite database with synthetic exchanges (questions,
+summaries and result tables of ``--rows`` companies) and indexes them like
+store_results does; the Company rows themselves are not written, search
+never reads them. Then times search_messages for queries from rare to
+common terms, with the first page of results and their snippets. The
+baseline is the ``icontains`` filter over questions and summaries that
+finding a message took before. The database is kept, so later runs with
+the same ``--db`` skip the fill.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+CITIES = [
+    'Austin', 'Berlin', 'Bangalore', 'London', 'Paris', 'Singapore', 'Toronto', 'Boston', 'Denver', 'Seattle',
+    'Munich', 'Stockholm', 'Tel Aviv', 'Lagos', 'Nairobi', 'Sao Paulo', 'Mexico City', 'Jakarta', 'Seoul', 'Sydney',
+]
+INDUSTRIES = [
+    'fintech', 'healthtech', 'edtech', 'climate tech', 'AI infrastructure', 'cybersecurity', 'logistics',
+    'e-commerce', 'biotech', 'robotics', 'gaming', 'proptech', 'insurtech', 'agritech', 'legaltech',
+]
+STAGES = ['Seed', 'Series A', 'Series B', 'Series C', 'Series D', 'Pre-IPO']
+INVESTORS = ['Sequoia', 'Accel', 'Index Ventures', 'Tiger Global', 'SoftBank', 'Lightspeed', 'a16z', 'Balderton']
+SYLLABLES = ['ra', 'zor', 'pay', 'lu', 'mi', 'kra', 'ven', 'do', 'sta', 'qi', 'fen', 'tor', 'ly', 'xo', 'bri', 'nu']
+
+
+def company_name(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+
+
+def exchange(rng, rows):
+    city, industry, stage = rng.choice(CITIES), rng.choice(INDUSTRIES), rng.choice(STAGES)
+    question = f'List {rows} {stage} {industry} startups in {city} with their investors'
+    summary = f'{rows} {industry} startups in {city} at {stage} or later, with funding and lead investors.'
+    companies = [
+        {
+            'company_name': company_name(rng),
+            'location': city,
+            'industry': industry,
+            'funding_stage': rng.choice(STAGES),
+            'funding_amount': f'${rng.randint(1, 900)}M',
+            'investors': ', '.join(rng.sample(INVESTORS, 2)),
+            'established_year': str(rng.randint(2005, 2023)),
+        }
+        for _ in range(rows)
+    ]
+    return question, summary, companies
+
+
+def fill(count, rows, seed):
+    """Write ``count`` synthetic messages with their result tables and search rows"""
+    from django.db import connection, transaction
+    from chat.models import ChatMessage, ResultSet
+    from chat.search import index_messages, optimize_index
+    from chat.storage import build_company
+
+    rng = random.Random(seed)
+    batch_size = 5000
+    started = time.perf_counter()
+    for start in range(0, count, batch_size):
+        exchanges = [exchange(rng, rows) for _ in range(min(batch_size, count - start))]
+        with transaction.atomic():
+            messages = ChatMessage.objects.bulk_create([
+                ChatMessage(user_message=question, bot_response='{}') for question, _, _ in exchanges
+            ])
+            result_sets = ResultSet.objects.bulk_create([
+                ResultSet(chat_message=message, status='success', summary=summary, row_count=rows)
+                for message, (_, summary, _) in zip(messages, exchanges)
+            ])
+            # Company rows are only indexed: search does not read them back
+            companies = [
+                [build_company(result_set, position, row) for position, row in enumerate(table)]
+                for result_set, (_, _, table) in zip(result_sets, exchanges)
+            ]
+            index_messages(zip(messages, result_sets, companies))
+        done = start + len(exchanges)
+        if done % 100000 == 0 or done == count:
+            print(f'  {done} messages written, {time.perf_counter() - started:.0f}s', flush=True)
+    optimize_index()
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def timed(function, repeat):
+    """Median and slowest of ``repeat`` runs, in milliseconds, and the last result"""
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        durations.append((time.perf_counter() - started) * 1e3)
+    return statistics.median(durations), max(durations), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--rows', type=int, default=10)
+    parser.add_argument('--db', default=os.path.join(SERVER_DIR, 'data', 'bench_search.sqlite3'))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=11)
+    args = parser.parse_args()
+
+    os.environ.update({'DJANGO_SETTINGS_MODULE': 'core.settings', 'SQLITE_PATH': args.db, 'METRICS_DIR': ''})
+    os.environ.setdefault('GROQ_API_KEY', 'benchmark')
+    import django
+    django.setup()
+    from django.core.management import call_command
+    from django.db.models import Q
+    from chat.models import ChatMessage
+    from chat.search import search_available, search_messages
+
+    call_command('migrate', verbosity=0)
+    if not search_available():
+        sys.exit('SQLite was built without FTS5')
+    existing = ChatMessage.objects.count()
+    if existing < args.messages:
+        print(f'Writing {args.messages - existing} messages to {args.db}')
+        fill(args.messages - existing, args.rows, args.seed + existing)
+    total = ChatMessage.objects.count()
+
+    rng = random.Random(args.seed)
+    rare = company_name(rng)
+    queries = [
+        ('rare company', rare),
+        ('company prefix', rare[:4] + '*'),
+        ('3 terms', 'Series B healthtech Austin'),
+        ('phrase', '"climate tech" Stockholm'),
+        ('investor', 'Balderton robotics Lagos'),
+        ('common term', 'startups'),
+    ]
+    print(f'{total} messages, median / slowest of {args.repeat} runs in ms, first page of 20')
+    print(f'{"query":<16}{"fts5":>16}{"icontains":>18}  q')
+    for label, query in queries:
+        median, slowest, result = timed(lambda: search_messages({'q': query}), args.repeat)
+        words = [word.strip('"*') for word in query.split()]
+
+        def scan():
+            queryset = ChatMessage.objects.all()
+            for word in words:
+                queryset = queryset.filter(Q(user_message__icontains=word) | Q(result_set__summary__icontains=word))
+            return list(queryset.order_by('-timestamp', '-id').values_list('id', flat=True)[:20])
+
+        scan_median, scan_slowest, _ = timed(scan, 1)
+        print(
+            f'{label:<16}{median:>8.1f} /{slowest:>6.1f}{scan_median:>10.1f} /{scan_slowest:>6.1f}  '
+            f'{query} ({len(result["results"])} results)'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Benchmark: large "list N startups" queries as one completion vs. parallel segments.
+
+Run from the server directory:
+
+    python benchmarks/bench_segments.py [--rows 20 50 100 200] [--latency 0.3] [--tokens-per-sec 500]
+
+Serves completions from a local benchmarks/fake_groq.py server, which sizes
+each completion to the row count of its system prompt and truncates it at
+max_tokens like the real API. "single" is one completion capped by
+GROQ_MAX_TOKENS, recovered by the truncation-tolerant parser; "segmented"
+is the fan-out of GroqService. Run with GROQ_MAX_CONCURRENT_CALLS and
+GROQ_SEGMENT_MAX_PARALLEL set to compare parallelism levels.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[20, 50, 100, 200])
+    parser.add_argument('--latency', type=float, default=0.3)
+    parser.add_argument('--tokens-per-sec', type=float, default=500.0)
+    args = parser.parse_args()
+
+    from benchmarks.fake_groq import make_server
+    server = make_server(port=0, latency=args.latency, tokens_per_sec=args.tokens_per_sec)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    os.environ.update({
+        'DJANGO_SETTINGS_MODULE': 'core.settings',
+        'GROQ_BASE_URL': f'http://127.0.0.1:{server.server_address[1]}',
+        'GROQ_KNOWLEDGE_ENABLED': 'False',
+        'CACHE_LOCATION': tempfile.mkdtemp(),
+        'METRICS_DIR': '',
+    })
+    os.environ.setdefault('GROQ_API_KEY', 'benchmark')
+    import django
+    django.setup()
+    from django.conf import settings
+    from chat.services import GroqService
+
+    service = GroqService()
+    print(
+        f'latency {args.latency}s, {args.tokens_per_sec:.0f} tokens/s, '
+        f'{settings.GROQ_SEGMENT_ROWS} rows per segment, '
+        f'{service.segment_parallelism(1000)} segments in parallel'
+    )
+    print(f'{"rows":>6}{"mode":>11}{"seconds":>9}{"returned":>10}{"segments":>10}{"tokens":>8}')
+    try:
+        for rows in args.rows:
+            message = f'List {rows} startups in Berlin with funding and investors'
+            for mode in ('single', 'segmented'):
+                service.segments_enabled = mode == 'segmented'
+                started = time.perf_counter()
+                response = service.get_response(message, bypass_cache=True)
+                seconds = time.perf_counter() - started
+                if response.get('status') != 'success':
+                    print(f'{rows:>6}{mode:>11}{seconds:>9.2f}  {response.get("message") or response.get("error")}')
+                    continue
+                returned = len(response['data']['data'].get('companies') or [])
+                segments = response.get('segments', {}).get('count', 1)
+                tokens = response.get('usage', {}).get('completion_tokens', 0)
+                print(f'{rows:>6}{mode:>11}{seconds:>9.2f}{returned:>10}{segments:>10}{tokens:>8}')
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
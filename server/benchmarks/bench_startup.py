@@ -0,0 +1,128 @@
+"""Benchmark: worker startup and first request, with and without warm-up.
+
+Run from the server directory:
+
+    python benchmarks/bench_startup.py [--runs 5] [--base-url https://api.groq.com]
+
+Each run is a fresh interpreter, like a new gunicorn worker. It imports
+core.wsgi or core.asgi, optionally runs the warm-up of the
+``post_worker_init`` hook, then times the first request through the app
+(``upstream_stats``, which needs the Groq service) and the first round trip
+to the upstream. Without ``--base-url`` the upstream is a local
+benchmarks/fake_groq.py server, so TLS setup is not part of the numbers;
+warm-up requests are unauthenticated and cost no quota either way.
+``--importtime`` prints the slowest imports of core.wsgi.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+# Runs in the child interpreter; prints one JSON line of timings in seconds
+CHILD = r'''
+import io, json, sys, time
+timings = {}
+started = time.perf_counter()
+module = __import__(sys.argv[1], fromlist=['application'])
+timings['import'] = time.perf_counter() - started
+
+if sys.argv[2] == 'warm':
+    from chat.startup import warm_up
+    started = time.perf_counter()
+    warm_up()
+    timings['warm_up'] = time.perf_counter() - started
+
+if sys.argv[1] == 'core.wsgi':
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': '/api/chat/messages/upstream_stats/', 'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '8000', 'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+    }
+    started = time.perf_counter()
+    body = b''.join(module.application(environ, lambda status, headers: None))
+    timings['first_request'] = time.perf_counter() - started
+else:
+    # Django's ASGI handler would need an event loop; time what the first request loads
+    from chat.startup import load_app
+    started = time.perf_counter()
+    load_app()
+    timings['first_request'] = time.perf_counter() - started
+
+from chat.services import get_groq_service
+service = get_groq_service()
+started = time.perf_counter()
+service.http_client.get(str(service.client.base_url))
+timings['first_upstream'] = time.perf_counter() - started
+print(json.dumps(timings))
+'''
+
+
+def run(module, mode, env):
+    result = subprocess.run(
+        [sys.executable, '-c', CHILD, module, mode],
+        cwd=SERVER_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def print_importtime(env, top):
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import core.wsgi, chat.urls'],
+        cwd=SERVER_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), name.rstrip()))
+    print(f'\nSlowest imports of core.wsgi and chat.urls (cumulative ms)')
+    for cumulative, name in sorted(rows, reverse=True)[:top]:
+        print(f'{cumulative / 1e3:>10.1f}  {name}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--base-url', help='upstream to connect to; a local fake server by default')
+    parser.add_argument('--importtime', type=int, default=0, metavar='N', help='show the N slowest imports')
+    args = parser.parse_args()
+
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='core.settings', METRICS_DIR='')
+    env.setdefault('GROQ_API_KEY', 'benchmark')
+    server = None
+    if args.base_url:
+        env['GROQ_BASE_URL'] = args.base_url
+    else:
+        import threading
+        from benchmarks.fake_groq import make_server
+        server = make_server(port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        env['GROQ_BASE_URL'] = f'http://127.0.0.1:{server.server_address[1]}'
+
+    phases = ['import', 'warm_up', 'first_request', 'first_upstream']
+    print(f'upstream {env["GROQ_BASE_URL"]}, median of {args.runs} runs, ms')
+    print(f'{"module":<12}{"mode":<6}' + ''.join(f'{phase:>16}' for phase in phases))
+    try:
+        for module in ('core.wsgi', 'core.asgi'):
+            for mode in ('cold', 'warm'):
+                runs = [run(module, mode, env) for _ in range(args.runs)]
+                row = f'{module:<12}{mode:<6}'
+                for phase in phases:
+                    values = [timings[phase] for timings in runs if phase in timings]
+                    row += f'{statistics.median(values) * 1e3:>16.1f}' if values else f'{"-":>16}'
+                print(row)
+        if args.importtime:
+            print_importtime(env, args.importtime)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Benchmark: payload size and serialization time of the wire formats.
+
+Run from the server directory:
+
+    python benchmarks/bench_wire_format.py [--rows 25] [--messages 50] [--repeat 50]
+
+Compares the default JSON of a send_message response and of a get_history
+page with the columnar form (``?format=columnar``), each uncompressed and
+compressed with gzip and brotli at the levels of CompressionMiddleware.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import zlib
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+
+def company(i):
+    return {
+        'company_name': f'Startup {i}',
+        'location': random.choice(['Berlin, Germany', 'Paris, France', 'London, UK']),
+        'industry': random.choice(['Fintech', 'Healthtech', 'AI', 'Climate']),
+        'funding_stage': random.choice(['Seed', 'Series A', 'Series B']),
+        'funding_amount': f'${random.randint(1, 200)}M',
+        'established_year': str(random.randint(2005, 2023)),
+        'investors': random.choice(['Sequoia, Accel', 'Index Ventures', 'Y Combinator, a16z']),
+    }
+
+
+def response(rows):
+    return {
+        'status': 'success',
+        'data': {
+            'summary': f'{rows} startups matching the query.',
+            'data': {'table_name': 'Startup Information', 'companies': [company(i) for i in range(rows)]},
+            'key_insights': [],
+        },
+    }
+
+
+def history(messages, rows):
+    """A get_history page as ChatMessageSerializer returns it"""
+    return [
+        {
+            'id': i,
+            'user_message': f'List {rows} fintech startups in Berlin',
+            'bot_response': json.dumps(response(rows)),
+            'timestamp': '2024-05-01T12:00:00Z',
+        }
+        for i in range(messages)
+    ]
+
+
+def timed(fn, repeat):
+    began = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - began) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=25, help='companies per response')
+    parser.add_argument('--messages', type=int, default=50, help='messages per history page')
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    os.environ.setdefault('GROQ_API_KEY', 'benchmark')
+    import django
+    django.setup()
+    from django.conf import settings
+    from rest_framework.renderers import JSONRenderer
+    from chat.middleware import _Compressor, brotli
+    from chat.renderers import ColumnarJSONRenderer
+
+    encodings = ['gzip'] + (['br'] if brotli is not None else [])
+    payloads = {
+        f'send_message ({args.rows} rows)': response(args.rows),
+        f'get_history ({args.messages}x{args.rows})': history(args.messages, args.rows),
+    }
+    renderers = {'json': JSONRenderer(), 'columnar': ColumnarJSONRenderer()}
+
+    print(f'gzip level {settings.API_COMPRESSION_GZIP_LEVEL}, brotli quality {settings.API_COMPRESSION_BROTLI_QUALITY}')
+    header = f'{"payload":<28}{"format":<10}{"render ms":>10}{"bytes":>10}'
+    for encoding in encodings:
+        header += f'{encoding + " bytes":>12}{encoding + " ms":>10}'
+    print(header)
+    for name, data in payloads.items():
+        for format_name, renderer in renderers.items():
+            body, render_seconds = timed(lambda: renderer.render(data), args.repeat)
+            row = f'{name:<28}{format_name:<10}{render_seconds * 1e3:>10.2f}{len(body):>10}'
+            for encoding in encodings:
+                compressed, seconds = timed(lambda: _Compressor(encoding).compress(body), args.repeat)
+                row += f'{len(compressed):>12}{seconds * 1e3:>10.2f}'
+            print(row)
+    # Make sure the compressed bodies decode to what was rendered
+    assert zlib.decompress(_Compressor('gzip').compress(b'check'), 31) == b'check'
+
+
+if __name__ == '__main__':
+    main()
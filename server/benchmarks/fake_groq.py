@@ -0,0 +1,239 @@
+"""Local stand-in for the Groq chat completions API, for load tests.
+
+Run from the server directory:
+
+    python benchmarks/fake_groq.py [--port 8090] [--latency 0.3] [--tokens-per-sec 500]
+
+and point the app at it with GROQ_BASE_URL=http://127.0.0.1:8090. Serves
+POST /openai/v1/chat/completions, streaming or not, with startup-table
+completions sized to the row count of the system prompt, or else to the
+"list N" count of the user message. Latency is
+the time to first byte; generation then takes completion tokens divided by
+tokens per second. A share of requests can fail with 500/429 or return
+malformed JSON (invalid escapes, a trailing comma, or a truncated table).
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_ROW_COUNT_RE = re.compile(r'\b(\d{1,3})\s+(?:[\w-]+\s+){0,3}?(?:startups|companies|businesses)\b', re.IGNORECASE)
+_PROMPT_ROWS_RE = re.compile(r'Return exactly (\d+) ')
+_SEGMENT_RE = re.compile(r'Only include startups (.+?)\.\n')
+
+# A token is roughly four characters of JSON output
+CHARS_PER_TOKEN = 4
+
+
+def completion_text(user_message, rows, malformed=None, system_prompt=''):
+    match = _PROMPT_ROWS_RE.search(system_prompt) or _ROW_COUNT_RE.search(user_message)
+    count = int(match.group(1)) if match else rows
+    # Segments of a fanned-out query get names of their own
+    segment = _SEGMENT_RE.search(system_prompt + '\n')
+    prefix = f'{segment.group(1)} ' if segment else ''
+    companies = [
+        {
+            'company_name': f'{prefix}Startup {i}',
+            'location': 'Berlin, Germany',
+            'industry': random.choice(['Fintech', 'Healthtech', 'AI', 'Climate']),
+            'funding_stage': random.choice(['Seed', 'Series A', 'Series B']),
+            'funding_amount': f'${random.randint(1, 200)}M',
+            'established_year': str(random.randint(2005, 2023)),
+            'investors': 'Sequoia, Accel',
+        }
+        for i in range(count)
+    ]
+    text = json.dumps({
+        'summary': f'{count} startups matching the query.',
+        'data': {'table_name': 'Startup Information', 'companies': companies},
+    })
+    if malformed == 'escape':
+        text = text.replace('company_name', 'company\\_name')
+    elif malformed == 'trailing_comma':
+        text = text.replace('}]', '},]', 1)
+    elif malformed == 'truncated':
+        text = text[:int(len(text) * 0.7)]
+    return f'```json\n{text}\n```'
+
+
+class FakeGroqHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes; with Nagle, kept-alive
+    # connections would wait for the client's delayed ACK each time
+    disable_nagle_algorithm = True
+    options = None
+    lock = threading.Lock()
+    counters = {'requests': 0, 'errors': 0, 'malformed': 0}
+
+    def log_message(self, format, *args):
+        if self.options.verbose:
+            super().log_message(format, *args)
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            with self.lock:
+                self._send_json(200, dict(self.counters))
+        else:
+            self._send_json(404, {'error': {'message': 'Not found'}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': {'message': 'Invalid JSON body'}})
+            return
+        if self.path.rstrip('/') != '/openai/v1/chat/completions':
+            self._send_json(404, {'error': {'message': 'Not found'}})
+            return
+
+        options = self.options
+        self._count('requests')
+        time.sleep(options.latency)
+
+        roll = random.random()
+        if roll < options.error_rate:
+            self._count('errors')
+            if random.random() < 0.5:
+                self._send_json(429, {'error': {'message': 'Rate limit reached'}}, {'Retry-After': '1'})
+            else:
+                self._send_json(500, {'error': {'message': 'Internal server error'}})
+            return
+
+        malformed = None
+        if roll < options.error_rate + options.malformed_rate:
+            self._count('malformed')
+            malformed = random.choice(['escape', 'trailing_comma', 'truncated'])
+
+        messages = request.get('messages') or []
+        user_message = next((m.get('content', '') for m in reversed(messages) if m.get('role') == 'user'), '')
+        prompt_tokens = sum(len(m.get('content', '')) for m in messages) // CHARS_PER_TOKEN
+        system_prompt = next((m.get('content', '') for m in messages if m.get('role') == 'system'), '')
+        text = completion_text(user_message, options.rows, malformed, system_prompt)
+        max_chars = (request.get('max_tokens') or 4096) * CHARS_PER_TOKEN
+        finish_reason = 'stop'
+        if len(text) > max_chars:
+            text, finish_reason = text[:max_chars], 'length'
+        completion_tokens = max(len(text) // CHARS_PER_TOKEN, 1)
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+        }
+        completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+        model = request.get('model', 'fake-model')
+
+        if request.get('stream'):
+            self._stream(text, completion_id, model, usage, finish_reason)
+            return
+
+        time.sleep(completion_tokens / options.tokens_per_sec)
+        self._send_json(200, {
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': text},
+                'finish_reason': finish_reason,
+            }],
+            'usage': usage,
+        })
+
+    def _stream(self, text, completion_id, model, usage, finish_reason):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def write(payload):
+            data = f'data: {payload}\n\n'.encode('utf-8')
+            self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+            self.wfile.flush()
+
+        def chunk(delta, finish=None, x_groq=None):
+            payload = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish}],
+            }
+            if x_groq:
+                payload['x_groq'] = x_groq
+            return json.dumps(payload)
+
+        # Send about ten tokens per event
+        step = CHARS_PER_TOKEN * 10
+        delay = 10 / self.options.tokens_per_sec
+        write(chunk({'role': 'assistant', 'content': ''}))
+        for start in range(0, len(text), step):
+            time.sleep(delay)
+            write(chunk({'content': text[start:start + step]}))
+        write(chunk({}, finish_reason, {'id': completion_id, 'usage': usage}))
+        write('[DONE]')
+        self.wfile.write(b'0\r\n\r\n')
+
+
+def make_server(host='127.0.0.1', port=8090, **options):
+    """Build a fake Groq server; options are the command line flags"""
+    defaults = vars(build_parser().parse_args([]))
+    defaults.update(options)
+    handler = type('Handler', (FakeGroqHandler,), {
+        'options': argparse.Namespace(**defaults),
+        'lock': threading.Lock(),
+        'counters': {'requests': 0, 'errors': 0, 'malformed': 0},
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency', type=float, default=0.3, help='seconds before the first byte')
+    parser.add_argument('--tokens-per-sec', type=float, default=500.0)
+    parser.add_argument('--rows', type=int, default=10, help='companies when the message has no count')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of 500/429 responses')
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='share of malformed JSON completions')
+    parser.add_argument('--verbose', action='store_true')
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    server = make_server(**vars(args))
+    print(f'Fake Groq API on http://{args.host}:{server.server_address[1]}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
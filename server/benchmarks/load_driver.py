@@ -0,0 +1,187 @@
+"""Load driver for send_message and get_history.
+
+Run from the server directory:
+
+    python benchmarks/load_driver.py [--workers 1,3] [--concurrency 1,8,32] [--requests 200]
+
+Without --url, a fake Groq server (benchmarks/fake_groq.py) and a gunicorn
+server per --workers value are started on free ports, with a temporary
+SQLite database and cache, so no Groq quota is used. With --url, an
+already running server is measured and --workers is ignored. Reports
+requests/s and p50/p95/p99 latency per endpoint and concurrency.
+"""
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_groq import make_server  # noqa: E402
+
+CITIES = ['Berlin', 'Paris', 'London', 'Bangalore', 'Singapore', 'Austin', 'Toronto', 'Stockholm']
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def wait_for(url, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} did not come up within {timeout:.0f}s')
+
+
+def start_app(workers, port, groq_url, directory, args):
+    """Start gunicorn against the fake Groq server with throwaway storage"""
+    env = dict(
+        os.environ,
+        GROQ_API_KEY=os.getenv('GROQ_API_KEY', 'fake-key'),
+        GROQ_BASE_URL=groq_url,
+        SQLITE_PATH=os.path.join(directory, f'db-{workers}.sqlite3'),
+        CACHE_LOCATION=os.path.join(directory, f'cache-{workers}'),
+        METRICS_DIR=os.path.join(directory, f'metrics-{workers}'),
+        DJANGO_SETTINGS_MODULE='core.settings',
+    )
+    subprocess.run([sys.executable, 'manage.py', 'migrate', '--noinput', '-v', '0'], cwd=SERVER_DIR, env=env, check=True)
+    command = [
+        'gunicorn', 'core.wsgi:application', '--config', 'gunicorn.conf.py',
+        '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+        '--threads', str(args.threads), '--log-level', 'warning',
+    ]
+    return subprocess.Popen(command, cwd=SERVER_DIR, env=env, stdout=subprocess.DEVNULL)
+
+
+def send_message(client, base_url, index, args):
+    city = CITIES[index % len(CITIES)]
+    return client.post(f'{base_url}/api/chat/messages/send_message/', json={
+        'message': f'List {args.rows} fintech startups in {city} with funding and investors',
+        'bypass_cache': args.bypass_cache,
+    })
+
+
+def get_history(client, base_url, index, args):
+    return client.get(f'{base_url}/api/chat/messages/get_history/', params={'limit': 50, 'summary': 1})
+
+
+ENDPOINTS = {'send_message': send_message, 'get_history': get_history}
+
+
+def run(base_url, endpoint, concurrency, args):
+    """Fire args.requests requests with concurrency threads; returns the latencies and stats"""
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    local = threading.local()
+
+    def one(index):
+        nonlocal errors
+        if not hasattr(local, 'client'):
+            local.client = httpx.Client(timeout=args.timeout)
+        began = time.perf_counter()
+        try:
+            response = ENDPOINTS[endpoint](local.client, base_url, index, args)
+            ok = response.status_code < 400 and (endpoint != 'send_message' or 'error' not in response.json())
+        except (httpx.HTTPError, ValueError):
+            ok = False
+        elapsed = time.perf_counter() - began
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(args.requests)))
+    return latencies, errors, time.perf_counter() - began
+
+
+def report(workers, base_url, args):
+    for endpoint in args.endpoints:
+        for concurrency in args.concurrency:
+            latencies, errors, elapsed = run(base_url, endpoint, concurrency, args)
+            print(
+                f'{workers:>8}{endpoint:>14}{concurrency:>6}{len(latencies) / elapsed:>10.1f}'
+                f'{percentile(latencies, 0.50) * 1e3:>9.1f}{percentile(latencies, 0.95) * 1e3:>9.1f}'
+                f'{percentile(latencies, 0.99) * 1e3:>9.1f}{errors:>8}',
+                flush=True,
+            )
+
+
+def int_list(value):
+    return [int(item) for item in value.split(',') if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='measure an already running server instead')
+    parser.add_argument('--workers', type=int_list, default=[1, 3], help='gunicorn workers, comma separated')
+    parser.add_argument('--threads', type=int, default=1, help='gunicorn threads per worker')
+    parser.add_argument('--concurrency', type=int_list, default=[1, 8, 32], help='client concurrency, comma separated')
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint and concurrency')
+    parser.add_argument('--endpoints', type=lambda value: value.split(','), default=list(ENDPOINTS))
+    parser.add_argument('--rows', type=int, default=10, help='companies asked for per message')
+    parser.add_argument('--bypass-cache', action='store_true', help='skip the response cache')
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--latency', type=float, default=0.3, help='fake Groq time to first byte')
+    parser.add_argument('--tokens-per-sec', type=float, default=500.0, help='fake Groq generation speed')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--malformed-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    header = f'{"workers":>8}{"endpoint":>14}{"conc":>6}{"req/s":>10}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"errors":>8}'
+    if args.url:
+        print(header)
+        report('-', args.url.rstrip('/'), args)
+        return
+
+    groq = make_server(
+        port=free_port(), latency=args.latency, tokens_per_sec=args.tokens_per_sec,
+        error_rate=args.error_rate, malformed_rate=args.malformed_rate,
+    )
+    threading.Thread(target=groq.serve_forever, daemon=True).start()
+    groq_url = f'http://127.0.0.1:{groq.server_address[1]}'
+
+    directory = tempfile.mkdtemp(prefix='load-driver-')
+    print(header)
+    try:
+        for workers in args.workers:
+            port = free_port()
+            app = start_app(workers, port, groq_url, directory, args)
+            try:
+                wait_for(f'http://127.0.0.1:{port}/api/chat/messages/get_history/?limit=1')
+                report(workers, f'http://127.0.0.1:{port}', args)
+            finally:
+                app.terminate()
+                app.wait(timeout=30)
+    finally:
+        groq.shutdown()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
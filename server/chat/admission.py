@@ -0,0 +1,461 @@
+import math
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+from .locks import worker_lock
+from .metrics import metrics
+
+
+class Overloaded(Exception):
+    """The upstream call was refused before it was made; answered with 503"""
+
+    status_code = 503
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class RateLimited(Overloaded):
+    """The shared Groq quota is used up; answered with 429"""
+
+    status_code = 429
+
+
+class CircuitOpen(Overloaded):
+    """Groq is failing or too slow and calls are paused"""
+
+
+class ConcurrencyLimiter:
+    """Cap on concurrent upstream calls per worker, with a bounded wait queue.
+
+    Callers beyond ``max_concurrent`` wait for a slot, but at most
+    ``max_queue`` of them and for at most ``max_wait`` seconds, so a hung
+    upstream cannot take every thread of the worker and cheap endpoints keep
+    being served. Sync callers wait on a condition; async callers poll,
+    like SingleFlight followers.
+    """
+
+    def __init__(self, max_concurrent, max_queue, max_wait, poll_interval=0.05):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+        self._condition = threading.Condition()
+        self.in_flight = 0
+        self.queued = 0
+
+    def _reject(self, reason):
+        metrics.inc('chat_admission_rejections_total', reason=reason)
+        return Overloaded('Too many requests to the AI service are in progress', self.max_wait)
+
+    def _try_enter(self):
+        if self.in_flight < self.max_concurrent:
+            self.in_flight += 1
+            return True
+        return False
+
+    def _enqueue(self):
+        if self.queued >= self.max_queue:
+            raise self._reject('queue_full')
+        self.queued += 1
+
+    def check(self):
+        """Raise Overloaded if a new call would be refused right now"""
+        with self._condition:
+            if self.in_flight >= self.max_concurrent and self.queued >= self.max_queue:
+                raise self._reject('queue_full')
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def acquire(self, timeout):
+        with self._condition:
+            if self._try_enter():
+                return
+            self._enqueue()
+            try:
+                expires_at = time.monotonic() + min(self.max_wait, timeout)
+                while not self._try_enter():
+                    remaining = expires_at - time.monotonic()
+                    if remaining <= 0:
+                        raise self._reject('queue_timeout')
+                    self._condition.wait(remaining)
+            finally:
+                self.queued -= 1
+
+    async def aacquire(self, timeout):
+        with self._condition:
+            if self._try_enter():
+                return
+            self._enqueue()
+        try:
+            expires_at = time.monotonic() + min(self.max_wait, timeout)
+            while True:
+                with self._condition:
+                    if self._try_enter():
+                        return
+                if time.monotonic() >= expires_at:
+                    raise self._reject('queue_timeout')
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            with self._condition:
+                self.queued -= 1
+
+
+class CircuitBreaker:
+    """Stops calling Groq while it fails or is too slow.
+
+    Outcomes of the last ``window`` seconds are kept per worker. Once there
+    are ``min_calls`` of them and the share of errors or of calls slower
+    than ``slow_call_seconds`` reaches its threshold, the circuit opens and
+    calls are refused for ``open_seconds``. It then half-opens: up to
+    ``half_open_calls`` probes go through, and the first outcome decides
+    whether it closes again or stays open for another period.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, window, min_calls, error_rate, slow_call_seconds, slow_call_rate,
+                 open_seconds, half_open_calls):
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self._lock = threading.Lock()
+        self._outcomes = deque()
+        self.state = self.CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+
+    def _trim(self, now):
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            self._outcomes.popleft()
+
+    def _open(self, now):
+        self.state = self.OPEN
+        self._opened_at = now
+        self._outcomes.clear()
+        metrics.inc('chat_circuit_transitions_total', state=self.OPEN)
+        print("Circuit breaker opened; pausing Groq calls")
+
+    def before_call(self):
+        """Raise CircuitOpen unless a call may go through now"""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self._opened_at + self.open_seconds - now
+                if remaining > 0:
+                    metrics.inc('chat_admission_rejections_total', reason='circuit_open')
+                    raise CircuitOpen('The AI service is unavailable right now', remaining)
+                self.state = self.HALF_OPEN
+                self._probes = 0
+                metrics.inc('chat_circuit_transitions_total', state=self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    metrics.inc('chat_admission_rejections_total', reason='circuit_open')
+                    raise CircuitOpen('The AI service is recovering', self.open_seconds)
+                self._probes += 1
+
+    def check(self):
+        """Raise CircuitOpen while the circuit is open, without taking a probe"""
+        with self._lock:
+            remaining = self._opened_at + self.open_seconds - time.monotonic()
+            if self.state == self.OPEN and remaining > 0:
+                metrics.inc('chat_admission_rejections_total', reason='circuit_open')
+                raise CircuitOpen('The AI service is unavailable right now', remaining)
+
+    def release_probe(self):
+        """Give back a half-open probe that was not used"""
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._probes:
+                self._probes -= 1
+
+    def record(self, failed, duration):
+        """Record the outcome of one upstream attempt"""
+        now = time.monotonic()
+        slow = duration >= self.slow_call_seconds
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                if failed or slow:
+                    self._open(now)
+                else:
+                    self.state = self.CLOSED
+                    metrics.inc('chat_circuit_transitions_total', state=self.CLOSED)
+                return
+            if self.state == self.OPEN:
+                # A call admitted before the circuit opened
+                return
+            self._outcomes.append((now, failed, slow))
+            self._trim(now)
+            calls = len(self._outcomes)
+            if calls < self.min_calls:
+                return
+            errors = sum(1 for _, outcome_failed, _ in self._outcomes if outcome_failed)
+            slow_calls = sum(1 for _, _, outcome_slow in self._outcomes if outcome_slow)
+            if errors / calls >= self.error_rate or slow_calls / calls >= self.slow_call_rate:
+                self._open(now)
+
+    def stats(self):
+        with self._lock:
+            self._trim(time.monotonic())
+            calls = len(self._outcomes)
+            errors = sum(1 for _, failed, _ in self._outcomes if failed)
+            slow_calls = sum(1 for _, _, slow in self._outcomes if slow)
+            return {
+                'state': self.state,
+                'calls': calls,
+                'error_rate': errors / calls if calls else 0.0,
+                'slow_call_rate': slow_calls / calls if calls else 0.0,
+            }
+
+
+class TokenBucket:
+    """Token bucket shared by all workers through Django's cache framework.
+
+    Refills at ``rate_per_minute`` and holds up to ``burst_seconds`` worth
+    of tokens. The bucket state is updated under a short worker lock (see
+    locks.worker_lock), so updates from different workers never interleave
+    on any cache backend. Cache errors and a lock that cannot be taken
+    quickly admit the call: the quota only exists to stay below Groq's own
+    limits.
+    """
+
+    def __init__(self, name, rate_per_minute, burst_seconds, alias=None, lock_timeout=2, lock_wait=0.1):
+        self.cache = caches[alias or getattr(settings, 'GROQ_CACHE_ALIAS', 'default')]
+        self.name = name
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(self.rate * burst_seconds, 1.0)
+        self.lock_timeout = lock_timeout
+        self.lock_wait = lock_wait
+
+    def _state_key(self):
+        return f'ratelimit:{self.name}'
+
+    @contextmanager
+    def _locked(self):
+        lock = worker_lock(self.cache, f'ratelimit:{self.name}', self.lock_timeout)
+        expires_at = time.monotonic() + self.lock_wait
+        while not lock.acquire():
+            if time.monotonic() >= expires_at:
+                yield False
+                return
+            time.sleep(0.005)
+        try:
+            yield True
+        finally:
+            lock.release()
+
+    def _update(self, change):
+        """Apply change(tokens) -> (tokens, result) to the refilled bucket"""
+        try:
+            with self._locked() as locked:
+                if not locked:
+                    return None
+                now = time.time()
+                tokens, updated = self.cache.get(self._state_key()) or (self.capacity, now)
+                tokens = min(self.capacity, tokens + max(now - updated, 0) * self.rate)
+                tokens, result = change(tokens)
+                self.cache.set(self._state_key(), (tokens, now), timeout=None)
+                return result
+        except Exception as e:
+            print(f"Error updating the {self.name} rate limit: {str(e)}")
+            return None
+
+    def take(self, cost):
+        """Take cost tokens; returns 0 when taken, else the seconds until they refill"""
+        # A call costing more than the bucket holds waits for a full bucket
+        cost = min(cost, self.capacity)
+
+        def change(tokens):
+            if tokens >= cost:
+                return tokens - cost, 0.0
+            return tokens, (cost - tokens) / self.rate
+
+        return self._update(change) or 0.0
+
+    def refund(self, cost):
+        self._update(lambda tokens: (min(self.capacity, tokens + cost), None))
+
+    def level(self):
+        state = self.cache.get(self._state_key())
+        if state is None:
+            return self.capacity
+        tokens, updated = state
+        return min(self.capacity, tokens + max(time.time() - updated, 0) * self.rate)
+
+
+class AdmissionController:
+    """Decides whether an upstream LLM call may be made, and when.
+
+    Every call holds a slot of the ConcurrencyLimiter for its whole
+    duration, retries included. Every attempt must pass the CircuitBreaker
+    and take its cost from the shared request and token quotas; a quota
+    that refills soon enough is waited for, otherwise the call is refused
+    with RateLimited. Refusals are Overloaded errors carrying the seconds
+    after which a retry makes sense.
+    """
+
+    def __init__(self, max_concurrent=None, max_queue=None, max_wait=None, breaker_enabled=None,
+                 requests_per_minute=None, tokens_per_minute=None, burst_seconds=None):
+        self.limiter = ConcurrencyLimiter(
+            max_concurrent or getattr(settings, 'GROQ_MAX_CONCURRENT_CALLS', 4),
+            getattr(settings, 'GROQ_ADMISSION_MAX_QUEUE', 4) if max_queue is None else max_queue,
+            getattr(settings, 'GROQ_ADMISSION_MAX_WAIT', 5.0) if max_wait is None else max_wait,
+        )
+        self.breaker_enabled = (
+            getattr(settings, 'GROQ_BREAKER_ENABLED', True) if breaker_enabled is None else breaker_enabled
+        )
+        self.breaker = CircuitBreaker(
+            window=getattr(settings, 'GROQ_BREAKER_WINDOW', 60),
+            min_calls=getattr(settings, 'GROQ_BREAKER_MIN_CALLS', 10),
+            error_rate=getattr(settings, 'GROQ_BREAKER_ERROR_RATE', 0.5),
+            slow_call_seconds=getattr(settings, 'GROQ_BREAKER_SLOW_CALL_SECONDS', 30),
+            slow_call_rate=getattr(settings, 'GROQ_BREAKER_SLOW_CALL_RATE', 0.5),
+            open_seconds=getattr(settings, 'GROQ_BREAKER_OPEN_SECONDS', 30),
+            half_open_calls=getattr(settings, 'GROQ_BREAKER_HALF_OPEN_CALLS', 1),
+        )
+        requests_per_minute = (
+            getattr(settings, 'GROQ_RATE_LIMIT_RPM', 0) if requests_per_minute is None else requests_per_minute
+        )
+        tokens_per_minute = (
+            getattr(settings, 'GROQ_RATE_LIMIT_TPM', 0) if tokens_per_minute is None else tokens_per_minute
+        )
+        burst_seconds = burst_seconds or getattr(settings, 'GROQ_RATE_LIMIT_BURST_SECONDS', 10)
+        # A rate of 0 turns a quota off
+        self.request_quota = TokenBucket('requests', requests_per_minute, burst_seconds) if requests_per_minute else None
+        self.token_quota = TokenBucket('tokens', tokens_per_minute, burst_seconds) if tokens_per_minute else None
+        self._lock = threading.Lock()
+        self.rejected = 0
+        metrics.gauge('chat_upstream_in_flight', lambda: self.limiter.in_flight)
+        metrics.gauge('chat_upstream_queued', lambda: self.limiter.queued)
+        metrics.gauge('chat_circuit_open', lambda: int(self.breaker.state == CircuitBreaker.OPEN))
+
+    def check(self):
+        """Raise Overloaded if a call would be refused right away, e.g. before opening a stream"""
+        try:
+            if self.breaker_enabled:
+                self.breaker.check()
+            self.limiter.check()
+        except Overloaded:
+            self._count_rejection()
+            raise
+
+    def _count_rejection(self):
+        with self._lock:
+            self.rejected += 1
+
+    @contextmanager
+    def slot(self, deadline):
+        try:
+            self.limiter.acquire(deadline.remaining())
+        except Overloaded:
+            self._count_rejection()
+            raise
+        try:
+            yield
+        finally:
+            self.limiter.release()
+
+    @asynccontextmanager
+    async def aslot(self, deadline):
+        try:
+            await self.limiter.aacquire(deadline.remaining())
+        except Overloaded:
+            self._count_rejection()
+            raise
+        try:
+            yield
+        finally:
+            self.limiter.release()
+
+    def _take_quota(self, tokens):
+        """Take one request and the tokens; returns the seconds to wait, 0 when taken"""
+        if self.request_quota:
+            wait = self.request_quota.take(1)
+            if wait:
+                return wait
+        if self.token_quota and tokens:
+            wait = self.token_quota.take(tokens)
+            if wait:
+                if self.request_quota:
+                    self.request_quota.refund(1)
+                return wait
+        return 0.0
+
+    def _quota_wait(self, wait, deadline):
+        """Raise RateLimited unless waiting for the quota fits in the budget"""
+        if wait > min(self.limiter.max_wait, deadline.remaining() * 0.5):
+            self._count_rejection()
+            metrics.inc('chat_admission_rejections_total', reason='rate_limit')
+            raise RateLimited('The AI service quota is used up', wait)
+
+    def before_attempt(self, deadline, tokens=0):
+        """Block until an attempt may be made, or raise Overloaded"""
+        while True:
+            if self.breaker_enabled:
+                try:
+                    self.breaker.before_call()
+                except Overloaded:
+                    self._count_rejection()
+                    raise
+            wait = self._take_quota(tokens)
+            if not wait:
+                return
+            # The attempt is not made now, whether it waits or is refused, so a
+            # half-open probe goes back before _quota_wait can raise
+            self.breaker.release_probe()
+            self._quota_wait(wait, deadline)
+            time.sleep(wait)
+
+    async def abefore_attempt(self, deadline, tokens=0):
+        """Async counterpart of before_attempt"""
+        while True:
+            if self.breaker_enabled:
+                try:
+                    self.breaker.before_call()
+                except Overloaded:
+                    self._count_rejection()
+                    raise
+            wait = await sync_to_async(self._take_quota, thread_sensitive=False)(tokens)
+            if not wait:
+                return
+            # The attempt is not made now, whether it waits or is refused, so a
+            # half-open probe goes back before _quota_wait can raise
+            self.breaker.release_probe()
+            self._quota_wait(wait, deadline)
+            await asyncio.sleep(wait)
+
+    def try_extra(self, tokens=0):
+        """Take quota for a hedged request without waiting"""
+        if self.breaker_enabled and self.breaker.state != CircuitBreaker.CLOSED:
+            return False
+        return not self._take_quota(tokens)
+
+    def record(self, failed, duration):
+        if self.breaker_enabled:
+            self.breaker.record(failed, duration)
+
+    def stats(self):
+        with self._lock:
+            rejected = self.rejected
+        return {
+            'in_flight': self.limiter.in_flight,
+            'queued': self.limiter.queued,
+            'max_concurrent': self.limiter.max_concurrent,
+            'rejected': rejected,
+            'circuit': self.breaker.stats() if self.breaker_enabled else None,
+            'request_quota': self.request_quota.level() if self.request_quota else None,
+            'token_quota': self.token_quota.level() if self.token_quota else None,
+        }
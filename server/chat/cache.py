@@ -0,0 +1,78 @@
+import re
+import json
+import hashlib
+from django.conf import settings
+from django.core.cache import caches
+from .metrics import metrics
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def canonical_query(message):
+    """Lowercase a query and collapse its whitespace"""
+    return _WHITESPACE_RE.sub(' ', message.lower()).strip()
+
+
+def make_cache_key(message, location, fields, custom_column, previous_message=None):
+    """Build a stable key from the canonical query and its resolved parameters"""
+    payload = {
+        'query': canonical_query(message),
+        'location': canonical_query(location) if location else None,
+        'fields': sorted(fields),
+        'custom_column': custom_column,
+    }
+    if previous_message is not None:
+        # Enrichments depend on the table they extend
+        payload['previous_message'] = previous_message
+    payload = json.dumps(payload, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Response cache with per-entry TTL on top of Django's cache framework.
+
+    Entries live in the configured cache backend, so every gunicorn worker
+    sees the same data. A hit pushes the expiry of its entry back by the
+    TTL, so responses in use stay cached while the others expire; the
+    backend culls entries past its own MAX_ENTRIES. Hit and miss counters
+    are kept in process and merged across workers by the metrics module.
+    """
+
+    def __init__(self, alias=None, timeout=None, prefix='groq'):
+        self.cache = caches[alias or getattr(settings, 'GROQ_CACHE_ALIAS', 'default')]
+        self.timeout = timeout or getattr(settings, 'GROQ_CACHE_TTL', 3600)
+        self.prefix = prefix
+
+    def _entry_key(self, key):
+        return f'{self.prefix}:entry:{key}'
+
+    def get(self, key):
+        """Return the cached response for a key, or None on a miss"""
+        entry_key = self._entry_key(key)
+        value = self.cache.get(entry_key)
+        if value is None:
+            metrics.inc('groq_cache_misses_total')
+            return None
+        metrics.inc('groq_cache_hits_total')
+        self.cache.touch(entry_key, self.timeout)
+        return value
+
+    def set(self, key, value):
+        """Store a response under a key"""
+        self.cache.set(self._entry_key(key), value, timeout=self.timeout)
+
+    def delete(self, key):
+        """Drop a single cached response"""
+        self.cache.delete(self._entry_key(key))
+
+    def stats(self):
+        """Return the hit/miss counters of all workers"""
+        hits = metrics.total('groq_cache_hits_total')
+        misses = metrics.total('groq_cache_misses_total')
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / lookups if lookups else 0.0,
+            'ttl': self.timeout,
+        }
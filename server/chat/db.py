@@ -0,0 +1,15 @@
+from django.conf import settings
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """Apply the SQLite performance pragmas to a new connection.
+
+    Connected to ``connection_created`` in ChatConfig.ready(). WAL lets
+    readers run alongside the single writer, and ``synchronous=NORMAL`` is
+    safe in WAL mode while skipping an fsync per transaction.
+    """
+    if connection.vendor != 'sqlite' or not getattr(settings, 'SQLITE_TUNING', True):
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
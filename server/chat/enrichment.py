@@ -0,0 +1,120 @@
+import copy
+import json
+from .knowledge import normalize_company_name, query_constraints
+from .models import ResultSet
+from .prompts import render_enrichment_prompt
+from .query_analysis import analyze_query
+
+# Output tokens budgeted per company for a name -> value pair, plus the JSON frame
+TOKENS_PER_COMPANY = 40
+BASE_TOKENS = 64
+MAX_TOKENS = 4096
+
+
+def has_query_content(message):
+    """Whether a message asks for companies of its own, besides its custom column.
+
+    "Include CEO as CEO Name" only adds a column to the table before it,
+    while "AI startups in Berlin, include CEO as CEO Name" is a new query
+    (it has a location, an industry or a row count).
+    """
+    analysis = analyze_query(message)
+    if analysis.location or analysis.row_count:
+        return True
+    constraints = query_constraints(message, analysis)
+    return constraints is None or any(constraints)
+
+
+def previous_exchange(message_id=None):
+    """The (chat_message_id, response) to enrich.
+
+    This is the given message, or the latest one with a non-empty result
+    table when no message is given, which only a follow-up without query
+    content of its own may refer to. Returns None when there is nothing to
+    enrich.
+    """
+    queryset = ResultSet.objects.filter(status='success', row_count__gt=0).select_related('chat_message')
+    if message_id is not None:
+        queryset = queryset.filter(chat_message_id=message_id)
+    result_set = queryset.order_by('-created_at', '-id').first()
+    if result_set is None:
+        return None
+    try:
+        response = json.loads(result_set.chat_message.bot_response)
+    except ValueError:
+        return None
+    return result_set.chat_message_id, response
+
+
+class Enrichment:
+    """Adds a single custom column to the table of a previous response.
+
+    Only the company names are sent and only ``{name: value}`` pairs come
+    back, so the model no longer regenerates the existing table. The values
+    are merged into a copy of the previous response on the server.
+    """
+
+    def __init__(self, message_id, response, column):
+        self.message_id = message_id
+        self.response = response
+        self.column = column
+
+    @classmethod
+    def for_column(cls, column, message_id=None):
+        """Build an enrichment of the previous table, or None if there is none"""
+        exchange = previous_exchange(message_id)
+        if exchange is None:
+            return None
+        enrichment = cls(exchange[0], exchange[1], column)
+        return enrichment if enrichment.companies else None
+
+    @property
+    def rows(self):
+        data = self.response.get('data') if isinstance(self.response, dict) else None
+        table = data.get('data') if isinstance(data, dict) else None
+        companies = table.get('companies') if isinstance(table, dict) else None
+        return [row for row in companies or [] if isinstance(row, dict)]
+
+    @property
+    def companies(self):
+        return [row['company_name'] for row in self.rows if row.get('company_name')]
+
+    def build_prompt(self):
+        """System prompt asking only for the new column's values"""
+        return render_enrichment_prompt(self.column['content'], self.companies)
+
+    def build_messages(self, user_message):
+        return [
+            {
+                "role": "system",
+                "content": self.build_prompt()
+            },
+            {
+                "role": "user",
+                "content": user_message
+            }
+        ]
+
+    def max_tokens(self):
+        """Output budget scaled to the number of values requested"""
+        return min(BASE_TOKENS + TOKENS_PER_COMPANY * len(self.companies), MAX_TOKENS)
+
+    def merge(self, values, format_value=str):
+        """Return the previous response with the new column filled in"""
+        if not isinstance(values, dict):
+            values = {}
+        by_name = {normalize_company_name(name): value for name, value in values.items()}
+
+        response = copy.deepcopy(self.response)
+        table = response['data']['data']
+        column = self.column['name']
+        for row in table['companies']:
+            if not isinstance(row, dict):
+                continue
+            value = by_name.get(normalize_company_name(row.get('company_name', '')))
+            row[column] = format_value(value) if value is not None else 'N/A'
+
+        response['status'] = 'success'
+        response.pop('source', None)
+        response['enriched_from'] = self.message_id
+        return response
@@ -0,0 +1,200 @@
+import re
+import unicodedata
+from django.conf import settings
+
+# Legal forms, dropped from the end of a name
+LEGAL_SUFFIXES = {
+    'inc', 'incorporated', 'ltd', 'limited', 'llc', 'llp', 'pvt', 'private', 'corp', 'corporation',
+    'co', 'gmbh', 'plc', 'sa', 'sas', 'srl', 'ag', 'bv', 'nv', 'oy', 'ab', 'pte', 'pty', 'kk',
+}
+# Generic words that trail a brand name, dropped from the end as well
+DESCRIPTOR_SUFFIXES = {
+    'software', 'technologies', 'technology', 'solutions', 'systems', 'labs', 'services',
+    'group', 'holdings', 'international', 'enterprises', 'company', 'industries',
+}
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+_APOSTROPHE_RE = re.compile(r"['’`]")
+
+NGRAM_SIZE = 3
+# Names this short only match exactly; their n-grams say too little
+MIN_FUZZY_LENGTH = 4
+
+
+def canonical_tokens(name):
+    """Words of a company name without accents, punctuation, legal forms or generic suffixes"""
+    text = unicodedata.normalize('NFKD', str(name or '')).encode('ascii', 'ignore').decode('ascii').lower()
+    text = _APOSTROPHE_RE.sub('', text.replace('&', ' and '))
+    tokens = _TOKEN_RE.findall(text)
+    if len(tokens) > 1 and tokens[0] == 'the':
+        tokens = tokens[1:]
+    while len(tokens) > 1 and (tokens[-1] in LEGAL_SUFFIXES or tokens[-1] in DESCRIPTOR_SUFFIXES):
+        tokens.pop()
+    return tokens
+
+
+def canonical_name(name):
+    """Canonical form of a company name, e.g. "Razorpay Software Pvt. Ltd." -> "razorpay" """
+    return ' '.join(canonical_tokens(name))
+
+
+def ngrams(text, size=NGRAM_SIZE):
+    """Character n-grams of a canonical name, spaces removed and ends padded"""
+    padded = f'#{text.replace(" ", "")}#'
+    if len(padded) <= size:
+        return frozenset([padded])
+    return frozenset(padded[index:index + size] for index in range(len(padded) - size + 1))
+
+
+def edit_distance(first, second, limit):
+    """Edits (insertions, deletions, substitutions, swaps of neighbours) between two strings.
+
+    Stops early and returns ``limit + 1`` once the distance exceeds ``limit``.
+    """
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+    before, previous = None, list(range(len(second) + 1))
+    for i in range(1, len(first) + 1):
+        current = [i] + [0] * len(second)
+        for j in range(1, len(second) + 1):
+            cost = first[i - 1] != second[j - 1]
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if before is not None and j > 1 and first[i - 1] == second[j - 2] and first[i - 2] == second[j - 1]:
+                value = min(value, before[j - 2] + 1)
+            current[j] = value
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+def segments(length, edits):
+    """``(start, size)`` of the ``edits + 1`` parts a name of ``length`` characters is cut into"""
+    parts = edits + 1
+    bounds = [length * index // parts for index in range(parts + 1)]
+    return [(bounds[index], bounds[index + 1] - bounds[index]) for index in range(parts)]
+
+
+def swapped(text, positions):
+    """``text`` and its variants with the characters at each position and the next one swapped"""
+    yield text
+    for index in sorted(positions):
+        if 0 <= index < len(text) - 1 and text[index] != text[index + 1]:
+            yield text[:index] + text[index + 1] + text[index] + text[index + 2:]
+
+
+class EntityResolver:
+    """Resolve company name variants to one entity key.
+
+    Names are first compared on their canonical form with spaces removed,
+    so "Razorpay", "razorpay" and "Razorpay Software Pvt Ltd" are one
+    entity without any scoring. Other names match when their edit
+    similarity, ``1 - edits / length``, reaches the threshold, with at most
+    ``(1 - threshold) * length`` edits for a name of ``length`` characters.
+    That catches typos such as "Razorpya" or "Freshwork" while short names,
+    where one letter makes another company, only match exactly.
+
+    Candidates come from a blocking index of name segments. A name that
+    can be ``k`` edits away from a match is cut into ``k + 1`` parts,
+    indexed by name length, part number and text. An insertion, deletion
+    or substitution breaks at most one part, so every match contains one
+    of them unchanged, shifted by at most ``k`` characters. A swap of
+    neighbours across a part boundary breaks two, so the query is also
+    probed with the neighbours around each boundary swapped back; that
+    keeps the lookup exact up to two edits. A lookup probes a few keys instead of scanning names, and the
+    candidates it finds are checked against their character trigram
+    overlap before the edit distance is computed.
+
+    Not thread-safe; callers serialize access.
+    """
+
+    def __init__(self, threshold=None):
+        self.threshold = threshold or getattr(settings, 'GROQ_ENTITY_MATCH_THRESHOLD', 0.85)
+        self._exact = {}
+        self._keys = []
+        self._names = []
+        self._grams = []
+        self._blocks = {}
+
+    def __len__(self):
+        return len(self._exact)
+
+    def max_edits(self, length):
+        """Most edits a name of ``length`` characters can be away from a match"""
+        return int((1 - self.threshold) * length + 1e-9)
+
+    def _indexed_edits(self, length):
+        """Edits to index a name of ``length`` characters for: a longer match allows a few more"""
+        return int((1 - self.threshold) * length / self.threshold + 1e-9)
+
+    def add(self, key, name=None):
+        """Index ``name`` (``key`` by default) as a name of entity ``key``"""
+        compact = canonical_name(name if name is not None else key).replace(' ', '')
+        if not compact or compact in self._exact:
+            return
+        self._exact[compact] = key
+        edits = self._indexed_edits(len(compact))
+        if len(compact) < MIN_FUZZY_LENGTH or not edits:
+            return
+        alias = len(self._keys)
+        self._keys.append(key)
+        self._names.append(compact)
+        self._grams.append(ngrams(compact))
+        for index, (start, size) in enumerate(segments(len(compact), edits)):
+            self._blocks.setdefault((len(compact), index, compact[start:start + size]), []).append(alias)
+
+    def candidates(self, compact, edits):
+        """Indexes of names that share an unchanged part with ``compact``"""
+        found = set()
+        for length in range(max(len(compact) - edits, 1), len(compact) + edits + 1):
+            indexed = self._indexed_edits(length)
+            if not indexed:
+                continue
+            parts = list(enumerate(segments(length, indexed)))
+            boundaries = {start + shift - 1 for _, (start, _) in parts[1:] for shift in range(-edits, edits + 1)}
+            for text in swapped(compact, boundaries):
+                for index, (start, size) in parts:
+                    for position in range(max(start - edits, 0), min(start + edits, len(text) - size) + 1):
+                        found.update(self._blocks.get((length, index, text[position:position + size]), ()))
+        return found
+
+    def match(self, name):
+        """``(key, similarity)`` of the entity a name belongs to, or ``(None, 0.0)``"""
+        compact = canonical_name(name).replace(' ', '')
+        if not compact:
+            return None, 0.0
+        key = self._exact.get(compact)
+        if key is not None:
+            return key, 1.0
+        edits = self.max_edits(len(compact))
+        if len(compact) < MIN_FUZZY_LENGTH or not edits:
+            return None, 0.0
+
+        grams = ngrams(compact)
+        best, best_score = None, 0.0
+        for alias in self.candidates(compact, edits):
+            other = self._names[alias]
+            if abs(len(other) - len(compact)) > edits:
+                continue
+            other_grams = self._grams[alias]
+            # An edit changes at most NGRAM_SIZE + 1 trigrams
+            if len(grams & other_grams) < max(len(grams), len(other_grams)) - (NGRAM_SIZE + 1) * edits:
+                continue
+            distance = edit_distance(compact, other, edits)
+            if distance > edits:
+                continue
+            score = 1 - distance / max(len(compact), len(other))
+            if score > best_score or (score == best_score and best is not None and self._keys[alias] < best):
+                best, best_score = self._keys[alias], score
+        if best_score >= self.threshold:
+            return best, best_score
+        return None, 0.0
+
+    def resolve(self, name):
+        """Key of the entity a name belongs to, adding a new entity if there is none"""
+        key, _ = self.match(name)
+        if key is None:
+            key = canonical_name(name)
+            if key:
+                self.add(key, name)
+        return key or None
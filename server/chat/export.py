@@ -0,0 +1,299 @@
+import io
+import re
+import csv
+import json
+import zipfile
+from datetime import datetime, time
+from xml.sax.saxutils import escape, quoteattr
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import ChatMessage
+
+# Output is handed to the server in chunks of about this many bytes
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+# Columns of a history export: the message, then the company fields
+MESSAGE_COLUMNS = ['message_id', 'timestamp', 'user_message', 'status', 'summary']
+COMPANY_COLUMNS = [
+    'company_name', 'location', 'industry', 'funding_stage',
+    'funding_amount', 'established_year', 'investors',
+]
+HISTORY_COLUMNS = MESSAGE_COLUMNS + COMPANY_COLUMNS + ['extra']
+
+# Characters that make spreadsheet apps evaluate a CSV cell as a formula
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+# Control characters that are not allowed in XML 1.0
+_XML_ILLEGAL_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+# Longest text Excel keeps in a cell
+XLSX_MAX_CELL_CHARS = 32767
+
+
+def _parse_response(bot_response):
+    try:
+        response = json.loads(bot_response)
+    except (TypeError, ValueError):
+        return {}
+    return response if isinstance(response, dict) else {}
+
+
+def response_rows(response):
+    """(status, summary, company rows) of a stored response"""
+    data = response.get('data') if isinstance(response.get('data'), dict) else {}
+    table = data.get('data') if isinstance(data.get('data'), dict) else {}
+    rows = [row for row in table.get('companies') or [] if isinstance(row, dict)]
+    return response.get('status') or 'error', str(data.get('summary') or ''), rows
+
+
+def table_columns(rows):
+    """Columns of a result table in first-seen order, as ResultTable shows them"""
+    columns = []
+    for row in rows:
+        for key in row:
+            if key not in columns:
+                columns.append(key)
+    return columns
+
+
+def _parse_bound(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'{name} must be an ISO 8601 date or datetime')
+        parsed = datetime.combine(day, time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def export_queryset(params):
+    """Messages between the optional ``since`` and ``until`` query parameters.
+
+    Raises ValueError for malformed dates.
+    """
+    queryset = ChatMessage.objects.all()
+    since, until = _parse_bound(params, 'since'), _parse_bound(params, 'until')
+    if since:
+        queryset = queryset.filter(timestamp__gte=since)
+    if until:
+        queryset = queryset.filter(timestamp__lt=until)
+    return queryset
+
+
+def history_records(queryset, chunk_size=500):
+    """One record per company row of each message, oldest first.
+
+    Messages are fetched ``chunk_size`` at a time and each response is only
+    parsed when its turn comes, so memory does not grow with the history.
+    Messages without rows, e.g. errors, still give one record.
+    """
+    messages = queryset.order_by('timestamp', 'id').only('id', 'timestamp', 'user_message', 'bot_response')
+    for message in messages.iterator(chunk_size=chunk_size):
+        status, summary, rows = response_rows(_parse_response(message.bot_response))
+        base = {
+            'message_id': message.id,
+            'timestamp': message.timestamp.isoformat(),
+            'user_message': message.user_message,
+            'status': status,
+            'summary': summary,
+        }
+        for row in rows or [{}]:
+            record = dict(base)
+            extra = {}
+            for key, value in row.items():
+                column = key.strip().lower().replace(' ', '_')
+                if column in COMPANY_COLUMNS:
+                    record[column] = value
+                else:
+                    extra[key] = value
+            record['extra'] = json.dumps(extra) if extra else ''
+            yield record
+
+
+def message_table(message_id):
+    """(columns, rows) of the result table of one message; raises ChatMessage.DoesNotExist"""
+    message = ChatMessage.objects.only('bot_response').get(pk=message_id)
+    _, _, rows = response_rows(_parse_response(message.bot_response))
+    return table_columns(rows), rows
+
+
+class _Sink:
+    """Write-only file object whose contents are taken out chunk by chunk"""
+
+    def __init__(self):
+        self._parts = []
+        self.size = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._parts.append(data)
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts, self.size = [], 0
+        return data
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return str(value)
+
+
+def _csv_cell(value):
+    text = _text(value)
+    # Keep values from the model from running as formulas when opened
+    return "'" + text if text.startswith(_FORMULA_PREFIXES) else text
+
+
+def csv_chunks(columns, records):
+    """CSV with a header row, yielded in chunks of bytes"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for record in records:
+        writer.writerow([_csv_cell(record.get(column)) for column in columns])
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def ndjson_chunks(records):
+    """One JSON object per line, yielded in chunks of bytes"""
+    lines, size = [], 0
+    for record in records:
+        line = json.dumps(record) + '\n'
+        lines.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield ''.join(lines).encode('utf-8')
+            lines, size = [], 0
+    yield ''.join(lines).encode('utf-8')
+
+
+_XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+        '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ),
+}
+
+
+def _xlsx_workbook(sheet_name):
+    # Sheet names are at most 31 characters and cannot contain []:*?/\
+    name = re.sub(r'[\[\]:*?/\\]', ' ', sheet_name)[:31] or 'Sheet1'
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name={quoteattr(name)} sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+
+
+def _xlsx_cell(value, style=''):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c{style}><v>{value}</v></c>'
+    text = _XML_ILLEGAL_RE.sub('', _text(value))[:XLSX_MAX_CELL_CHARS]
+    return f'<c t="inlineStr"{style}><is><t xml:space="preserve">{escape(text)}</t></is></c>'
+
+
+def xlsx_chunks(columns, records, sheet_name='Export'):
+    """A single-sheet XLSX workbook, yielded in chunks of bytes.
+
+    The zip is written to a sink that is drained as rows are added, using
+    inline strings so no shared string table has to be kept in memory.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as workbook:
+        for name, content in _XLSX_PARTS.items():
+            workbook.writestr(name, content)
+        workbook.writestr('xl/workbook.xml', _xlsx_workbook(sheet_name))
+        with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                b'<sheetData>'
+            )
+            header = ''.join(_xlsx_cell(column, ' s="1"') for column in columns)
+            sheet.write(f'<row>{header}</row>'.encode('utf-8'))
+            # Compressed rows arrive in bursts; start the download right away
+            yield sink.take()
+            for record in records:
+                cells = ''.join(_xlsx_cell(record.get(column)) for column in columns)
+                sheet.write(f'<row>{cells}</row>'.encode('utf-8'))
+                if sink.size >= EXPORT_CHUNK_BYTES:
+                    yield sink.take()
+            sheet.write(b'</sheetData></worksheet>')
+    yield sink.take()
+
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def export_chunks(export_format, columns, records, title='Export'):
+    """Chunks of bytes of the records in csv, ndjson or xlsx"""
+    if export_format == 'csv':
+        return csv_chunks(columns, records)
+    if export_format == 'ndjson':
+        return ndjson_chunks(records)
+    return xlsx_chunks(columns, records, title)
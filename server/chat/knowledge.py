@@ -0,0 +1,401 @@
+import re
+import time
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .entities import EntityResolver, canonical_name
+from .models import KnownCompany
+from .query_analysis import FIELD_KEYWORDS, analyze_query
+
+# Columns kept on KnownCompany; anything else is merged into ``extra``
+KNOWN_COLUMNS = [
+    'company_name', 'location', 'industry', 'funding_stage',
+    'funding_amount', 'investors', 'established_year',
+]
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+_LOCATION_SPLIT_RE = re.compile(r'\s*[,/;|]\s*|\s+and\s+')
+
+# Words that appear in industry names but say nothing about the query
+_INDUSTRY_STOP_WORDS = {
+    'and', 'the', 'of', 'for', 'a', 'an', 'in', 'with', 'startups', 'startup',
+    'companies', 'company', 'list', 'top', 'show', 'find', 'other', 'services',
+}
+
+
+# Words of a query that do not narrow down which companies it asks for
+_QUERY_STOP_WORDS = _INDUSTRY_STOP_WORDS | {
+    word for keywords in FIELD_KEYWORDS.values() for keyword in keywords for word in keyword.split()
+} | {
+    'me', 'give', 'get', 'all', 'some', 'any', 'please', 'what', 'which', 'are', 'is', 'there',
+    'based', 'located', 'headquartered', 'their', 'them', 'they', 'to', 'on', 'or', 'at', 'by',
+    'name', 'names', 'info', 'information', 'details', 'data', 'table', 'along', 'plus', 'also',
+    'each', 'every', 'known', 'about', 'tell', 'us', 'i', 'want', 'need', 'can', 'you', 'include',
+    'including', 'having', 'have', 'has', 'that', 'who', 'more', 'most', 'amount', 'amounts',
+    'now', 'too', 'could', 'would', 'add', 'column', 'columns', 'these', 'those', 'this', 'it',
+    'same', 'previous', 'above', 'below', 'new',
+}
+
+# Words that compare a value instead of naming it ("founded after 2018")
+_COMPARISON_WORDS = {
+    'after', 'before', 'since', 'until', 'between', 'over', 'under',
+    'than', 'least', 'less', 'fewer', 'older', 'newer', 'earlier', 'later',
+}
+
+_STAGE_RE = re.compile(r'\b(pre[- ]?seed|seed|angel|series[- ][a-h])\b')
+_QUERY_YEAR_RE = re.compile(r'^(?:19|20)\d\d$')
+
+
+def _stage_key(text):
+    return re.sub(r'[^a-z0-9]+', ' ', str(text or '').lower()).strip()
+
+
+def query_constraints(message, analysis):
+    """What a query asks of each company: (industry terms, funding stages, years).
+
+    Returns None when the query has a constraint the index cannot check,
+    e.g. a comparison ("founded after 2018"), an amount or a word that is
+    neither a known industry term nor filler.
+    """
+    text = message.lower()
+    if analysis.custom_column:
+        text = re.sub(r'\binclude\s+.*?\s+as\s+.*?(?=\.|$)', ' ', text, flags=re.DOTALL)
+    stages = {_stage_key(match) for match in _STAGE_RE.findall(text)}
+    text = _STAGE_RE.sub(' ', text)
+
+    ignored = set(_QUERY_STOP_WORDS)
+    ignored |= set(_TOKEN_RE.findall(str(analysis.location or '').lower()))
+    if analysis.row_count:
+        ignored.add(str(analysis.row_count))
+
+    terms, years = set(), set()
+    words = set(_TOKEN_RE.findall(text)) - ignored
+    if words & _COMPARISON_WORDS:
+        return None
+    for word in words:
+        if _QUERY_YEAR_RE.match(word):
+            years.add(word)
+        elif word.isdigit() or any(char.isdigit() for char in word):
+            return None
+        else:
+            terms.add(word)
+    return terms, stages, years
+
+
+def _satisfies(record, stages, years):
+    """Whether a record has every funding stage and year a query asks for"""
+    stage = f' {_stage_key(record["funding_stage"])} '
+    if any(f' {wanted} ' not in stage for wanted in stages):
+        return False
+    year = str(record['established_year'] or '')
+    return all(wanted in year for wanted in years)
+
+
+def normalize_company_name(name):
+    """Canonical lookup key for a company name"""
+    return canonical_name(name)
+
+
+def location_keys(location):
+    """Lookup keys for a location, e.g. "Bangalore, India" -> {"bangalore", "india"}"""
+    location = str(location or '').strip().lower()
+    if not location:
+        return set()
+    keys = {part for part in _LOCATION_SPLIT_RE.split(location) if part}
+    keys.add(location)
+    return keys
+
+
+def industry_terms(industry):
+    return set(_TOKEN_RE.findall(str(industry or '').lower())) - _INDUSTRY_STOP_WORDS
+
+
+def _column_key(key):
+    return key.strip().lower().replace(' ', '_')
+
+
+def _has_value(value):
+    return value not in (None, '', [], {}) and str(value).strip().lower() not in ('n/a', 'unknown', 'null')
+
+
+def _merged(company, values, now):
+    """``company`` with the known values of a response written over its own"""
+    for column in KNOWN_COLUMNS:
+        if column in values:
+            max_length = KnownCompany._meta.get_field(column).max_length
+            setattr(company, column, values[column][:max_length] if max_length else values[column])
+    company.extra = {**(company.extra or {}), **values['extra']}
+    company.updated_at = now
+    return company
+
+
+class KnowledgePlan:
+    """What the index knows about a query.
+
+    ``rows`` are fresh records that carry every requested field, ``partial``
+    are fresh records missing some of them. ``complete`` is set when the rows
+    alone answer the query.
+    """
+
+    def __init__(self, rows, partial, wanted_rows):
+        self.rows = rows
+        self.partial = partial
+        self.wanted_rows = wanted_rows
+
+    @property
+    def complete(self):
+        return len(self.rows) >= self.wanted_rows
+
+    @property
+    def missing_rows(self):
+        """Rows the model still has to return"""
+        return max(self.wanted_rows - len(self.rows), 1) + len(self.partial)
+
+    def __bool__(self):
+        return bool(self.rows or self.partial)
+
+    def prompt_section(self):
+        """Prompt instructions so the model only returns what is missing"""
+        lines = ['### KNOWN COMPANIES:']
+        if self.rows:
+            names = ', '.join(row['company_name'] for row in self.rows)
+            lines.append(f'These companies are already known, do NOT include them: {names}')
+            missing = max(self.wanted_rows - len(self.rows), 1)
+            lines.append(f'Return at least {missing} other companies.')
+        if self.partial:
+            names = ', '.join(row['company_name'] for row in self.partial)
+            lines.append(f'Include these companies with all requested fields filled in: {names}')
+        return '\n'.join(lines)
+
+    def response(self, location=None):
+        """A response built only from known rows"""
+        place = f' in {location}' if location else ''
+        return {
+            'status': 'success',
+            'source': 'knowledge_index',
+            'data': {
+                'summary': f'{len(self.rows)} known startups{place}, answered from previously retrieved data.',
+                'data': {
+                    'table_name': 'Startup Information',
+                    'companies': [dict(row) for row in self.rows],
+                },
+                'key_insights': [],
+            }
+        }
+
+    def merge(self, response):
+        """Add known rows to a model response, letting fresh model data win"""
+        if not self.rows or not isinstance(response, dict) or response.get('status') != 'success':
+            return response
+        table = response['data'].setdefault('data', {})
+        companies = table.get('companies') or []
+        resolver = EntityResolver()
+        for row in companies:
+            resolver.resolve(str(row.get('company_name', '')))
+        known = [
+            dict(row) for row in self.rows
+            if resolver.match(row['company_name'])[0] is None
+        ]
+        table['companies'] = known + companies
+        return response
+
+
+class CompanyIndex:
+    """In-process index of known companies backed by the KnownCompany table.
+
+    Records are keyed by normalized name and indexed by location and
+    industry terms. Names are resolved to the key of a record through an
+    EntityResolver, so spelling variants of a company update one record.
+    The index loads lazily and picks up rows written by other workers at
+    most every ``refresh_interval`` seconds.
+    """
+
+    def __init__(self, max_age=None, min_rows=None, refresh_interval=None, default_rows=None):
+        self.max_age = timedelta(days=max_age or getattr(settings, 'GROQ_KNOWLEDGE_MAX_AGE_DAYS', 7))
+        self.min_rows = min_rows or getattr(settings, 'GROQ_KNOWLEDGE_MIN_ROWS', 5)
+        self.default_rows = default_rows or getattr(settings, 'GROQ_DEFAULT_ROWS', 10)
+        self.refresh_interval = refresh_interval or getattr(settings, 'GROQ_KNOWLEDGE_REFRESH_INTERVAL', 30)
+        self._lock = threading.RLock()
+        self._records = {}
+        self._by_location = {}
+        self._by_industry = {}
+        self._resolver = EntityResolver()
+        self._loaded_until = None
+        self._last_refresh = 0.0
+
+    def _add(self, record):
+        """Add or replace a record in the in-memory indexes"""
+        key = record['normalized_name']
+        previous = self._records.get(key)
+        if previous is not None:
+            for location in location_keys(previous['location']):
+                self._by_location.get(location, set()).discard(key)
+            for term in industry_terms(previous['industry']):
+                self._by_industry.get(term, set()).discard(key)
+
+        self._records[key] = record
+        self._resolver.add(key, record['company_name'])
+        self._resolver.add(key)
+        for location in location_keys(record['location']):
+            self._by_location.setdefault(location, set()).add(key)
+        for term in industry_terms(record['industry']):
+            self._by_industry.setdefault(term, set()).add(key)
+
+    def _record(self, company):
+        record = {column: getattr(company, column) for column in KNOWN_COLUMNS}
+        record['normalized_name'] = company.normalized_name
+        record['extra'] = dict(company.extra or {})
+        record['updated_at'] = company.updated_at
+        return record
+
+    def refresh(self, force=False):
+        """Load rows written since the last refresh"""
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_refresh < self.refresh_interval:
+                return
+            self._last_refresh = now
+
+            queryset = KnownCompany.objects.order_by('updated_at')
+            if self._loaded_until is not None:
+                queryset = queryset.filter(updated_at__gte=self._loaded_until)
+            for company in queryset.iterator(chunk_size=1000):
+                self._add(self._record(company))
+                self._loaded_until = company.updated_at
+
+    def lookup(self, message, location, fields):
+        """Return a KnowledgePlan for a query, or None if nothing is known.
+
+        Known records only answer a query if they match all of its
+        constraints; a query with a term the index has never seen or cannot
+        check gets no plan, so the model answers it in full. Without a row
+        count the plan is complete with GROQ_DEFAULT_ROWS rows, the most the
+        model is asked for, or GROQ_KNOWLEDGE_MIN_ROWS if that is more.
+        """
+        if not location:
+            return None
+        analysis = analyze_query(message)
+        constraints = query_constraints(message, analysis)
+        if constraints is None:
+            return None
+        terms, stages, years = constraints
+        self.refresh()
+
+        with self._lock:
+            # The full place first, then its most specific part ("Berlin, Germany" -> "berlin")
+            location = location.strip().lower()
+            parts = [part for part in _LOCATION_SPLIT_RE.split(location) if part]
+            keys = set(self._by_location.get(location) or self._by_location.get(parts[0] if parts else '', ()))
+            if not keys:
+                return None
+
+            for term in terms:
+                # Words after the place, e.g. "Germany" in "Berlin, Germany", narrow it down
+                matching = self._by_industry.get(term) or self._by_location.get(term)
+                if not matching:
+                    return None
+                keys &= matching
+
+            cutoff = timezone.now() - self.max_age
+            records = [
+                self._records[key] for key in sorted(keys)
+                if self._records[key]['updated_at'] >= cutoff and _satisfies(self._records[key], stages, years)
+            ]
+
+        # As many rows as the model would be asked for; min_rows only raises that bar
+        wanted_rows = analysis.row_count or max(self.default_rows, self.min_rows)
+
+        rows, partial = [], []
+        for record in records:
+            row = self.row(record, fields)
+            if row is None:
+                partial.append({'company_name': record['company_name']})
+            else:
+                rows.append(row)
+
+        plan = KnowledgePlan(rows[:wanted_rows], partial, wanted_rows)
+        return plan if plan else None
+
+    def row(self, record, fields):
+        """Table row for the requested fields, or None if any of them is unknown"""
+        extra = {_column_key(key): value for key, value in record['extra'].items()}
+        row = {'company_name': record['company_name']}
+        for field in sorted(fields):
+            column = _column_key(field)
+            if column == 'company_name':
+                continue
+            value = record[column] if column in KNOWN_COLUMNS else extra.get(column)
+            if not _has_value(value):
+                return None
+            row[field] = value
+        return row
+
+    def match(self, name):
+        """Key of the known record a company name resolves to, or None"""
+        self.refresh()
+        with self._lock:
+            return self._resolver.match(str(name or ''))[0]
+
+    def entity_keys(self, names):
+        """Entity key of each name: the key of its known record or a new canonical key"""
+        self.refresh()
+        with self._lock:
+            return [self._resolver.resolve(str(name or '')) or '' for name in names]
+
+    def ingest(self, rows):
+        """Merge company rows from a response into the persisted and in-memory index"""
+        rows = [row for row in rows if isinstance(row, dict)]
+        names = [row.get('company_name') or row.get('Company Name') for row in rows]
+        merged = {}
+        for row, name, key in zip(rows, names, self.entity_keys(names)):
+            if not key:
+                continue
+            values = merged.setdefault(key, {'company_name': str(name)[:255], 'extra': {}})
+            for field, value in row.items():
+                if not _has_value(value):
+                    continue
+                column = _column_key(field)
+                if column in KNOWN_COLUMNS:
+                    values[column] = str(value)
+                else:
+                    values['extra'][field] = value
+        if not merged:
+            return
+
+        now = timezone.now()
+        existing = KnownCompany.objects.in_bulk(list(merged), field_name='normalized_name')
+        to_create, to_update = [], []
+        for key, values in merged.items():
+            company = _merged(existing.get(key) or KnownCompany(normalized_name=key), values, now)
+            (to_update if company.pk else to_create).append(company)
+
+        # Another worker may create the same companies meanwhile; the unique
+        # normalized_name keeps its rows, and this response's values are merged into them
+        KnownCompany.objects.bulk_create(to_create, batch_size=500, ignore_conflicts=True)
+        created = []
+        if to_create:
+            stored = KnownCompany.objects.in_bulk(
+                [company.normalized_name for company in to_create], field_name='normalized_name'
+            )
+            for company in to_create:
+                current = stored.get(company.normalized_name)
+                # bulk_create stamped updated_at on the rows it inserted
+                if current is None or current.updated_at == company.updated_at:
+                    created.append(current or company)
+                else:
+                    to_update.append(_merged(current, merged[company.normalized_name], now))
+        KnownCompany.objects.bulk_update(to_update, KNOWN_COLUMNS + ['extra', 'updated_at'], batch_size=500)
+
+        # Other requests only see the rows once they are committed
+        records = [self._record(company) for company in created + to_update]
+        transaction.on_commit(lambda: self._add_all(records))
+
+    def _add_all(self, records):
+        with self._lock:
+            for record in records:
+                self._add(record)
+
+
+company_index = CompanyIndex()
@@ -0,0 +1,113 @@
+import os
+import uuid
+import hashlib
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Cache backends whose add() is atomic, so that an entry can serve as a lock
+# between workers. The file-based cache checks for the file and then writes
+# it, so two workers can both "add" the same key.
+ATOMIC_CACHE_BACKENDS = {
+    'django.core.cache.backends.redis.RedisCache',
+    'django.core.cache.backends.memcached.PyMemcacheCache',
+    'django.core.cache.backends.memcached.PyLibMCCache',
+    'django.core.cache.backends.db.DatabaseCache',
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django_redis.cache.RedisCache',
+}
+
+
+class CacheLock:
+    """Lock held as a cache entry, for backends with an atomic add().
+
+    The entry expires after ``timeout`` seconds, so a holder that died
+    does not block the others for longer than that.
+    """
+
+    def __init__(self, cache, name, timeout):
+        self.cache = cache
+        self.key = f'lock:{name}'
+        self.timeout = timeout
+        self.token = None
+
+    def acquire(self):
+        """Take the lock if it is free; returns whether it was taken"""
+        token = uuid.uuid4().hex
+        if self.cache.add(self.key, token, timeout=self.timeout):
+            self.token = token
+            return True
+        return False
+
+    def release(self):
+        # Only drop the lock if it has not expired and been taken by another worker
+        if self.token is not None and self.cache.get(self.key) == self.token:
+            self.cache.delete(self.key)
+        self.token = None
+
+
+class FileLock:
+    """flock() on a file per lock name, for caches without an atomic add().
+
+    Works between the workers of one host, which is what the file-based
+    cache is shared by. The kernel drops the lock when its holder exits,
+    so a crashed worker never blocks the others. The file is removed on
+    release; a worker that opened it just before checks that it locked
+    the file still in place.
+    """
+
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.path = os.path.join(directory, f'{hashlib.sha256(name.encode("utf-8")).hexdigest()}.lock')
+        self._fd = None
+
+    def acquire(self):
+        """Take the lock if it is free; returns whether it was taken"""
+        os.makedirs(self.directory, exist_ok=True)
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            try:
+                current = os.stat(self.path)
+            except FileNotFoundError:
+                current = None
+            locked = os.fstat(fd)
+            if current is not None and (current.st_dev, current.st_ino) == (locked.st_dev, locked.st_ino):
+                self._fd = fd
+                return True
+            # Removed by the previous holder after we opened it
+            os.close(fd)
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+
+def is_atomic(cache):
+    """Whether add() on ``cache`` is atomic between workers"""
+    return f'{type(cache).__module__}.{type(cache).__qualname__}' in ATOMIC_CACHE_BACKENDS
+
+
+def worker_lock(cache, name, timeout):
+    """A lock on ``name`` shared by the workers that share ``cache``.
+
+    A cache entry where the backend's add() is atomic, else a file lock in
+    CHAT_LOCK_DIR. ``timeout`` bounds how long a cache entry lock is held.
+    """
+    if is_atomic(cache) or fcntl is None:
+        return CacheLock(cache, name, timeout)
+    return FileLock(getattr(settings, 'CHAT_LOCK_DIR', os.path.join(settings.BASE_DIR, 'data', 'locks')), name)
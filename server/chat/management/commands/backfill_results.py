@@ -0,0 +1,160 @@
+import json
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from chat.knowledge import company_index
+from chat.models import ChatMessage, Company, ResultSet
+from chat.normalize import normalize_table
+from chat.search import index_messages, indexed_ids, optimize_index, search_available
+from chat.storage import store_results
+from chat.tables import company_row
+
+
+class Command(BaseCommand):
+    help = 'Write result tables for chat messages saved before they existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of messages processed per transaction'
+        )
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Drop and rebuild existing result tables as well'
+        )
+        parser.add_argument(
+            '--normalize',
+            action='store_true',
+            help='Recompute the typed values of existing result tables'
+        )
+        parser.add_argument(
+            '--entities',
+            action='store_true',
+            help='Resolve the company rows of existing result tables to entities again'
+        )
+        parser.add_argument(
+            '--search',
+            action='store_true',
+            help='Add messages missing from the full-text search index'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if options['rebuild']:
+            deleted, _ = ResultSet.objects.all().delete()
+            self.stdout.write(f'Deleted {deleted} existing rows')
+
+        messages = (
+            ChatMessage.objects
+            .filter(result_set__isnull=True)
+            .order_by('id')
+            .only('id', 'bot_response')
+        )
+
+        total = 0
+        batch = []
+        for chat_message in messages.iterator(chunk_size=batch_size):
+            try:
+                response = json.loads(chat_message.bot_response)
+            except (TypeError, ValueError):
+                response = {'status': 'error', 'message': 'Unparseable bot_response'}
+            batch.append((chat_message, response))
+            if len(batch) >= batch_size:
+                total += self._flush(batch)
+                batch = []
+        if batch:
+            total += self._flush(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled result tables for {total} messages'))
+
+        if options['normalize'] and not options['rebuild']:
+            normalized = self._normalize(batch_size)
+            self.stdout.write(self.style.SUCCESS(f'Normalized typed values of {normalized} result tables'))
+
+        if options['entities'] and not options['rebuild']:
+            resolved = self._resolve_entities(batch_size)
+            self.stdout.write(self.style.SUCCESS(f'Resolved {resolved} company rows to entities'))
+
+        if options['search']:
+            if not search_available():
+                self.stdout.write(self.style.WARNING('No full-text search index; it needs SQLite with FTS5'))
+            else:
+                indexed = self._index_search(batch_size)
+                self.stdout.write(self.style.SUCCESS(f'Added {indexed} messages to the search index'))
+
+    def _normalize(self, batch_size):
+        """Parse typed values again from the rows stored in each result table"""
+        total = 0
+        result_sets = ResultSet.objects.filter(row_count__gt=0).order_by('id')
+        for result_set in result_sets.iterator(chunk_size=batch_size):
+            companies = list(result_set.companies.order_by('position'))
+            rows = [company_row(result_set, company) for company in companies]
+            with transaction.atomic():
+                result_set.column_types, values = normalize_table(result_set.columns, rows)
+                result_set.save(update_fields=['column_types'])
+                for company, row_values in zip(companies, values):
+                    company.values = row_values
+                Company.objects.bulk_update(companies, ['values'], batch_size=batch_size)
+            total += 1
+        return total
+
+    def _resolve_entities(self, batch_size):
+        """Set the entity key of every company row from the current knowledge index"""
+        total = 0
+        batch = []
+        companies = Company.objects.order_by('id').only('id', 'company_name', 'entity_key')
+        for company in companies.iterator(chunk_size=batch_size):
+            batch.append(company)
+            if len(batch) >= batch_size:
+                total += self._update_entities(batch)
+                batch = []
+        if batch:
+            total += self._update_entities(batch)
+        return total
+
+    def _update_entities(self, companies):
+        keys = company_index.entity_keys(company.company_name for company in companies)
+        for company, key in zip(companies, keys):
+            company.entity_key = key[:255]
+        Company.objects.bulk_update(companies, ['entity_key'], batch_size=len(companies))
+        return len(companies)
+
+    def _index_search(self, batch_size):
+        """Index messages stored before the search index existed, then merge the index"""
+        total = 0
+        messages = ChatMessage.objects.order_by('id').select_related('result_set').only(
+            'id', 'user_message', 'result_set__id', 'result_set__summary'
+        )
+        batch = []
+        for chat_message in messages.iterator(chunk_size=batch_size):
+            batch.append(chat_message)
+            if len(batch) >= batch_size:
+                total += self._index_batch(batch)
+                batch = []
+        if batch:
+            total += self._index_batch(batch)
+        optimize_index()
+        return total
+
+    def _index_batch(self, messages):
+        indexed = indexed_ids(message.pk for message in messages)
+        entries = [
+            (message, getattr(message, 'result_set', None))
+            for message in messages if message.pk not in indexed
+        ]
+        companies = {}
+        result_sets = [result_set for _, result_set in entries if result_set is not None]
+        for company in Company.objects.filter(result_set__in=result_sets).order_by('result_set', 'position'):
+            companies.setdefault(company.result_set_id, []).append(company)
+        with transaction.atomic():
+            return index_messages(
+                (message, result_set, companies.get(result_set.pk, []) if result_set is not None else [])
+                for message, result_set in entries
+            )
+
+    def _flush(self, batch):
+        with transaction.atomic():
+            store_results(batch)
+        return len(batch)
@@ -0,0 +1,304 @@
+import os
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+
+# Upper bounds in seconds, from cache lookups to full LLM completions
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRICS = {
+    'chat_stage_duration_seconds': ('histogram', 'Duration of each stage of the chat pipeline'),
+    'chat_request_duration_seconds': ('histogram', 'Duration of HTTP requests by route'),
+    'chat_startup_duration_seconds': ('histogram', 'Duration of worker startup phases'),
+    'chat_requests_total': ('counter', 'HTTP requests by route and status'),
+    'chat_errors_total': ('counter', 'Errors by pipeline stage'),
+    'chat_retries_total': ('counter', 'Retried upstream attempts'),
+    'chat_segments_total': ('counter', 'Sub-queries of fanned-out large queries, by outcome'),
+    'chat_hedges_total': ('counter', 'Hedged upstream requests sent and won'),
+    'chat_admission_rejections_total': ('counter', 'Upstream calls refused before being made, by reason'),
+    'chat_circuit_transitions_total': ('counter', 'Circuit breaker state changes'),
+    'groq_prompt_tokens_total': ('counter', 'Prompt tokens sent to Groq'),
+    'groq_completion_tokens_total': ('counter', 'Completion tokens received from Groq'),
+    'groq_completions_total': ('counter', 'Completions received from Groq'),
+    'groq_max_tokens_total': ('counter', 'Completion token budgets requested from Groq'),
+    'groq_cache_hits_total': ('counter', 'Response cache hits'),
+    'groq_cache_misses_total': ('counter', 'Response cache misses'),
+    'chat_write_behind_queue_depth': ('gauge', 'Exchanges waiting in the write-behind queue'),
+    'chat_upstream_in_flight': ('gauge', 'Upstream calls in progress'),
+    'chat_upstream_queued': ('gauge', 'Upstream calls waiting for a slot'),
+    'chat_circuit_open': ('gauge', 'Workers whose circuit breaker is open'),
+}
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + (list(extra.items()) if extra else [])
+    if not items:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in items
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+RETIRED_FILENAME = 'retired.json'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merge(snapshots):
+    """Sum counters, gauges and histograms of snapshots by name and labels"""
+    counters, gauges, histograms = {}, {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, value in snapshot['gauges']:
+            key = (name, tuple(map(tuple, labels)))
+            gauges[key] = gauges.get(key, 0) + value
+        for name, labels, values in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.get(key)
+            histograms[key] = values if merged is None else [a + b for a, b in zip(merged, values)]
+    return counters, gauges, histograms
+
+
+class Metrics:
+    """Counters, gauges and fixed-bucket histograms, merged across workers.
+
+    Recording only updates in-process dicts under a lock. Each worker writes
+    a snapshot to ``<directory>/<pid>.json`` at most every
+    ``flush_interval`` seconds; rendering merges the snapshots of every
+    worker, like the multiprocess mode of prometheus_client. Counters and
+    histograms of exited workers still count, so they stay monotonic: the
+    gunicorn master folds the snapshot of each exited worker into
+    ``retired.json``. Gauges are only read from live workers. Everything is
+    cleared by the master on startup.
+    """
+
+    def __init__(self, directory=None, flush_interval=None, buckets=LATENCY_BUCKETS):
+        self.directory = directory or getattr(settings, 'METRICS_DIR', None)
+        self.flush_interval = flush_interval or getattr(settings, 'METRICS_FLUSH_INTERVAL', 1.0)
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self._last_flush = time.monotonic()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+        self._maybe_flush()
+
+    def observe(self, name, value, **labels):
+        key = (name, _labels_key(labels))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # Per-bucket counts (the last one is +Inf), then count and sum
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0, 0.0]
+            histogram[index] += 1
+            histogram[-2] += 1
+            histogram[-1] += value
+        self._maybe_flush()
+
+    def gauge(self, name, callback, **labels):
+        """Register a callback read whenever a snapshot is taken"""
+        with self._lock:
+            self._gauges[(name, _labels_key(labels))] = callback
+
+    @contextmanager
+    def timer(self, stage):
+        """Time a block as a stage of the chat pipeline"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('chat_stage_duration_seconds', time.perf_counter() - started, stage=stage)
+
+    def snapshot(self):
+        """This process' metrics as a JSON-serializable dict"""
+        with self._lock:
+            counters = [[name, list(labels), value] for (name, labels), value in self._counters.items()]
+            histograms = [[name, list(labels), list(values)] for (name, labels), values in self._histograms.items()]
+            gauges = list(self._gauges.items())
+        values = []
+        for (name, labels), callback in gauges:
+            try:
+                values.append([name, list(labels), callback()])
+            except Exception:
+                continue
+        return {'counters': counters, 'histograms': histograms, 'gauges': values}
+
+    def _maybe_flush(self):
+        if self.directory and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write this process' snapshot for other workers to merge"""
+        self._last_flush = time.monotonic()
+        if not self.directory:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f'{os.getpid()}.json')
+            temp_path = f'{path}.{threading.get_ident()}.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Error writing metrics snapshot: {str(e)}")
+
+    def clear(self):
+        """Drop the in-process metrics and every worker's snapshot"""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+        if self.directory and os.path.isdir(self.directory):
+            for filename in os.listdir(self.directory):
+                if filename.endswith('.json'):
+                    try:
+                        os.remove(os.path.join(self.directory, filename))
+                    except OSError:
+                        pass
+
+    def _read(self, filename):
+        try:
+            with open(os.path.join(self.directory, filename)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # Being replaced or removed right now
+            return None
+
+    def collect(self):
+        """Snapshots of all workers, this one taken live.
+
+        Snapshots of workers that are gone keep their counters and
+        histograms but not their gauges.
+        """
+        snapshots = [self.snapshot()]
+        own = f'{os.getpid()}.json'
+        if self.directory and os.path.isdir(self.directory):
+            for filename in os.listdir(self.directory):
+                if not filename.endswith('.json') or filename == own:
+                    continue
+                snapshot = self._read(filename)
+                if snapshot is None:
+                    continue
+                pid = filename[:-len('.json')]
+                if not (pid.isdigit() and _pid_alive(int(pid))):
+                    snapshot['gauges'] = []
+                snapshots.append(snapshot)
+        return snapshots
+
+    def retire(self, pid):
+        """Fold the snapshot of an exited worker into the retired totals.
+
+        Called by the gunicorn master, the only writer of ``retired.json``,
+        so snapshots do not pile up as workers are replaced.
+        """
+        if not self.directory:
+            return
+        snapshot = self._read(f'{pid}.json')
+        if snapshot is None:
+            return
+        retired = self._read(RETIRED_FILENAME) or {'counters': [], 'histograms': [], 'gauges': []}
+        counters, _, histograms = _merge([retired, snapshot])
+        retired = {
+            'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+            'histograms': [[name, list(labels), values] for (name, labels), values in histograms.items()],
+            'gauges': [],
+        }
+        try:
+            path = os.path.join(self.directory, RETIRED_FILENAME)
+            with open(f'{path}.tmp', 'w') as f:
+                json.dump(retired, f)
+            os.replace(f'{path}.tmp', path)
+            os.remove(os.path.join(self.directory, f'{pid}.json'))
+        except OSError as e:
+            print(f"Error retiring metrics snapshot: {str(e)}")
+
+    def total(self, name, **labels):
+        """Sum of a counter over all workers and the series that have ``labels``"""
+        wanted = {(label, str(value)) for label, value in labels.items()}
+        total = 0
+        for snapshot in self.collect():
+            for counter, series, value in snapshot['counters']:
+                if counter == name and wanted <= {(label, str(item)) for label, item in series}:
+                    total += value
+        return total
+
+    def render(self):
+        """Prometheus text exposition of the merged metrics"""
+        self.flush()
+        counters, gauges, histograms = _merge(self.collect())
+
+        lines = []
+        for metric_name, (metric_type, help_text) in METRICS.items():
+            series = {'counter': counters, 'gauge': gauges, 'histogram': histograms}[metric_type]
+            keys = sorted(key for key in series if key[0] == metric_name)
+            if not keys:
+                continue
+            lines.append(f'# HELP {metric_name} {help_text}')
+            lines.append(f'# TYPE {metric_name} {metric_type}')
+            for key in keys:
+                labels = key[1]
+                if metric_type != 'histogram':
+                    lines.append(f'{metric_name}{_format_labels(labels)} {series[key]}')
+                    continue
+                values = series[key]
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), values):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{metric_name}_bucket{_format_labels(labels, {"le": le})} {cumulative}')
+                lines.append(f'{metric_name}_count{_format_labels(labels)} {values[-2]}')
+                lines.append(f'{metric_name}_sum{_format_labels(labels)} {values[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+def httpx_event_hooks():
+    """Event hooks timing the upstream time to first byte of a sync httpx client"""
+    def on_request(request):
+        request.extensions['metrics_started'] = time.perf_counter()
+
+    def on_response(response):
+        started = response.request.extensions.get('metrics_started')
+        if started is not None:
+            metrics.observe('chat_stage_duration_seconds', time.perf_counter() - started, stage='upstream_ttfb')
+
+    return {'request': [on_request], 'response': [on_response]}
+
+
+def async_httpx_event_hooks():
+    """Async counterpart of httpx_event_hooks"""
+    hooks = httpx_event_hooks()
+
+    async def on_request(request):
+        hooks['request'][0](request)
+
+    async def on_response(response):
+        hooks['response'][0](response)
+
+    return {'request': [on_request], 'response': [on_response]}
+
+
+metrics = Metrics()
@@ -0,0 +1,193 @@
+import time
+import zlib
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from .metrics import metrics
+
+try:
+    import brotli
+except ImportError:
+    # gzip only
+    brotli = None
+
+# Content types worth compressing; XLSX is a zip already
+COMPRESSIBLE_TYPES = {
+    'application/json',
+    'application/x-ndjson',
+    'application/javascript',
+    'text/csv',
+    'text/html',
+    'text/plain',
+}
+
+
+class RequestMetricsMiddleware:
+    """Record request durations and counts by route for /api/metrics.
+
+    Works in both sync and async mode, so async views under ASGI are not
+    pushed onto a thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.record(request, response, started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, started)
+        return response
+
+    def record(self, request, response, started):
+        match = getattr(request, 'resolver_match', None)
+        route = match.url_name if match and match.url_name else 'unmatched'
+        # Streaming responses are timed until their headers are ready
+        metrics.observe('chat_request_duration_seconds', time.perf_counter() - started, route=route)
+        metrics.inc('chat_requests_total', route=route, method=request.method, status=response.status_code)
+
+
+def accepted_encodings(header):
+    """Encodings of an Accept-Encoding header with a q-value above zero"""
+    encodings = set()
+    for item in header.split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name and quality > 0:
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+class _Compressor:
+    """Incremental gzip or brotli compression of one response body"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=getattr(settings, 'API_COMPRESSION_BROTLI_QUALITY', 4))
+        else:
+            # wbits 31 writes a gzip header and trailer
+            self._compressor = zlib.compressobj(getattr(settings, 'API_COMPRESSION_GZIP_LEVEL', 6), zlib.DEFLATED, 31)
+
+    def chunk(self, data):
+        """Compress data and flush it, so streamed chunks are not held back"""
+        if self.encoding == 'br':
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._compressor.process(data) + self._compressor.finish()
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+class CompressionMiddleware:
+    """Compress API responses with brotli or gzip, as the client accepts.
+
+    Brotli is preferred when the ``brotli`` package is installed. Bodies
+    below ``API_COMPRESSION_MIN_BYTES`` and event streams are sent as they
+    are; other streaming responses are compressed chunk by chunk with a
+    flush after each, so exports still start downloading right away.
+    Strong ETags are weakened, like Django's GZipMiddleware does.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'API_COMPRESSION_ENABLED', True)
+        self.min_bytes = getattr(settings, 'API_COMPRESSION_MIN_BYTES', 1024)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.process(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process(request, await self.get_response(request))
+
+    def encoding_for(self, request):
+        encodings = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+        if brotli is not None and 'br' in encodings:
+            return 'br'
+        if 'gzip' in encodings:
+            return 'gzip'
+        return None
+
+    def process(self, request, response):
+        if not self.enabled or response.has_header('Content-Encoding') or response.status_code in (204, 304):
+            return response
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type not in COMPRESSIBLE_TYPES and not content_type.endswith('+json'):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = self.encoding_for(request)
+        if encoding is None:
+            return response
+
+        compressor = _Compressor(encoding)
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = self._acompress_stream(compressor, response.streaming_content)
+            else:
+                response.streaming_content = self._compress_stream(compressor, response.streaming_content)
+            del response['Content-Length']
+        else:
+            if len(response.content) < self.min_bytes:
+                return response
+            compressed = compressor.compress(response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+    @staticmethod
+    def _compress_stream(compressor, chunks):
+        for chunk in chunks:
+            data = compressor.chunk(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+
+    @staticmethod
+    async def _acompress_stream(compressor, chunks):
+        async for chunk in chunks:
+            data = compressor.chunk(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
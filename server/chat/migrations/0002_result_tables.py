@@ -0,0 +1,54 @@
+# Generated by Django 5.0.2 on 2026-10-16 22:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultSet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(db_index=True, max_length=20)),
+                ('summary', models.TextField(blank=True)),
+                ('table_name', models.CharField(blank=True, max_length=255)),
+                ('columns', models.JSONField(blank=True, default=list)),
+                ('row_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('chat_message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='result_set', to='chat.chatmessage')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Company',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('company_name', models.CharField(db_index=True, max_length=255)),
+                ('location', models.CharField(blank=True, db_index=True, max_length=255)),
+                ('industry', models.CharField(blank=True, db_index=True, max_length=255)),
+                ('funding_stage', models.CharField(blank=True, db_index=True, max_length=100)),
+                ('funding_amount', models.CharField(blank=True, max_length=100)),
+                ('investors', models.TextField(blank=True)),
+                ('established_year', models.PositiveSmallIntegerField(blank=True, db_index=True, null=True)),
+                ('extra', models.JSONField(blank=True, default=dict)),
+                ('result_set', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='companies', to='chat.resultset')),
+            ],
+            options={
+                'verbose_name_plural': 'companies',
+                'ordering': ['result_set', 'position'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='company',
+            constraint=models.UniqueConstraint(fields=('result_set', 'position'), name='unique_company_position'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.2 on 2026-10-16 22:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_history_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KnownCompany',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('normalized_name', models.CharField(max_length=255, unique=True)),
+                ('company_name', models.CharField(max_length=255)),
+                ('location', models.CharField(blank=True, max_length=255)),
+                ('industry', models.CharField(blank=True, max_length=255)),
+                ('funding_stage', models.CharField(blank=True, max_length=100)),
+                ('funding_amount', models.CharField(blank=True, max_length=100)),
+                ('investors', models.TextField(blank=True)),
+                ('established_year', models.CharField(blank=True, max_length=20)),
+                ('extra', models.JSONField(blank=True, default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+            options={
+                'verbose_name_plural': 'known companies',
+                'ordering': ['normalized_name'],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.2 on 2026-10-16 23:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_known_companies'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='values',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='resultset',
+            name='column_types',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
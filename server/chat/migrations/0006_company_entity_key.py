@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-16 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_typed_values'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='entity_key',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,64 @@
+from django.db import migrations
+
+# Deletes and edits of a message reach its search row through triggers; new
+# messages are indexed by chat.storage.store_results, since they are written
+# with bulk_create, which sends no signals.
+CREATE_SEARCH_INDEX = [
+    """
+    CREATE VIRTUAL TABLE chat_search USING fts5(
+        user_message, summary, companies, details,
+        tokenize = 'porter unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER chat_search_delete AFTER DELETE ON chat_chatmessage BEGIN
+        DELETE FROM chat_search WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER chat_search_update AFTER UPDATE OF user_message ON chat_chatmessage BEGIN
+        UPDATE chat_search SET user_message = new.user_message WHERE rowid = new.id;
+    END
+    """,
+]
+
+DROP_SEARCH_INDEX = [
+    'DROP TRIGGER IF EXISTS chat_search_update',
+    'DROP TRIGGER IF EXISTS chat_search_delete',
+    'DROP TABLE IF EXISTS chat_search',
+]
+
+
+def _fts5(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return any(option == 'ENABLE_FTS5' for option, in cursor.fetchall())
+
+
+def create_search_index(apps, schema_editor):
+    """Full-text search runs on SQLite FTS5; other databases fall back to substring matching"""
+    if not _fts5(schema_editor.connection):
+        return
+    for statement in CREATE_SEARCH_INDEX:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP_SEARCH_INDEX:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_company_entity_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -4,11 +4,92 @@ class ChatMessage(models.Model):
     user_message = models.TextField()
     bot_response = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
+    # Part of the history ETag, so edited messages invalidate cached pages
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        ordering = ['-timestamp']
+        ordering = ['-timestamp', '-id']
+        indexes = [
+            # Keyset pagination of the history runs on (timestamp, id)
+            models.Index(fields=['-timestamp', '-id'], name='chat_message_recent_idx'),
+        ]
 
     def __str__(self):
         return f'Chat at {self.timestamp}'
 
-# Create your models here.
+
+class ResultSet(models.Model):
+    """Structured result of a chat exchange, written when the message is saved"""
+    chat_message = models.OneToOneField(
+        ChatMessage,
+        on_delete=models.CASCADE,
+        related_name='result_set'
+    )
+    status = models.CharField(max_length=20, db_index=True)
+    summary = models.TextField(blank=True)
+    table_name = models.CharField(max_length=255, blank=True)
+    columns = models.JSONField(default=list, blank=True)
+    # Kind of each column (money, year, count, date, number or text)
+    column_types = models.JSONField(default=dict, blank=True)
+    row_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f'Result set for chat {self.chat_message_id}'
+
+
+class Company(models.Model):
+    """A single company row of a result set"""
+    result_set = models.ForeignKey(
+        ResultSet,
+        on_delete=models.CASCADE,
+        related_name='companies'
+    )
+    position = models.PositiveIntegerField()
+    company_name = models.CharField(max_length=255, db_index=True)
+    location = models.CharField(max_length=255, blank=True, db_index=True)
+    industry = models.CharField(max_length=255, blank=True, db_index=True)
+    funding_stage = models.CharField(max_length=100, blank=True, db_index=True)
+    funding_amount = models.CharField(max_length=100, blank=True)
+    investors = models.TextField(blank=True)
+    established_year = models.PositiveSmallIntegerField(null=True, blank=True, db_index=True)
+    # Custom columns and any other fields the model returned
+    extra = models.JSONField(default=dict, blank=True)
+    # Parsed numbers of the typed columns, keyed by column name, for sorting and filtering
+    values = models.JSONField(default=dict, blank=True)
+    # Normalized name of the KnownCompany this row resolves to, shared by its name variants
+    entity_key = models.CharField(max_length=255, blank=True, db_index=True)
+
+    class Meta:
+        ordering = ['result_set', 'position']
+        verbose_name_plural = 'companies'
+        constraints = [
+            models.UniqueConstraint(fields=['result_set', 'position'], name='unique_company_position'),
+        ]
+
+    def __str__(self):
+        return self.company_name
+
+
+class KnownCompany(models.Model):
+    """Latest known facts about a company, merged across all responses"""
+    normalized_name = models.CharField(max_length=255, unique=True)
+    company_name = models.CharField(max_length=255)
+    location = models.CharField(max_length=255, blank=True)
+    industry = models.CharField(max_length=255, blank=True)
+    funding_stage = models.CharField(max_length=100, blank=True)
+    funding_amount = models.CharField(max_length=100, blank=True)
+    investors = models.TextField(blank=True)
+    established_year = models.CharField(max_length=20, blank=True)
+    extra = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        ordering = ['normalized_name']
+        verbose_name_plural = 'known companies'
+
+    def __str__(self):
+        return self.company_name
@@ -0,0 +1,210 @@
+import re
+from functools import lru_cache
+
+# Column kinds with a typed value; everything else is text
+MONEY, YEAR, COUNT, DATE, NUMBER, TEXT = 'money', 'year', 'count', 'date', 'number', 'text'
+TYPED_KINDS = (MONEY, YEAR, COUNT, DATE, NUMBER)
+
+# Column name hints, checked in order before looking at the values
+_NAME_HINTS = [
+    (DATE, re.compile(r'\bdated?\b')),
+    (YEAR, re.compile(r'year|founded|established|inception')),
+    (MONEY, re.compile(r'fund|amount|raised|revenue|valuation|arr\b|mrr\b|price|cost|capital|investment')),
+    (COUNT, re.compile(r'employee|headcount|team|staff|size|people|workforce|customers|users')),
+]
+
+# Share of non-empty values that must parse for a column to get a kind from its values
+_MIN_PARSED_SHARE = 0.6
+
+_NUMBER = r'\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?|\.\d+'
+_UNIT = r'k|thousand|m|mn|mm|mil|million|b|bn|billion|t|tn|trillion|lakhs?|lacs?|crores?|cr'
+_CURRENCY_SYMBOLS = {'$': 'USD', '€': 'EUR', '£': 'GBP', '₹': 'INR', '¥': 'JPY'}
+_CURRENCY_CODES = {'usd', 'eur', 'gbp', 'inr', 'jpy', 'cad', 'aud', 'sgd', 'chf', 'cny', 'rs'}
+_CURRENCY_ALIASES = {'RS': 'INR'}
+
+_AMOUNT_RE = re.compile(
+    rf'(?P<currency>[$€£₹¥]|\b(?:{"|".join(_CURRENCY_CODES)})\b\.?)?\s*'
+    rf'(?P<low>{_NUMBER})\s*(?P<low_unit>{_UNIT})?\b'
+    rf'(?:\s*(?:-|–|to)\s*[$€£₹¥]?\s*(?P<high>{_NUMBER})\s*(?P<high_unit>{_UNIT})?\b)?',
+    re.IGNORECASE
+)
+_YEAR_RE = re.compile(r'\b(1[89]\d\d|20\d\d)\b')
+_MONTHS = {
+    name: number
+    for number, names in enumerate([
+        ('jan', 'january'), ('feb', 'february'), ('mar', 'march'), ('apr', 'april'),
+        ('may',), ('jun', 'june'), ('jul', 'july'), ('aug', 'august'),
+        ('sep', 'sept', 'september'), ('oct', 'october'), ('nov', 'november'), ('dec', 'december'),
+    ], start=1)
+    for name in names
+}
+_ISO_DATE_RE = re.compile(r'\b(1[89]\d\d|20\d\d)-(\d{1,2})(?:-(\d{1,2}))?\b')
+_MONTH_NAME_RE = re.compile(
+    r'\b(?:(\d{1,2})\s+)?([a-z]{3,9})\.?\s+(?:(\d{1,2}),?\s+)?(1[89]\d\d|20\d\d)\b', re.IGNORECASE
+)
+_QUARTER_RE = re.compile(r'\bq([1-4])\s*(1[89]\d\d|20\d\d)\b', re.IGNORECASE)
+
+_UNIT_FACTORS = {
+    'k': 1e3, 'thousand': 1e3,
+    'm': 1e6, 'mn': 1e6, 'mm': 1e6, 'mil': 1e6, 'million': 1e6,
+    'b': 1e9, 'bn': 1e9, 'billion': 1e9,
+    't': 1e12, 'tn': 1e12, 'trillion': 1e12,
+    'lakh': 1e5, 'lakhs': 1e5, 'lac': 1e5, 'lacs': 1e5,
+    'crore': 1e7, 'crores': 1e7, 'cr': 1e7,
+}
+
+
+def _to_number(number, unit):
+    value = float(number.replace(',', ''))
+    return value * _UNIT_FACTORS.get((unit or '').lower(), 1)
+
+
+def _amount(text):
+    """(value, currency) of the first amount in text; ranges give their midpoint"""
+    match = _AMOUNT_RE.search(text)
+    if not match:
+        return None, None
+    low_unit, high_unit = match.group('low_unit'), match.group('high_unit')
+    # "$10-15M": the unit after the range applies to both ends
+    low = _to_number(match.group('low'), low_unit or high_unit)
+    value = low
+    if match.group('high'):
+        high = _to_number(match.group('high'), high_unit or low_unit)
+        value = (low + high) / 2 if high >= low else low
+    currency = match.group('currency')
+    if currency:
+        currency = _CURRENCY_SYMBOLS.get(currency) or currency.rstrip('.').upper()
+        currency = _CURRENCY_ALIASES.get(currency, currency)
+    return value, currency
+
+
+@lru_cache(maxsize=4096)
+def parse_money(text):
+    """Amount of money in its currency's units, e.g. "$1.2B" -> 1200000000.0"""
+    value, _ = _amount(text)
+    return value
+
+
+@lru_cache(maxsize=4096)
+def parse_count(text):
+    """Headcount-like number, e.g. "2,300" -> 2300, "1k-5k" -> 3000, "500+" -> 500"""
+    value, _ = _amount(text)
+    return round(value) if value is not None else None
+
+
+@lru_cache(maxsize=4096)
+def parse_number(text):
+    value, _ = _amount(text)
+    return value
+
+
+@lru_cache(maxsize=4096)
+def parse_year(text):
+    match = _YEAR_RE.search(text)
+    return int(match.group(1)) if match else None
+
+
+@lru_cache(maxsize=4096)
+def parse_date(text):
+    """Date as a sortable YYYYMMDD integer; missing month or day count as the first"""
+    match = _ISO_DATE_RE.search(text)
+    if match and 1 <= int(match.group(2)) <= 12:
+        return int(match.group(1)) * 10000 + int(match.group(2)) * 100 + int(match.group(3) or 1)
+    for match in _MONTH_NAME_RE.finditer(text):
+        month = _MONTHS.get(match.group(2).lower())
+        if month:
+            day = int(match.group(1) or match.group(3) or 1)
+            return int(match.group(4)) * 10000 + month * 100 + min(day, 31)
+    match = _QUARTER_RE.search(text)
+    if match:
+        return int(match.group(2)) * 10000 + ((int(match.group(1)) - 1) * 3 + 1) * 100 + 1
+    year = parse_year(text)
+    return year * 10000 + 101 if year else None
+
+
+PARSERS = {
+    MONEY: parse_money,
+    YEAR: parse_year,
+    COUNT: parse_count,
+    DATE: parse_date,
+    NUMBER: parse_number,
+}
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, (list, dict)):
+        return ''
+    return str(value).strip()
+
+
+def _parsed_share(parser, texts):
+    parsed = sum(1 for text in texts if parser(text) is not None)
+    return parsed / len(texts)
+
+
+def column_kind(column, texts):
+    """Kind of a column, from its name and then from its non-empty values"""
+    name = column.strip().lower().replace('_', ' ')
+    texts = [text for text in texts if text]
+    for kind, pattern in _NAME_HINTS:
+        if pattern.search(name):
+            # A name hint still needs values that parse, e.g. "Team" of people names does not
+            if not texts or _parsed_share(PARSERS[kind], texts) >= _MIN_PARSED_SHARE:
+                return kind
+            break
+    if not texts:
+        return TEXT
+    # Amounts need a currency or a unit so plain numbers stay numbers
+    if _parsed_share(parse_money, texts) >= _MIN_PARSED_SHARE and any(
+        _amount(text)[1] or re.search(rf'\d\s*(?:{_UNIT})\b', text, re.IGNORECASE) for text in texts
+    ):
+        return MONEY
+    if all(re.fullmatch(r'(1[89]\d\d|20\d\d)', text) for text in texts):
+        return YEAR
+    if _parsed_share(parse_number, texts) >= _MIN_PARSED_SHARE and all(
+        re.fullmatch(r'[~≈<>+\s]*(?:' + _NUMBER + r')\+?\s*(?:-\s*(?:' + _NUMBER + r'))?\+?', text) for text in texts
+    ):
+        return NUMBER
+    if _parsed_share(parse_date, texts) >= _MIN_PARSED_SHARE and any(
+        _ISO_DATE_RE.search(text) or _MONTH_NAME_RE.search(text) or _QUARTER_RE.search(text) for text in texts
+    ):
+        return DATE
+    return TEXT
+
+
+def normalize_table(columns, rows):
+    """Typed values of a result table, computed column by column.
+
+    Each column's kind is decided once from its name and values, and its
+    parser then runs over the whole column; repeated values such as
+    "Series A" or "$10M" are parsed once thanks to the parser caches.
+    Returns ``(column_types, values)`` where ``values`` has one
+    ``{column: number}`` dict per row holding the values that parsed.
+    """
+    column_types = {}
+    values = [{} for _ in rows]
+    for column in columns:
+        texts = [_text(row.get(column)) for row in rows]
+        kind = column_kind(column, texts)
+        column_types[column] = kind
+        if kind == TEXT:
+            continue
+        parser = PARSERS[kind]
+        for row_values, text in zip(values, texts):
+            if text:
+                parsed = parser(text)
+                if parsed is not None:
+                    row_values[column] = parsed
+    return column_types, values
+
+
+def parse_value(kind, value):
+    """A filter value given by a client, parsed like the column it applies to"""
+    if kind == TEXT:
+        return str(value)
+    parsed = PARSERS[kind](str(value).strip())
+    if parsed is None:
+        raise ValueError(f'{value!r} is not a valid {kind} value')
+    return parsed
@@ -0,0 +1,86 @@
+import base64
+import hashlib
+from datetime import datetime
+from django.db.models import Q
+from django.utils.http import parse_etags, quote_etag
+from .models import ChatMessage
+
+DEFAULT_HISTORY_LIMIT = 50
+MAX_HISTORY_LIMIT = 200
+
+
+def encode_cursor(timestamp, pk):
+    """Encode the (timestamp, id) position of a message as an opaque cursor"""
+    raw = f'{timestamp.isoformat()}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor back into (timestamp, id); raises ValueError if invalid"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, pk = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(pk)
+    except (TypeError, UnicodeDecodeError, ValueError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def parse_history_params(params):
+    """Read limit, cursor and summary mode from query parameters.
+
+    Raises ValueError for malformed values.
+    """
+    try:
+        limit = int(params.get('limit', DEFAULT_HISTORY_LIMIT))
+    except (TypeError, ValueError) as e:
+        raise ValueError('limit must be an integer') from e
+    limit = max(1, min(limit, MAX_HISTORY_LIMIT))
+
+    cursor = params.get('cursor') or None
+    after = decode_cursor(cursor) if cursor else None
+    summary = str(params.get('summary', '')).lower() in ('true', '1', 'yes')
+    return limit, cursor, after, summary
+
+
+def history_queryset(after=None, summary=False):
+    """Messages newest first, starting after the given (timestamp, id) position"""
+    queryset = ChatMessage.objects.order_by('-timestamp', '-id')
+    if after is not None:
+        timestamp, pk = after
+        queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+    if summary:
+        # Leave the response blobs in the database
+        queryset = queryset.select_related('result_set').only(
+            'id', 'user_message', 'timestamp', 'result_set__summary', 'result_set__row_count'
+        )
+    return queryset
+
+
+def history_page_keys(queryset, limit):
+    """Fetch the keys of a page without loading message bodies.
+
+    Each key is (id, timestamp, updated_at, result set id): the position of
+    a message plus what changes when it is edited or its results are
+    stored. Returns the keys and the cursor of the next page, if there is one.
+    """
+    keys = list(queryset.values_list('id', 'timestamp', 'updated_at', 'result_set__id')[:limit + 1])
+    next_cursor = None
+    if len(keys) > limit:
+        keys = keys[:limit]
+        pk, timestamp = keys[-1][:2]
+        next_cursor = encode_cursor(timestamp, pk)
+    return keys, next_cursor
+
+
+def history_etag(keys, *variant):
+    """Strong ETag of a history page, derived from its keys and request variant"""
+    digest = hashlib.sha1(repr((keys, variant)).encode()).hexdigest()
+    return quote_etag(digest)
+
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header value matches the ETag"""
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return '*' in etags or etag in etags or f'W/{etag}' in etags
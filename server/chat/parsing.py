@@ -0,0 +1,112 @@
+import re
+import json
+
+# Every backslash escape; group 1 is set only for valid JSON escapes, so the
+# "\_" models like to emit in key names can be told apart from "\\"
+_ESCAPE_RE = re.compile(r'\\(["\\/bfnrt]|u[0-9a-fA-F]{4})?')
+
+# Cheap pre-check for escapes that are not valid JSON
+_BAD_ESCAPE_RE = re.compile(r'\\(?!["\\/bfnrtu])')
+
+_WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+
+# strict=False accepts raw newlines and tabs inside strings
+_decoder = json.JSONDecoder(strict=False)
+
+
+class ResponseParseError(ValueError):
+    """Raised when no JSON object can be recovered from a completion"""
+
+
+def _parse_container(text, pos):
+    """Parse the object or array starting at text[pos] as far as possible.
+
+    Complete members are decoded by the C scanner in one call each; only
+    the path leading to a defect (truncation, trailing comma) is walked
+    here. Members cut off by truncation are dropped, and objects that are
+    array items (i.e. half-generated company rows) are dropped whole rather
+    than kept with missing fields.
+
+    Returns ``(value, end, complete)``.
+    """
+    is_object = text[pos] == '{'
+    closer = '}' if is_object else ']'
+    value = {} if is_object else []
+    length = len(text)
+    pos += 1
+
+    while True:
+        pos = _WHITESPACE_RE.match(text, pos).end()
+        if pos >= length:
+            return value, pos, False
+        char = text[pos]
+        if char == closer:
+            return value, pos + 1, True
+        if char == ',':
+            # Separators, including trailing commas before the closer
+            pos += 1
+            continue
+
+        key = None
+        if is_object:
+            try:
+                key, pos = _decoder.raw_decode(text, pos)
+            except json.JSONDecodeError:
+                return value, pos, False
+            pos = _WHITESPACE_RE.match(text, pos).end()
+            if not isinstance(key, str) or pos >= length or text[pos] != ':':
+                return value, pos, False
+            pos = _WHITESPACE_RE.match(text, pos + 1).end()
+            if pos >= length:
+                return value, pos, False
+
+        try:
+            item, pos = _decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            if text[pos] not in '{[':
+                return value, pos, False
+            item, pos, complete = _parse_container(text, pos)
+            if not complete:
+                if is_object:
+                    value[key] = item
+                return value, pos, False
+
+        else:
+            if pos >= length and not isinstance(item, str):
+                # A number or literal at the very end may have been cut short
+                return value, pos, False
+
+        if is_object:
+            value[key] = item
+        else:
+            value.append(item)
+
+
+def _fix_escape(match):
+    """Keep valid escapes and drop the backslash of invalid ones"""
+    return match.group() if match.group(1) else ''
+
+
+def extract_json(text):
+    """Extract and parse the JSON object from an LLM completion.
+
+    Code fences and any prose around the object are ignored, invalid escapes
+    are dropped, and truncated or slightly malformed output is repaired in
+    the same forward pass (see ``_parse_container``). Raises
+    ResponseParseError when nothing can be recovered.
+    """
+    start = text.find('{')
+    if start == -1:
+        raise ResponseParseError('No JSON object found in response')
+
+    if _BAD_ESCAPE_RE.search(text, start):
+        # Invalid escapes are the most common defect; fixing them is a
+        # single substitution over the text
+        text = _ESCAPE_RE.sub(_fix_escape, text)
+
+    # Well-formed members are decoded whole by the C scanner, so a valid
+    # object costs about the same as json.loads
+    data, _, complete = _parse_container(text, start)
+    if not data and not complete:
+        raise ResponseParseError('No complete JSON element found in response')
+    return data
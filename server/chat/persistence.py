@@ -0,0 +1,170 @@
+import time
+import queue
+import atexit
+import threading
+from django.conf import settings
+from django.db import close_old_connections
+from .metrics import metrics
+from .storage import record_exchange, record_exchanges
+
+
+class ExchangeWriter:
+    """Write-behind queue for chat exchanges.
+
+    Finished exchanges are put on a bounded in-process queue and saved by a
+    background thread with bulk inserts, once ``batch_size`` exchanges are
+    waiting or ``flush_interval`` seconds after the first one arrived. When
+    the queue is full the caller saves synchronously instead, so exchanges
+    are never dropped. The queue is drained when the worker exits.
+
+    Queued exchanges are only visible to other requests once flushed;
+    ``flush()`` saves everything queued in this process immediately.
+    """
+
+    def __init__(self, enabled=None, max_size=None, batch_size=None, flush_interval=None):
+        self.enabled = getattr(settings, 'CHAT_WRITE_BEHIND_ENABLED', False) if enabled is None else enabled
+        self.max_size = max_size or getattr(settings, 'CHAT_WRITE_BEHIND_QUEUE_SIZE', 1000)
+        self.batch_size = batch_size or getattr(settings, 'CHAT_WRITE_BEHIND_BATCH_SIZE', 50)
+        self.flush_interval = flush_interval or getattr(settings, 'CHAT_WRITE_BEHIND_FLUSH_INTERVAL', 0.5)
+        self.queue = queue.Queue(maxsize=self.max_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+        self._counters = {
+            'enqueued': 0,
+            'written': 0,
+            'batches': 0,
+            'fallbacks': 0,
+            'failed': 0,
+        }
+        self._last_flush = None
+        self._atexit_registered = False
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def start(self):
+        """Start the flusher thread; called on first use so it runs in each worker after the fork"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='chat-write-behind', daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+
+    def offer(self, user_message, response):
+        """Queue an exchange; returns False if it has to be saved by the caller"""
+        if not self.enabled or self._stopping.is_set():
+            return False
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+        try:
+            self.queue.put_nowait((user_message, response))
+        except queue.Full:
+            self._count('fallbacks')
+            return False
+        self._count('enqueued')
+        return True
+
+    def save(self, user_message, response):
+        """Queue an exchange, or save it right away when write-behind is off or full"""
+        if not self.offer(user_message, response):
+            record_exchange(user_message, response)
+
+    def _take_batch(self, first):
+        """Collect up to batch_size exchanges, waiting at most flush_interval after the first"""
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                return batch
+
+    def _write(self, batch):
+        """Save a batch, isolating bad exchanges if the bulk insert fails"""
+        try:
+            with metrics.timer('db_flush'):
+                record_exchanges(batch)
+            self._count('written', len(batch))
+        except Exception as e:
+            print(f"Error saving queued chat messages: {e}")
+            for user_message, response in batch:
+                try:
+                    record_exchange(user_message, response)
+                    self._count('written')
+                except Exception as e:
+                    print(f"Error saving chat message: {e}")
+                    self._count('failed')
+                    metrics.inc('chat_errors_total', stage='db_save')
+        finally:
+            self._count('batches')
+            self._last_flush = time.time()
+            for _ in batch:
+                self.queue.task_done()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                first = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            self._write(self._take_batch(first))
+            # The flusher thread holds its own connection
+            close_old_connections()
+
+    def flush(self, timeout=5.0):
+        """Save everything queued so far, including batches being written by the flusher"""
+        batch = self._drain()
+        if batch:
+            self._write(batch)
+        deadline = time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.queue.all_tasks_done.wait(remaining)
+
+    def stop(self, timeout=10.0):
+        """Stop the flusher and save whatever is still queued"""
+        self._stopping.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+        self.flush(timeout)
+
+    def stats(self):
+        """Return queue depth and write counters"""
+        with self._lock:
+            stats = dict(self._counters)
+        stats.update({
+            'enabled': self.enabled,
+            'depth': self.queue.qsize(),
+            'max_size': self.max_size,
+            'batch_size': self.batch_size,
+            'flush_interval': self.flush_interval,
+            'flusher_alive': self._thread is not None and self._thread.is_alive(),
+            'last_flush': self._last_flush,
+        })
+        return stats
+
+
+exchange_writer = ExchangeWriter()
+metrics.gauge('chat_write_behind_queue_depth', exchange_writer.queue.qsize)
@@ -0,0 +1,166 @@
+import re
+import json
+from functools import lru_cache
+from django.conf import settings
+
+_SPACE_RE = re.compile(r'[ \t]+')
+
+# Example values shown in the response format, in column order
+FIELD_EXAMPLES = {
+    'company_name': 'Company Name',
+    'location': 'City, Country',
+    'industry': 'Industry/Sector',
+    'funding_stage': 'Series A/B/C',
+    'funding_amount': '$X million',
+    'established_year': 'YYYY',
+    'investors': 'Key investors',
+}
+
+# Columns of a table when the query does not name any fields
+DEFAULT_FIELDS = frozenset([
+    'company_name', 'location', 'industry', 'funding_stage',
+    'funding_amount', 'established_year', 'investors',
+])
+
+# Rough output tokens of a typical value per field
+FIELD_VALUE_TOKENS = {
+    'company_name': 6,
+    'location': 6,
+    'industry': 6,
+    'funding_stage': 4,
+    'funding_amount': 5,
+    'established_year': 3,
+    'investors': 16,
+}
+CUSTOM_VALUE_TOKENS = 12
+# Braces and separators of a row, and the summary plus JSON frame of a response
+ROW_OVERHEAD_TOKENS = 4
+RESPONSE_OVERHEAD_TOKENS = 96
+
+
+def compact(text):
+    """Strip indentation, blank lines and repeated spaces from a prompt"""
+    lines = (_SPACE_RE.sub(' ', line).strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines if line)
+
+
+def ordered_fields(fields):
+    """Known fields in table order, then custom fields alphabetically"""
+    known = [field for field in FIELD_EXAMPLES if field in fields]
+    return known + sorted(field for field in fields if field not in FIELD_EXAMPLES)
+
+
+class PromptTemplate:
+    """A prompt whose static text is compacted once, at construction.
+
+    Placeholders use ``str.format`` syntax; substituted values are inserted
+    as they are.
+    """
+
+    def __init__(self, template):
+        self.template = compact(template)
+
+    def render(self, **values):
+        return self.template.format(**values)
+
+
+SYSTEM_PROMPT = PromptTemplate("""
+    You are a highly knowledgeable AI assistant specializing in venture capital and startups.
+    {task}
+
+    ### INSTRUCTIONS:
+    1. Return {rows} real startups, not mock data
+    2. Provide accurate, SPECIFIC numerical or factual data for: {fields}
+       (team size: number of employees, funding: amount raised, investors: key investors, revenue: annual revenue)
+    3. Format values consistently: money "$XM" or "$XB", years YYYY, commas for thousands
+    4. Only include the fields listed in the response format, no metadata or descriptive fields
+    {custom}
+
+    ### RESPONSE FORMAT:
+    Return ONLY minified JSON in exactly this shape:
+    {example}
+""")
+
+
+ENRICHMENT_PROMPT = PromptTemplate("""
+    You are a highly knowledgeable AI assistant specializing in venture capital and startups.
+    For each company below, provide {content}.
+
+    ### COMPANIES:
+    {names}
+
+    ### RESPONSE FORMAT:
+    Return ONLY a minified JSON object mapping every company name, exactly as written above, to its value:
+    {{"Company Name":"value"}}
+
+    ### RULES:
+    1. Provide SPECIFIC numerical or factual data, or "N/A" if it is not known
+    2. Format values consistently: money "$XM" or "$XB", years YYYY, commas for thousands
+""")
+
+
+def render_enrichment_prompt(content, names):
+    """The system prompt asking for one value per company"""
+    return ENRICHMENT_PROMPT.render(content=content, names='\n'.join(f'- {name}' for name in names))
+
+
+def example_row(fields, custom_column=None):
+    row = {}
+    for field in ordered_fields(fields):
+        if custom_column and field == custom_column['name']:
+            row[field] = custom_column['content']
+        else:
+            row[field] = FIELD_EXAMPLES.get(field, field.replace('_', ' ').title())
+    return row
+
+
+@lru_cache(maxsize=512)
+def _render_system_prompt(location, fields, rows, custom_name, custom_content):
+    custom_column = {'name': custom_name, 'content': custom_content} if custom_name else None
+    example = {
+        'summary': 'Brief overview of the startups',
+        'data': {
+            'table_name': 'Startup Information',
+            'companies': [example_row(fields, custom_column)],
+        },
+    }
+    return SYSTEM_PROMPT.render(
+        task=f'Find startups in {location}' if location else 'List notable startups',
+        rows=f'exactly {rows}' if rows else f"up to {getattr(settings, 'GROQ_DEFAULT_ROWS', 10)}",
+        fields=', '.join(ordered_fields(fields)),
+        custom=f'5. For the column "{custom_name}", provide {custom_content}' if custom_name else '',
+        example=json.dumps(example, separators=(',', ':')),
+    ).replace('\n\n', '\n')
+
+
+def render_system_prompt(location, fields, rows=None, custom_column=None):
+    """The system prompt for a query, memoized per distinct set of parameters"""
+    return _render_system_prompt(
+        location,
+        frozenset(fields),
+        rows,
+        custom_column['name'] if custom_column else None,
+        custom_column['content'] if custom_column else None,
+    )
+
+
+def estimate_output_tokens(fields, rows):
+    """Estimate the completion tokens of a response with rows x fields values"""
+    per_row = ROW_OVERHEAD_TOKENS
+    for field in fields:
+        # The key is repeated in every row of the JSON output
+        per_row += len(field) // 4 + 2 + FIELD_VALUE_TOKENS.get(field, CUSTOM_VALUE_TOKENS)
+    return RESPONSE_OVERHEAD_TOKENS + per_row * rows
+
+
+def estimate_request_tokens(messages, max_tokens):
+    """Upper bound of the tokens a completion request counts against the Groq quota"""
+    return sum(len(message['content']) for message in messages) // 4 + max_tokens
+
+
+def max_tokens_for(fields, rows=None):
+    """max_tokens for a completion, from the estimated output size plus headroom"""
+    rows = rows or getattr(settings, 'GROQ_DEFAULT_ROWS', 10)
+    estimate = estimate_output_tokens(fields, rows)
+    budget = int(estimate * getattr(settings, 'GROQ_MAX_TOKENS_HEADROOM', 1.5))
+    return max(getattr(settings, 'GROQ_MIN_MAX_TOKENS', 256), min(budget, getattr(settings, 'GROQ_MAX_TOKENS', 4096)))
@@ -0,0 +1,112 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+# Keywords that make a field relevant to the user's query
+FIELD_KEYWORDS = {
+    'company_name': ['company', 'startup', 'business', 'organization', 'companies', 'startups', 'businesses'],
+    'location': ['location', 'based in', 'from', 'in', 'where'],
+    'funding_amount': ['funding', 'raised', 'investment', 'money'],
+    'investors': ['investors', 'backed by', 'invested by', 'vc', 'vcs', 'venture capital'],
+    'industry': ['industry', 'sector', 'field', 'domain'],
+    'established_year': ['year', 'established', 'founded', 'started'],
+    'funding_stage': ['stage', 'series', 'round'],
+}
+
+# Words that end a location phrase ("startups in Berlin with investors")
+LOCATION_STOP_WORDS = [
+    'with', 'that', 'which', 'who', 'having', 'have', 'has', 'include', 'including',
+    'founded', 'established', 'backed', 'by', 'sorted', 'ordered', 'ranked',
+]
+
+QueryAnalysis = namedtuple('QueryAnalysis', ['fields', 'location', 'custom_column', 'row_count'])
+
+
+_WORD_RE = re.compile(r"[a-z0-9$']+")
+
+# "10 startups", "top 25 fintech companies"
+_ROW_COUNT_RE = re.compile(r'\b(\d{1,3})\s+(?:[\w-]+\s+){0,3}?(?:startups|companies|businesses)\b', re.IGNORECASE)
+
+_CUSTOM_COLUMN_RE = re.compile(r'\binclude\s+(\S.*?)\s+as\s+(\S.*?)(?=\.|$)', re.IGNORECASE | re.DOTALL)
+
+LOCATION_PREPOSITIONS = {'in', 'at', 'from'}
+
+
+class QueryAnalyzer:
+    """Precompiled analyzer for prospecting queries.
+
+    The message is lowercased and split into words once; single-word and
+    two-word keywords are resolved with dictionary lookups, so matching is
+    on whole words ("in" no longer matches "fintech"). The location and
+    custom column ("include X as Y") patterns are compiled at construction
+    and only run when their trigger words occur in the message.
+    """
+
+    def __init__(self, field_keywords=None, location_stop_words=None):
+        field_keywords = field_keywords or FIELD_KEYWORDS
+        self.word_fields = {}
+        self.pair_fields = {}
+        for field_name, keywords in field_keywords.items():
+            for keyword in keywords:
+                words = tuple(keyword.lower().split())
+                if len(words) == 1:
+                    self.word_fields[words[0]] = field_name
+                else:
+                    self.pair_fields[words] = field_name
+
+        stop_words = '|'.join(
+            re.escape(word).replace(r'\ ', r'\s+')
+            for word in sorted(location_stop_words or LOCATION_STOP_WORDS, key=len, reverse=True)
+        )
+        self.location_re = re.compile(
+            r'\b(?:in|at|from)\s+([^.,;?!]+?)(?=\s+(?:' + stop_words + r')\b|[.,;?!]|$)',
+            re.IGNORECASE,
+        )
+
+    def analyze(self, message):
+        """Return the QueryAnalysis for a user message"""
+        words = _WORD_RE.findall(message.lower())
+        word_fields = self.word_fields
+
+        # Always include company_name as it's needed for context
+        fields = {'company_name'}
+        fields.update(word_fields[word] for word in words if word in word_fields)
+        if self.pair_fields:
+            pair_fields = self.pair_fields
+            fields.update(pair_fields[pair] for pair in zip(words, words[1:]) if pair in pair_fields)
+
+        custom_column = None
+        if 'include' in words:
+            match = _CUSTOM_COLUMN_RE.search(message)
+            if match:
+                custom_column = {
+                    'content': match.group(1).strip(),
+                    'name': match.group(2).strip(),
+                }
+
+        row_count = None
+        if any(word.isdigit() for word in words):
+            match = _ROW_COUNT_RE.search(message)
+            if match:
+                row_count = int(match.group(1)) or None
+
+        location = None
+        if not LOCATION_PREPOSITIONS.isdisjoint(words):
+            match = self.location_re.search(message)
+            if match:
+                location = match.group(1).strip()
+                fields.add('location')
+
+        return QueryAnalysis(frozenset(fields), location, custom_column, row_count)
+
+
+analyzer = QueryAnalyzer()
+
+
+@lru_cache(maxsize=1024)
+def analyze_query(message):
+    """Analyze a user message with the shared analyzer, memoized per message.
+
+    The custom column dict is shared between callers and must not be modified.
+    """
+    return analyzer.analyze(message)
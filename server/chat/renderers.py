@@ -0,0 +1,101 @@
+import json
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from .export import table_columns
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets clients send ``Accept: text/event-stream`` to streaming actions"""
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Streaming responses bypass rendering; this only formats early errors
+        return f'event: error\ndata: {json.dumps(data)}\n\n'.encode(self.charset)
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Lets clients send ``Accept: application/x-ndjson`` to streaming actions"""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Streaming responses bypass rendering; this only formats early errors
+        return (json.dumps(data) + '\n').encode(self.charset)
+
+
+class CSVRenderer(BaseRenderer):
+    """Lets clients ask export actions for CSV with ``?format=csv``"""
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Exports are streamed and send their own errors as JSON; this only
+        # formats errors raised by the framework, e.g. authentication
+        return json.dumps(data).encode(self.charset)
+
+
+class XLSXRenderer(BaseRenderer):
+    """Lets clients ask export actions for XLSX with ``?format=xlsx``"""
+    media_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    format = 'xlsx'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Exports are streamed and send their own errors as JSON; this only
+        # formats errors raised by the framework, e.g. authentication
+        return json.dumps(data).encode('utf-8')
+
+
+def columnar_table(rows):
+    """``{'columns': [...], 'rows': [[...]]}`` for a list of row dicts"""
+    columns = table_columns(rows)
+    return {
+        'columns': columns,
+        'rows': [[row.get(column) for column in columns] for row in rows],
+    }
+
+
+def to_columnar(data):
+    """Compact form of a payload.
+
+    Every ``companies`` list of dicts becomes a columnar table, and stored
+    ``bot_response`` strings are sent as a structured ``response`` instead
+    of JSON escaped a second time.
+    """
+    if isinstance(data, list):
+        return [to_columnar(item) for item in data]
+    if not isinstance(data, dict):
+        return data
+    compact = {}
+    for key, value in data.items():
+        if key == 'bot_response' and isinstance(value, str):
+            try:
+                compact['response'] = to_columnar(json.loads(value))
+                continue
+            except ValueError:
+                pass
+        if key == 'companies' and isinstance(value, list) and all(isinstance(row, dict) for row in value):
+            compact[key] = columnar_table(value)
+        else:
+            compact[key] = to_columnar(value)
+    return compact
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    """Opt-in compact JSON, asked for with ``?format=columnar`` or its media type in ``Accept``"""
+    media_type = 'application/vnd.prospectpro.columnar+json'
+    format = 'columnar'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(to_columnar(data), accepted_media_type, renderer_context)
+
+
+def wants_columnar(request):
+    """Content negotiation of the compact form for plain Django views"""
+    return (
+        request.GET.get('format') == ColumnarJSONRenderer.format
+        or ColumnarJSONRenderer.media_type in request.headers.get('Accept', '')
+    )
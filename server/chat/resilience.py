@@ -0,0 +1,312 @@
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from django.conf import settings
+import groq
+
+from .admission import AdmissionController
+from .metrics import metrics
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when the request deadline runs out before the upstream call succeeds"""
+
+
+class Deadline:
+    """Absolute point in time by which a request has to be answered"""
+
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+
+def is_retryable(error):
+    """Connection errors, timeouts, 429 and 5xx are worth another attempt"""
+    if isinstance(error, groq.APIConnectionError):
+        return True
+    if isinstance(error, groq.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def is_failure(error):
+    """Errors that count against the health of the upstream; 429 is a quota, not an outage"""
+    if isinstance(error, groq.APIStatusError) and error.status_code == 429:
+        return False
+    return is_retryable(error)
+
+
+def retry_after(error):
+    """Seconds from a Retry-After header of an upstream error, if any"""
+    response = getattr(error, 'response', None)
+    value = response.headers.get('retry-after') if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class LatencyTracker:
+    """Rolling window of successful upstream call durations"""
+
+    def __init__(self, window):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, fraction, min_samples):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            samples = sorted(self._samples)
+        return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+class UpstreamCaller:
+    """Deadline-aware retries and hedged requests for upstream LLM calls.
+
+    ``fn(timeout)`` performs one attempt; ``timeout`` is the time left
+    until the deadline, so no attempt outlives the request. Retryable
+    errors are retried with full-jitter exponential backoff (or the
+    server's Retry-After) as long as the backoff still fits in the
+    remaining budget.
+
+    With hedging on, an attempt that is still running after the p95 of
+    recent call durations gets a second, identical request, and whichever
+    finishes first wins. Hedges are capped at ``hedge_max_extra_ratio`` of
+    all calls. Async losers are cancelled; sync losers cannot be
+    interrupted and finish in the background with their result discarded.
+
+    Calls go through ``admission`` first: each holds a concurrency slot
+    for its duration, and each attempt, hedges included, has to pass the
+    circuit breaker and the shared quotas. ``tokens`` is what one attempt
+    counts against the token quota.
+    """
+
+    def __init__(self, max_attempts=None, base_delay=None, max_delay=None, hedge_enabled=None,
+                 hedge_quantile=None, hedge_min_delay=None, hedge_max_extra_ratio=None,
+                 hedge_min_samples=None, window=None, max_threads=None, admission=None):
+        self.max_attempts = max_attempts or getattr(settings, 'GROQ_RETRY_MAX_ATTEMPTS', 3)
+        self.base_delay = base_delay or getattr(settings, 'GROQ_RETRY_BASE_DELAY', 0.5)
+        self.max_delay = max_delay or getattr(settings, 'GROQ_RETRY_MAX_DELAY', 8.0)
+        self.hedge_enabled = getattr(settings, 'GROQ_HEDGE_ENABLED', False) if hedge_enabled is None else hedge_enabled
+        self.hedge_quantile = hedge_quantile or getattr(settings, 'GROQ_HEDGE_QUANTILE', 0.95)
+        self.hedge_min_delay = hedge_min_delay or getattr(settings, 'GROQ_HEDGE_MIN_DELAY', 1.0)
+        self.hedge_max_extra_ratio = (
+            getattr(settings, 'GROQ_HEDGE_MAX_EXTRA_RATIO', 0.05)
+            if hedge_max_extra_ratio is None else hedge_max_extra_ratio
+        )
+        self.hedge_min_samples = hedge_min_samples or getattr(settings, 'GROQ_HEDGE_MIN_SAMPLES', 20)
+        self.latency = LatencyTracker(window or getattr(settings, 'GROQ_HEDGE_WINDOW', 200))
+        self._max_threads = max_threads or getattr(settings, 'GROQ_HEDGE_MAX_THREADS', 32)
+        self.admission = admission or AdmissionController()
+        self._executor = None
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._hedges = 0
+
+    @property
+    def executor(self):
+        # Created on first use so no threads exist before gunicorn forks
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self._max_threads, thread_name_prefix='groq-hedge')
+        return self._executor
+
+    def hedge_delay(self, deadline):
+        """Seconds to wait before hedging, or None if no hedge should be sent"""
+        if not self.hedge_enabled:
+            return None
+        threshold = self.latency.quantile(self.hedge_quantile, self.hedge_min_samples)
+        if threshold is None:
+            return None
+        threshold = max(threshold, self.hedge_min_delay)
+        return threshold if threshold < deadline.remaining() else None
+
+    def _take_hedge(self, tokens):
+        """Reserve a hedge if the extra-cost budget and the quotas allow it"""
+        with self._lock:
+            if self._hedges + 1 > self.hedge_max_extra_ratio * self._calls:
+                return False
+            self._hedges += 1
+        if self.admission.try_extra(tokens):
+            return True
+        with self._lock:
+            self._hedges -= 1
+        return False
+
+    def _count_call(self):
+        with self._lock:
+            self._calls += 1
+
+    def _backoff(self, attempt, error, deadline):
+        """Delay before the next attempt, or None if there is no time or attempt left"""
+        if attempt + 1 >= self.max_attempts or not is_retryable(error):
+            return None
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        server_delay = retry_after(error)
+        if server_delay is not None:
+            delay = max(delay, server_delay)
+        # Leave time for the next attempt itself
+        if delay >= deadline.remaining() * 0.5:
+            return None
+        return delay
+
+    def _record(self, started, error=None):
+        duration = time.perf_counter() - started
+        if error is None:
+            self.latency.add(duration)
+        self.admission.record(error is not None and is_failure(error), duration)
+
+    def _timed(self, fn, timeout):
+        started = time.perf_counter()
+        try:
+            result = fn(timeout)
+        except Exception as error:
+            self._record(started, error)
+            raise
+        self._record(started)
+        return result
+
+    def _attempt(self, fn, deadline, hedge, tokens):
+        delay = self.hedge_delay(deadline) if hedge else None
+        if delay is None:
+            return self._timed(fn, deadline.remaining())
+
+        primary = self.executor.submit(self._timed, fn, deadline.remaining())
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._take_hedge(tokens):
+            return primary.result(timeout=deadline.remaining())
+
+        metrics.inc('chat_hedges_total', outcome='sent')
+        secondary = self.executor.submit(self._timed, fn, deadline.remaining())
+        pending = {primary, secondary}
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=deadline.remaining(), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if future is secondary:
+                        metrics.inc('chat_hedges_total', outcome='won')
+                    for loser in pending:
+                        loser.cancel()
+                    return future.result()
+                error = future.exception()
+        if error is not None:
+            raise error
+        raise DeadlineExceeded('Upstream call did not finish before the deadline')
+
+    def call(self, fn, deadline, hedge=True, tokens=0, slot=True):
+        """Call fn(timeout) with retries and optional hedging within the deadline.
+
+        ``slot`` is False when the caller already holds an admission slot,
+        e.g. to keep it while a stream is consumed.
+        """
+        self._count_call()
+        with self.admission.slot(deadline) if slot else nullcontext():
+            for attempt in range(self.max_attempts):
+                if deadline.expired:
+                    break
+                self.admission.before_attempt(deadline, tokens)
+                try:
+                    return self._attempt(fn, deadline, hedge, tokens)
+                except Exception as error:
+                    delay = self._backoff(attempt, error, deadline)
+                    if delay is None:
+                        raise
+                    metrics.inc('chat_retries_total')
+                    print(f"Retrying Groq call in {delay:.2f}s after: {str(error)}")
+                    time.sleep(delay)
+        metrics.inc('chat_errors_total', stage='deadline')
+        raise DeadlineExceeded('Request deadline exceeded')
+
+    async def _atimed(self, coro_fn, timeout):
+        started = time.perf_counter()
+        try:
+            result = await coro_fn(timeout)
+        except Exception as error:
+            self._record(started, error)
+            raise
+        self._record(started)
+        return result
+
+    async def _aattempt(self, coro_fn, deadline, hedge, tokens):
+        delay = self.hedge_delay(deadline) if hedge else None
+        if delay is None:
+            return await self._atimed(coro_fn, deadline.remaining())
+
+        primary = asyncio.ensure_future(self._atimed(coro_fn, deadline.remaining()))
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done or not self._take_hedge(tokens):
+                return await asyncio.wait_for(primary, timeout=deadline.remaining())
+
+            metrics.inc('chat_hedges_total', outcome='sent')
+            secondary = asyncio.ensure_future(self._atimed(coro_fn, deadline.remaining()))
+            pending = {primary, secondary}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=deadline.remaining(), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        if task is secondary:
+                            metrics.inc('chat_hedges_total', outcome='won')
+                        return task.result()
+                    error = task.exception()
+            if error is not None:
+                raise error
+            raise DeadlineExceeded('Upstream call did not finish before the deadline')
+        finally:
+            # Cancelling the loser closes its connection, so generation stops
+            for task in pending:
+                task.cancel()
+
+    async def acall(self, coro_fn, deadline, hedge=True, tokens=0):
+        """Async counterpart of call for coro_fn(timeout)"""
+        self._count_call()
+        async with self.admission.aslot(deadline):
+            for attempt in range(self.max_attempts):
+                if deadline.expired:
+                    break
+                await self.admission.abefore_attempt(deadline, tokens)
+                try:
+                    return await self._aattempt(coro_fn, deadline, hedge, tokens)
+                except Exception as error:
+                    delay = self._backoff(attempt, error, deadline)
+                    if delay is None:
+                        raise
+                    metrics.inc('chat_retries_total')
+                    print(f"Retrying Groq call in {delay:.2f}s after: {str(error)}")
+                    await asyncio.sleep(delay)
+        metrics.inc('chat_errors_total', stage='deadline')
+        raise DeadlineExceeded('Request deadline exceeded')
+
+    def stats(self):
+        with self._lock:
+            calls, hedges = self._calls, self._hedges
+        return {
+            'calls': calls,
+            'hedges': hedges,
+            'hedge_ratio': hedges / calls if calls else 0.0,
+            'hedge_threshold': self.latency.quantile(self.hedge_quantile, self.hedge_min_samples),
+            'admission': self.admission.stats(),
+        }
@@ -0,0 +1,323 @@
+import re
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.html import escape
+from .models import ChatMessage
+
+# FTS5 table written by store_results, one row per message with rowid = message id.
+# Deletes and edits of user_message are mirrored by triggers (migration 0007).
+SEARCH_TABLE = 'chat_search'
+SEARCH_COLUMNS = ['user_message', 'summary', 'companies', 'details']
+# BM25 weight of each column: a match in the question or a company name counts most
+SEARCH_WEIGHTS = (4.0, 1.0, 3.0, 1.0)
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+SNIPPET_TOKENS = 16
+# Newest messages sampled to tell the terms that are in most of them, see _common_terms
+DF_SAMPLE_ROWS = 10000
+
+# Company fields indexed as details, next to the custom columns in ``extra``
+DETAIL_FIELDS = ['location', 'industry', 'funding_stage', 'funding_amount', 'investors', 'established_year']
+
+_TERM_RE = re.compile(r'"([^"]*)"|(\w+\*?)', re.UNICODE)
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+# Words that carry no meaning in a search box, such as "that query about";
+# kept when they are all there is
+_STOP_WORDS = {
+    'a', 'an', 'and', 'the', 'of', 'in', 'on', 'for', 'with', 'about', 'that', 'this', 'to', 'from',
+    'by', 'at', 'is', 'are', 'was', 'were', 'me', 'my', 'or', 'show', 'list', 'find',
+    'query', 'question', 'asked', 'search', 'searched',
+}
+# Control characters FTS5 puts around matches; replaced after the snippet is HTML-escaped
+_MARK_START, _MARK_END = '\x02', '\x03'
+
+
+def search_available():
+    """Whether the FTS5 table exists, i.e. the database is SQLite with FTS5"""
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [SEARCH_TABLE])
+        return cursor.fetchone() is not None
+
+
+def _text(value):
+    if isinstance(value, (list, tuple)):
+        return ', '.join(_text(item) for item in value)
+    if isinstance(value, dict):
+        return ', '.join(f'{key} {_text(item)}' for key, item in value.items())
+    return '' if value is None else str(value)
+
+
+def search_document(chat_message, result_set, companies):
+    """Indexed text of a message: question, summary, company names and company details"""
+    details = []
+    for company in companies:
+        values = [getattr(company, field) for field in DETAIL_FIELDS]
+        values.extend(company.extra.values())
+        details.append(' '.join(text for text in map(_text, values) if text))
+    return (
+        chat_message.user_message,
+        result_set.summary if result_set is not None else '',
+        '\n'.join(company.company_name for company in companies),
+        '\n'.join(details),
+    )
+
+
+def index_messages(entries):
+    """Write the search rows of ``(chat_message, result_set, companies)`` entries, replacing old ones"""
+    if not search_available():
+        return 0
+    rows = [
+        (chat_message.pk, *search_document(chat_message, result_set, companies))
+        for chat_message, result_set, companies in entries
+    ]
+    if not rows:
+        return 0
+    columns = ', '.join(SEARCH_COLUMNS)
+    placeholders = ', '.join(['%s'] * (len(SEARCH_COLUMNS) + 1))
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+        cursor.executemany(f'INSERT INTO {SEARCH_TABLE} (rowid, {columns}) VALUES ({placeholders})', rows)
+    return len(rows)
+
+
+def indexed_ids(ids):
+    """Those of ``ids`` that already have a search row"""
+    ids = list(ids)
+    if not ids or not search_available():
+        return set()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {SEARCH_TABLE} WHERE rowid IN ({", ".join(["%s"] * len(ids))})', ids
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def optimize_index():
+    """Merge the index b-trees into one, which keeps queries fast after bulk writes"""
+    if search_available():
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+
+
+def match_terms(query):
+    """FTS5 terms for text typed into a search box, which a match ANDs.
+
+    ``"series b"`` stays a phrase and ``health*`` a prefix. Every term is
+    quoted, so operators and punctuation in the input cannot make the
+    expression invalid. Raises ValueError when nothing is left.
+    """
+    terms = []
+    for phrase, word in _TERM_RE.findall(query or ''):
+        if phrase:
+            words = _WORD_RE.findall(phrase)
+            if words:
+                terms.append((' '.join(words), False, False))
+        else:
+            prefix = word.endswith('*')
+            word = word.rstrip('*')
+            terms.append((word, prefix, word.lower() in _STOP_WORDS and not prefix))
+    if not terms:
+        raise ValueError('q must contain letters or digits')
+    if not all(stop for _, _, stop in terms):
+        terms = [term for term in terms if not term[2]]
+    return [f'"{text}"*' if prefix else f'"{text}"' for text, prefix, _ in terms]
+
+
+def _snippet(text):
+    text = escape(text or '')
+    return text.replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+def _page(params):
+    try:
+        limit = int(params.get('limit', DEFAULT_SEARCH_LIMIT))
+        offset = int(params.get('offset', 0))
+    except (TypeError, ValueError) as e:
+        raise ValueError('limit and offset must be integers') from e
+    return max(1, min(limit, MAX_SEARCH_LIMIT)), max(0, offset)
+
+
+def _common_terms(cursor, terms):
+    """Those of ``terms`` in half or more of the newest DF_SAMPLE_ROWS messages.
+
+    BM25 gives such a term no weight (FTS5 clamps its IDF to 1e-6), yet
+    computing that IDF reads every message the term is in. The sample
+    only decides whether to skip that work; near the cut-off the IDF is
+    close to zero either way. Prefix terms are always ranked.
+    """
+    cursor.execute(f'SELECT max(rowid) FROM {SEARCH_TABLE}')
+    newest = cursor.fetchone()[0]
+    if newest is None:
+        return set()
+    since = max(newest - DF_SAMPLE_ROWS, 0)
+    common = set()
+    for term in terms:
+        if term.endswith('*'):
+            continue
+        cursor.execute(
+            f'SELECT count(*) FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s AND rowid > %s', [term, since]
+        )
+        if 2 * cursor.fetchone()[0] >= newest - since:
+            common.add(term)
+    return common
+
+
+def _snippets(cursor, terms, ids):
+    """Snippets of messages ``ids`` around their matches of ``terms``"""
+    placeholders = ', '.join(['%s'] * len(ids))
+    if any(term.endswith('*') for term in terms):
+        # FTS5 expands a prefix again at every rowid lookup; scanning from the oldest id is cheaper
+        bound, params = f'rowid >= %s AND +rowid IN ({placeholders})', [min(ids), *ids]
+    else:
+        bound, params = f'rowid IN ({placeholders})', list(ids)
+    cursor.execute(
+        f"SELECT rowid, snippet({SEARCH_TABLE}, -1, %s, %s, '…', %s) FROM {SEARCH_TABLE} "
+        f'WHERE {SEARCH_TABLE} MATCH %s AND {bound}',
+        [_MARK_START, _MARK_END, SNIPPET_TOKENS, ' '.join(terms), *params]
+    )
+    return {pk: _snippet(text) for pk, text in cursor.fetchall()}
+
+
+def _with_terms(cursor, ranked, terms, needed):
+    """The first ``needed`` of the ``(id, score)`` in ``ranked`` whose messages match ``terms`` too"""
+    # Most messages have common terms, so twice the rows needed is usually one batch
+    kept = []
+    for start in range(0, len(ranked), 2 * needed):
+        batch = ranked[start:start + 2 * needed]
+        cursor.execute(
+            f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s '
+            f'AND rowid IN ({", ".join(["%s"] * len(batch))})',
+            [' '.join(terms), *(pk for pk, _ in batch)]
+        )
+        found = {row[0] for row in cursor.fetchall()}
+        kept.extend((pk, score) for pk, score in batch if pk in found)
+        if len(kept) >= needed:
+            break
+    return kept[:needed]
+
+
+def _ranked(terms, limit, offset):
+    """``(id, score, snippet)`` of one page of matches, best first.
+
+    BM25 is computed for every match before sorting, with the IDF of each
+    term taken over the whole history, so common terms would cost time in
+    proportion to the history. Terms found in most messages are left out
+    of the ranking, where they weigh nothing, and only checked on the best
+    matches of the others, a batch at a time; when every term is that
+    common, matches come newest first. Only the newest SEARCH_MAX_RANKED
+    matches are ranked: FTS5 walks matches newest first and stops at the
+    oldest of them, and the rowid bound keeps the ranking to that window.
+    Snippets are built for the page only.
+    """
+    window = getattr(settings, 'SEARCH_MAX_RANKED', 1000)
+    with connection.cursor() as cursor:
+        common = _common_terms(cursor, terms)
+        ranked_terms = [term for term in terms if term not in common]
+        if not ranked_terms:
+            cursor.execute(
+                f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s '
+                f'ORDER BY rowid DESC LIMIT %s OFFSET %s',
+                [' '.join(terms), limit, offset]
+            )
+            page = [(pk, 0.0) for pk, in cursor.fetchall()]
+        else:
+            expression = ' '.join(ranked_terms)
+            cursor.execute(
+                f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s '
+                f'ORDER BY rowid DESC LIMIT 1 OFFSET %s',
+                [expression, window - 1]
+            )
+            oldest = cursor.fetchone()
+            since = oldest[0] if oldest else 0
+            # Sorting bm25() values in SQLite is faster than FTS5's own ORDER BY rank
+            ranking = (
+                f'SELECT rowid, bm25({SEARCH_TABLE}, {", ".join(map(str, SEARCH_WEIGHTS))}) AS score '
+                f'FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s AND rowid >= %s ORDER BY score'
+            )
+            if not common:
+                cursor.execute(f'{ranking} LIMIT %s OFFSET %s', [expression, since, limit, offset])
+                page = cursor.fetchall()
+            else:
+                cursor.execute(ranking, [expression, since])
+                checked = [term for term in terms if term in common]
+                page = _with_terms(cursor, cursor.fetchall(), checked, offset + limit)[offset:]
+        if not page:
+            return []
+        snippets = _snippets(cursor, terms, [pk for pk, _ in page])
+    # bm25() is lower for better matches; report it as a score that grows with relevance
+    return [(pk, round(-score, 4) or 0.0, snippets.get(pk)) for pk, score in page]
+
+
+def _fallback(query, limit, offset):
+    """Substring matching, newest first, for databases without FTS5"""
+    queryset = ChatMessage.objects.all()
+    words = [word for word in _WORD_RE.findall(query) if word.lower() not in _STOP_WORDS] or _WORD_RE.findall(query)
+    for word in words:
+        queryset = queryset.filter(
+            Q(user_message__icontains=word)
+            | Q(result_set__summary__icontains=word)
+            | Q(result_set__companies__company_name__icontains=word)
+        )
+    ids = queryset.order_by('-timestamp', '-id').values_list('id', flat=True).distinct()[offset:offset + limit + 1]
+    return [(pk, None, None) for pk in ids]
+
+
+def search_messages(params):
+    """One page of messages matching ``q``, most relevant first.
+
+    Matches are ranked with BM25 over the question, the summary, the
+    company names and the company details of each message, weighted by
+    SEARCH_WEIGHTS; past SEARCH_MAX_RANKED matches, only the newest ones
+    are ranked, and matches of terms found in most messages, which BM25
+    cannot tell apart, come newest first with a score of 0. ``snippet`` is
+    HTML-escaped text around the best match, with matches in ``<mark>``.
+    ``limit`` and ``offset`` page through the matches; ``next_offset`` is
+    set when there are more. Raises ValueError for a missing query or
+    malformed parameters.
+    """
+    query = (params.get('q') or '').strip()
+    limit, offset = _page(params)
+    if search_available():
+        terms = match_terms(query)
+        expression = ' '.join(terms)
+        # One row more than the page tells whether there is a next one
+        matches = _ranked(terms, limit + 1, offset)
+    else:
+        expression = None
+        if not _WORD_RE.search(query):
+            raise ValueError('q must contain letters or digits')
+        matches = _fallback(query, limit, offset)
+
+    more = len(matches) > limit
+    matches = matches[:limit]
+    messages = {
+        message['id']: message
+        for message in ChatMessage.objects.filter(pk__in=[pk for pk, _, _ in matches]).values(
+            'id', 'user_message', 'timestamp', 'result_set__summary', 'result_set__row_count'
+        )
+    }
+    results = []
+    for pk, score, snippet in matches:
+        message = messages.get(pk)
+        if message is None:
+            continue
+        results.append({
+            'id': pk,
+            'timestamp': message['timestamp'].isoformat(),
+            'user_message': message['user_message'],
+            'summary': message['result_set__summary'] or '',
+            'row_count': message['result_set__row_count'] or 0,
+            'score': score,
+            'snippet': snippet if snippet is not None else escape(message['user_message']),
+        })
+    return {
+        'query': expression,
+        'limit': limit,
+        'offset': offset,
+        'next_offset': offset + limit if more else None,
+        'results': results,
+    }
@@ -0,0 +1,162 @@
+import re
+import math
+from collections import namedtuple
+from django.conf import settings
+from .entities import EntityResolver, canonical_name
+from .prompts import estimate_output_tokens
+
+# A way to split a list of startups into disjoint parts. ``keywords`` are
+# words that show a query already narrows this dimension down, in which case
+# splitting on it would contradict the query.
+Dimension = namedtuple('Dimension', ['name', 'values', 'instruction', 'keywords'])
+
+DIMENSIONS = {
+    'industry': Dimension(
+        'industry',
+        [
+            'fintech', 'healthtech or biotech', 'AI or data infrastructure', 'enterprise software or SaaS',
+            'e-commerce or consumer apps', 'climate tech or energy', 'mobility or logistics', 'edtech',
+            'deep tech, robotics or hardware', 'media, gaming or other sectors',
+        ],
+        'in {values}',
+        {
+            'fintech', 'insurtech', 'proptech', 'healthtech', 'health', 'medtech', 'biotech', 'ai', 'ml',
+            'saas', 'b2b', 'ecommerce', 'e-commerce', 'consumer', 'climate', 'cleantech', 'energy',
+            'mobility', 'logistics', 'edtech', 'hardware', 'robotics', 'deeptech', 'gaming', 'crypto',
+            'web3', 'blockchain', 'cybersecurity', 'foodtech', 'agritech', 'legaltech', 'hrtech',
+        },
+    ),
+    'funding_stage': Dimension(
+        'funding_stage',
+        ['pre-seed or seed', 'Series A', 'Series B', 'Series C or later', 'growth stage, pre-IPO or public'],
+        'at {values}',
+        {'seed', 'pre-seed', 'series', 'ipo', 'unicorn', 'unicorns', 'early-stage', 'late-stage', 'growth-stage'},
+    ),
+    'established_year': Dimension(
+        'established_year',
+        ['before 2010', 'from 2010 to 2014', 'from 2015 to 2018', 'from 2019 to 2021', 'in 2022 or later'],
+        'founded {values}',
+        set(),
+    ),
+    # Always available, whatever the query narrows down
+    'company_name': Dimension(
+        'company_name',
+        ['A to C', 'D to F', 'G to I', 'J to L', 'M to O', 'P to R', 'S to U', 'V to Z or a digit'],
+        'whose name starts with {values}',
+        set(),
+    ),
+}
+
+_WORD_RE = re.compile(r"[a-z0-9'-]+")
+_YEAR_RE = re.compile(r'\b(?:19|20)\d\d\b')
+
+
+class Segment(namedtuple('Segment', ['rows', 'instruction', 'count'])):
+    """One of ``count`` sub-queries, asking for ``rows`` startups matching ``instruction``"""
+
+    def prompt_section(self):
+        """Prompt instructions restricting a completion to its segment"""
+        return '\n'.join([
+            '### SEGMENT:',
+            f'Only include startups {self.instruction}.',
+            f'This is one of {self.count} parallel requests that split the list; the others cover the rest.',
+        ])
+
+
+def rows_per_completion(fields):
+    """Most rows one completion can return without running into GROQ_MAX_TOKENS.
+
+    Capped by GROQ_SEGMENT_ROWS: output time grows with the rows, so
+    smaller segments run in parallel finish sooner than one large one.
+    """
+    budget = getattr(settings, 'GROQ_MAX_TOKENS', 4096) / getattr(settings, 'GROQ_MAX_TOKENS_HEADROOM', 1.5)
+    per_row = estimate_output_tokens(fields, 1) - estimate_output_tokens(fields, 0)
+    fitting = int((budget - estimate_output_tokens(fields, 0)) // per_row)
+    return max(1, min(fitting, getattr(settings, 'GROQ_SEGMENT_ROWS', 20)))
+
+
+def _constrained(dimension, message, words):
+    if dimension.name == 'established_year':
+        return bool(_YEAR_RE.search(message))
+    return not dimension.keywords.isdisjoint(words)
+
+
+def _split(rows, parts):
+    """``rows`` spread over ``parts`` as evenly as possible"""
+    return [rows // parts + (1 if index < rows % parts else 0) for index in range(parts)]
+
+
+def _group(values, parts):
+    """``values`` cut into at most ``parts`` runs, joined with "or" """
+    parts = min(parts, len(values))
+    groups, start = [], 0
+    for size in _split(len(values), parts):
+        groups.append(' or '.join(values[start:start + size]))
+        start += size
+    return groups
+
+
+def plan_segments(message, fields, rows):
+    """Disjoint sub-queries covering a request for ``rows`` startups.
+
+    Returns an empty list when one completion can hold the rows. Otherwise
+    the values of the first dimension in GROQ_SEGMENT_DIMENSIONS that the
+    query does not already narrow down are cut into as many runs as
+    segments are needed, so together the segments cover every value
+    without overlapping; when there are too few values each one is split
+    further on the next dimension. Each segment asks for
+    GROQ_SEGMENT_OVERFETCH more rows than its share, to make up for
+    duplicates across segments.
+    """
+    per_segment = rows_per_completion(fields)
+    if not rows or rows <= per_segment:
+        return []
+    rows = min(rows, getattr(settings, 'GROQ_SEGMENT_MAX_ROWS', 200))
+    wanted = math.ceil(rows * (1 + getattr(settings, 'GROQ_SEGMENT_OVERFETCH', 0.2)))
+    count = math.ceil(wanted / per_segment)
+
+    words = set(_WORD_RE.findall(message.lower()))
+    names = getattr(settings, 'GROQ_SEGMENT_DIMENSIONS', list(DIMENSIONS))
+    dimensions = [
+        DIMENSIONS[name] for name in names
+        if name in DIMENSIONS and not _constrained(DIMENSIONS[name], message, words)
+    ]
+    if not dimensions:
+        return []
+    primary = dimensions[0]
+    if count <= len(primary.values) or len(dimensions) == 1:
+        groups = [[primary.instruction.format(values=values)] for values in _group(primary.values, count)]
+    else:
+        # Too few values: split each of them further on the next dimension
+        secondary = dimensions[1]
+        parts = math.ceil(count / len(primary.values))
+        groups = [
+            [primary.instruction.format(values=value), secondary.instruction.format(values=values)]
+            for value in primary.values
+            for values in _group(secondary.values, parts)
+        ]
+    return [
+        Segment(min(segment_rows, per_segment), ' and '.join(clauses), len(groups))
+        for clauses, segment_rows in zip(groups, _split(wanted, len(groups)))
+    ]
+
+
+def merge_companies(tables, limit=None):
+    """Company rows of several tables without duplicates, in table order.
+
+    Rows are duplicates when their names resolve to the same entity, e.g.
+    "Razorpay" in one segment and "Razorpay Software Pvt Ltd" in another.
+    """
+    resolver = EntityResolver()
+    companies = []
+    for rows in tables:
+        for row in rows:
+            name = str(row.get('company_name', ''))
+            key = canonical_name(name)
+            if not key or resolver.match(name)[0] is not None:
+                continue
+            resolver.add(key, name)
+            companies.append(row)
+            if limit and len(companies) >= limit:
+                return companies
+    return companies
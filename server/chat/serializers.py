@@ -1,7 +1,42 @@
 from rest_framework import serializers
-from .models import ChatMessage
+from .models import ChatMessage, Company, ResultSet
 
 class ChatMessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = ChatMessage
         fields = ['id', 'user_message', 'bot_response', 'timestamp']
+
+
+class ChatMessageSummarySerializer(serializers.ModelSerializer):
+    """History entry without the response blob"""
+    summary = serializers.SerializerMethodField()
+    row_count = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ChatMessage
+        fields = ['id', 'user_message', 'timestamp', 'summary', 'row_count']
+
+    def get_summary(self, obj):
+        result_set = getattr(obj, 'result_set', None)
+        return result_set.summary if result_set else ''
+
+    def get_row_count(self, obj):
+        result_set = getattr(obj, 'result_set', None)
+        return result_set.row_count if result_set else 0
+
+
+class CompanySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Company
+        fields = [
+            'position', 'company_name', 'location', 'industry', 'funding_stage',
+            'funding_amount', 'investors', 'established_year', 'extra', 'values', 'entity_key'
+        ]
+
+
+class ResultSetSerializer(serializers.ModelSerializer):
+    companies = CompanySerializer(many=True, read_only=True)
+
+    class Meta:
+        model = ResultSet
+        fields = ['chat_message', 'status', 'summary', 'table_name', 'columns', 'column_types', 'row_count', 'created_at', 'companies']
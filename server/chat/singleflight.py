@@ -0,0 +1,189 @@
+import time
+import uuid
+import asyncio
+import threading
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from .locks import worker_lock
+
+
+def _in_thread(method):
+    """Run a blocking cache operation off the event loop"""
+    return sync_to_async(method, thread_sensitive=False)
+
+
+class _Call:
+    """An in-flight call that other threads can wait on"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into a single upstream call.
+
+    Within a process, threads asking for a key that is already in flight wait
+    for the leader and share its result. Across gunicorn workers, the leader
+    holds a worker lock (see locks.worker_lock), advertises a token in the
+    shared cache and publishes its result under that token for a short time,
+    so followers in other workers poll for it instead of calling upstream
+    themselves. If the leader lets go without publishing, a follower takes
+    over; if waiting exceeds ``wait_timeout`` the follower calls upstream
+    itself rather than failing the request.
+    """
+
+    def __init__(self, alias=None, prefix='singleflight', lock_timeout=None,
+                 wait_timeout=None, result_ttl=None, poll_interval=None):
+        self.cache = caches[alias or getattr(settings, 'GROQ_CACHE_ALIAS', 'default')]
+        self.prefix = prefix
+        self.lock_timeout = lock_timeout or getattr(settings, 'GROQ_SINGLEFLIGHT_LOCK_TIMEOUT', 120)
+        self.wait_timeout = wait_timeout or getattr(settings, 'GROQ_SINGLEFLIGHT_WAIT_TIMEOUT', 120)
+        self.result_ttl = result_ttl or getattr(settings, 'GROQ_SINGLEFLIGHT_RESULT_TTL', 10)
+        self.poll_interval = poll_interval or getattr(settings, 'GROQ_SINGLEFLIGHT_POLL_INTERVAL', 0.1)
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+
+    def _leader_key(self, key):
+        return f'{self.prefix}:leader:{key}'
+
+    def _result_key(self, key, token):
+        # Results are tied to the leader's token so followers never pick up
+        # the result of an earlier, already finished call
+        return f'{self.prefix}:result:{key}:{token}'
+
+    def _try_acquire(self, key):
+        """Try to take the cross-worker lock, returning it on success"""
+        lock = worker_lock(self.cache, f'{self.prefix}:{key}', self.lock_timeout)
+        return lock if lock.acquire() else None
+
+    def _lead(self, key):
+        """Advertise a new leader token for followers to find the result under"""
+        token = uuid.uuid4().hex
+        self.cache.set(self._leader_key(key), token, timeout=self.lock_timeout)
+        return token
+
+    def _release(self, key, lock, token):
+        # Once a result is published the token stays up as long as the result,
+        # so followers that have not seen it yet can still find it
+        if token and self.cache.get(self._leader_key(key)) == token \
+                and self.cache.get(self._result_key(key, token)) is None:
+            self.cache.delete(self._leader_key(key))
+        lock.release()
+
+    def _published(self, key, token):
+        return self.cache.get(self._result_key(key, token)) if token else None
+
+    def _publish(self, key, token, result):
+        self.cache.set(self._result_key(key, token), result, timeout=self.result_ttl)
+        self.cache.touch(self._leader_key(key), self.result_ttl)
+
+    def _poll(self, key, seen):
+        """Check for the current leader's result; returns (result, leader token)"""
+        leader = self.cache.get(self._leader_key(key)) or seen
+        return self._published(key, leader), leader
+
+    def _run_shared(self, key, fn):
+        """Run fn at most once across workers for concurrent callers of key"""
+        deadline = time.monotonic() + self.wait_timeout
+        seen = None
+        while True:
+            lock = self._try_acquire(key)
+            if lock is not None:
+                token = None
+                try:
+                    # The leader we waited on may have published just before letting go
+                    result = self._published(key, seen)
+                    if result is None:
+                        token = self._lead(key)
+                        result = fn()
+                        self._publish(key, token, result)
+                    return result
+                finally:
+                    self._release(key, lock, token)
+
+            # Another worker is already computing this key
+            result, seen = self._poll(key, seen)
+            if result is not None:
+                return result
+            if time.monotonic() >= deadline:
+                return fn()
+            time.sleep(self.poll_interval)
+
+    def do(self, key, fn):
+        """Call fn for key, sharing the result with concurrent identical calls"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_shared(key, fn)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    async def _arun_shared(self, key, coro_fn):
+        """Async counterpart of _run_shared"""
+        deadline = time.monotonic() + self.wait_timeout
+        seen = None
+        while True:
+            lock = await _in_thread(self._try_acquire)(key)
+            if lock is not None:
+                token = None
+                try:
+                    result = await _in_thread(self._published)(key, seen)
+                    if result is None:
+                        token = await _in_thread(self._lead)(key)
+                        result = await coro_fn()
+                        await _in_thread(self._publish)(key, token, result)
+                    return result
+                finally:
+                    await _in_thread(self._release)(key, lock, token)
+
+            result, seen = await _in_thread(self._poll)(key, seen)
+            if result is not None:
+                return result
+            if time.monotonic() >= deadline:
+                return await coro_fn()
+            await asyncio.sleep(self.poll_interval)
+
+    async def ado(self, key, coro_fn):
+        """Await coro_fn for key, sharing the result with concurrent identical calls"""
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), key)
+        future = self._async_calls.get(flight_key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = loop.create_future()
+        self._async_calls[flight_key] = future
+        try:
+            result = await self._arun_shared(key, coro_fn)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else is waiting
+            future.exception()
+            raise
+        finally:
+            self._async_calls.pop(flight_key, None)
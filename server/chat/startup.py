@@ -0,0 +1,98 @@
+import time
+from django.conf import settings
+from django.urls import get_resolver
+from .metrics import metrics
+
+
+def record_phase(phase, started):
+    """Record how long a startup phase took since ``started`` (a perf_counter value)"""
+    seconds = time.perf_counter() - started
+    metrics.observe('chat_startup_duration_seconds', seconds, phase=phase)
+    return seconds
+
+
+def load_app():
+    """Import the URLconf and build the Groq service, as the first request would.
+
+    Django only loads the URLconf, and with it the views, on the first
+    request. Returns the service, or None if it cannot be built, e.g.
+    without GROQ_API_KEY.
+    """
+    from .services import get_groq_service
+    started = time.perf_counter()
+    get_resolver().url_patterns
+    record_phase('urlconf', started)
+
+    started = time.perf_counter()
+    try:
+        service = get_groq_service()
+    except Exception as e:
+        print(f"Error building the Groq service: {str(e)}")
+        return None
+    record_phase('service', started)
+    return service
+
+
+def warm_up():
+    """Get a freshly forked worker ready before it accepts requests.
+
+    Loads the app and opens GROQ_WARMUP_CONNECTIONS pooled connections to
+    the upstream, so the first request does not pay for imports, client
+    construction or the TCP and TLS handshakes.
+    """
+    if not getattr(settings, 'GROQ_WARMUP_ENABLED', True):
+        return
+    started = time.perf_counter()
+    service = load_app()
+    opened = 0
+    if service is not None:
+        connections_started = time.perf_counter()
+        opened = service.warm_up(
+            getattr(settings, 'GROQ_WARMUP_CONNECTIONS', 2),
+            getattr(settings, 'GROQ_WARMUP_TIMEOUT', 5)
+        )
+        record_phase('connections', connections_started)
+    print(f"Worker warmed up in {record_phase('warm_up', started):.3f}s, {opened} upstream connections open")
+
+
+async def awarm_up():
+    """Warm up the async Groq client of the worker's event loop"""
+    if not getattr(settings, 'GROQ_WARMUP_ENABLED', True):
+        return
+    from .services import get_groq_service
+    started = time.perf_counter()
+    try:
+        service = get_groq_service()
+    except Exception as e:
+        print(f"Error building the Groq service: {str(e)}")
+        return
+    opened = await service.awarm_up(
+        getattr(settings, 'GROQ_WARMUP_CONNECTIONS', 2),
+        getattr(settings, 'GROQ_WARMUP_TIMEOUT', 5)
+    )
+    print(f"Event loop warmed up in {record_phase('async_warm_up', started):.3f}s, {opened} upstream connections open")
+
+
+def with_lifespan(application):
+    """Wrap an ASGI application to run awarm_up on lifespan startup.
+
+    Django's ASGI handler only speaks HTTP; the async client is bound to the
+    event loop, which only exists once the server runs, so it is warmed up
+    from the lifespan protocol instead of a gunicorn hook.
+    """
+    async def lifespan(scope, receive, send):
+        if scope['type'] != 'lifespan':
+            return await application(scope, receive, send)
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await awarm_up()
+                except Exception as e:
+                    print(f"Error warming up the event loop: {str(e)}")
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    return lifespan
@@ -0,0 +1,178 @@
+import re
+import json
+from django.db import transaction
+from .knowledge import company_index
+from .metrics import metrics
+from .models import ChatMessage, Company, ResultSet
+from .normalize import normalize_table
+from .search import index_messages
+
+# Company fields stored in typed columns; everything else goes to ``extra``
+COMPANY_COLUMNS = {
+    'company_name': 255,
+    'location': 255,
+    'industry': 255,
+    'funding_stage': 100,
+    'funding_amount': 100,
+    'investors': None,
+}
+
+_YEAR_RE = re.compile(r'\b(1[89]\d\d|20\d\d)\b')
+
+
+def _column_key(key):
+    return key.strip().lower().replace(' ', '_')
+
+
+def _parse_year(value):
+    match = _YEAR_RE.search(str(value))
+    return int(match.group(1)) if match else None
+
+
+def _guarded(stage, fn, default=None, savepoint=True):
+    """Run one step of storing results, in its own savepoint if it writes.
+
+    The tables, search rows and knowledge index are all derived from the
+    saved message, so a failing step is logged and skipped instead of
+    losing the message or the other steps.
+    """
+    try:
+        if not savepoint:
+            return fn()
+        with transaction.atomic():
+            return fn()
+    except Exception as e:
+        print(f"Error storing results ({stage}): {e}")
+        metrics.inc('chat_errors_total', stage=stage)
+        return default
+
+
+def build_company(result_set, position, row, values=None):
+    """Map a company row from a response onto a Company instance"""
+    company = Company(result_set=result_set, position=position, extra={}, values=values or {})
+    for key, value in row.items():
+        column = _column_key(key)
+        if column in COMPANY_COLUMNS:
+            text = '' if value is None else str(value)
+            max_length = COMPANY_COLUMNS[column]
+            setattr(company, column, text[:max_length] if max_length else text)
+        elif column == 'established_year':
+            company.established_year = _parse_year(value)
+            if company.established_year is None and value:
+                # Keep values that are not a plain year, e.g. "Unknown"
+                company.extra[key] = value
+        else:
+            company.extra[key] = value
+    return company
+
+
+def _response_table(response):
+    """Return (data, table) dicts of a successful response"""
+    if not isinstance(response, dict) or response.get('status') != 'success':
+        return {}, {}
+    data = response.get('data') if isinstance(response.get('data'), dict) else {}
+    table = data.get('data') if isinstance(data.get('data'), dict) else {}
+    return data, table
+
+
+def build_rows(response):
+    """Company rows of a successful response"""
+    _, table = _response_table(response)
+    return [row for row in table.get('companies') or [] if isinstance(row, dict)]
+
+
+def build_result_set(chat_message, response):
+    """Build the ResultSet and Company rows for a response, without saving them"""
+    if not isinstance(response, dict):
+        response = {}
+    data, table = _response_table(response)
+    rows = build_rows(response)
+
+    columns = []
+    for row in rows:
+        for key in row:
+            if key not in columns:
+                columns.append(key)
+
+    result_set = ResultSet(
+        chat_message=chat_message,
+        status=response.get('status') or 'error',
+        summary=str(data.get('summary') or ''),
+        table_name=str(table.get('table_name') or '')[:255],
+        columns=columns,
+        row_count=len(rows),
+    )
+    # Typed values are parsed once here so queries can sort and filter on them
+    result_set.column_types, values = _guarded(
+        'normalize', lambda: normalize_table(columns, rows), ({}, [{}] * len(rows)), savepoint=False
+    )
+    companies = [
+        build_company(result_set, position, row, row_values)
+        for position, (row, row_values) in enumerate(zip(rows, values))
+    ]
+    return result_set, companies
+
+
+def _create_tables(built):
+    result_sets = ResultSet.objects.bulk_create([result_set for result_set, _ in built])
+    companies = []
+    for result_set, (_, rows) in zip(result_sets, built):
+        for company in rows:
+            # Re-bind so the primary key assigned by bulk_create is picked up
+            company.result_set = result_set
+            companies.append(company)
+    # Name variants across responses share one key, for cross-response views
+    keys = _guarded(
+        'entity_keys',
+        lambda: company_index.entity_keys(company.company_name for company in companies),
+        [''] * len(companies),
+        savepoint=False
+    )
+    for company, key in zip(companies, keys):
+        company.entity_key = key[:255]
+    Company.objects.bulk_create(companies, batch_size=500)
+    return result_sets
+
+
+def store_results(pairs):
+    """Write result tables for (chat_message, response) pairs of saved messages"""
+    pairs = list(pairs)
+    built = [build_result_set(chat_message, response) for chat_message, response in pairs]
+    with transaction.atomic():
+        result_sets = _guarded('result_tables', lambda: _create_tables(built), [])
+        if result_sets:
+            _guarded('search_index', lambda: index_messages(
+                (result_set.chat_message, result_set, rows)
+                for result_set, (_, rows) in zip(result_sets, built)
+            ))
+
+        # Keep the company knowledge index up to date with model answers
+        _guarded('knowledge_index', lambda: company_index.ingest(
+            row
+            for _, response in pairs
+            if isinstance(response, dict) and response.get('source') != 'knowledge_index'
+            for row in build_rows(response)
+        ))
+    return result_sets
+
+
+def record_exchange(user_message, response):
+    """Save a chat exchange, then its result tables"""
+    # The message is committed first; storing its results never loses it
+    chat_message = ChatMessage.objects.create(
+        user_message=user_message,
+        bot_response=json.dumps(response)
+    )
+    store_results([(chat_message, response)])
+    return chat_message
+
+
+def record_exchanges(exchanges):
+    """Save many (user_message, response) exchanges, then their result tables"""
+    exchanges = list(exchanges)
+    chat_messages = ChatMessage.objects.bulk_create([
+        ChatMessage(user_message=user_message, bot_response=json.dumps(response))
+        for user_message, response in exchanges
+    ])
+    store_results(zip(chat_messages, (response for _, response in exchanges)))
+    return chat_messages
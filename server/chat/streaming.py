@@ -0,0 +1,112 @@
+import json
+from asgiref.sync import sync_to_async
+
+from .parsing import ResponseParseError, extract_json
+
+
+class CompanyStreamParser:
+    """Incremental JSON scanner that emits company objects as soon as they close.
+
+    Completion text is fed in chunks as it arrives from the model. The scanner
+    tracks string/escape state and nesting, and whenever an object inside the
+    ``companies`` array is closed it is decoded and returned from ``feed``.
+    Text before the first ``{`` (markdown fences, preambles) is ignored.
+    """
+
+    def __init__(self, array_key='companies'):
+        self.array_key = array_key
+        self.text = ''
+        self.pos = 0
+        self.started = False
+        self.in_string = False
+        self.escaped = False
+        self.string_start = None
+        self.last_string = None
+        self.pending_key = None
+        # Stack of (container, key) for every open '{' / '['
+        self.stack = []
+        self.item_start = None
+
+    def _in_target_array(self):
+        return bool(self.stack) and self.stack[-1] == ('[', self.array_key)
+
+    def feed(self, chunk):
+        """Consume a chunk of completion text and return any completed companies"""
+        self.text += chunk
+        text = self.text
+        companies = []
+
+        for i in range(self.pos, len(text)):
+            char = text[i]
+
+            if not self.started:
+                if char != '{':
+                    continue
+                self.started = True
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    self.last_string = text[self.string_start:i]
+                continue
+
+            if char == '"':
+                self.in_string = True
+                self.string_start = i + 1
+            elif char == ':':
+                self.pending_key = self.last_string
+            elif char in '{[':
+                if char == '{' and self._in_target_array():
+                    self.item_start = i
+                self.stack.append((char, self.pending_key))
+                self.pending_key = None
+            elif char in '}]':
+                if self.stack:
+                    self.stack.pop()
+                if char == '}' and self.item_start is not None and self._in_target_array():
+                    try:
+                        companies.append(extract_json(text[self.item_start:i + 1]))
+                    except ResponseParseError:
+                        # Leave malformed rows to the final tolerant parse
+                        pass
+                    self.item_start = None
+            elif char == ',':
+                self.pending_key = None
+
+        self.pos = len(text)
+        return companies
+
+
+def sse_event(event, data):
+    """Format a server-sent event"""
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+async def iterate_in_thread(iterator):
+    """Drive a blocking iterator from a worker thread for async streaming.
+
+    Django buffers synchronous iterators completely when serving a
+    StreamingHttpResponse over ASGI, so each step is pulled off the event loop
+    instead to keep chunks flowing as they are produced. Steps are
+    thread-sensitive: Django gives every request its own such thread, so all
+    steps of one response run on the same thread and a database cursor read
+    across them stays with its connection.
+    """
+    iterator = iter(iterator)
+    sentinel = object()
+    next_item = sync_to_async(next, thread_sensitive=True)
+    try:
+        while True:
+            item = await next_item(iterator, sentinel)
+            if item is sentinel:
+                break
+            yield item
+    finally:
+        # A client that disconnects stops the loop; close the iterator like
+        # the WSGI server would, so its cleanup runs
+        if hasattr(iterator, 'close'):
+            await sync_to_async(iterator.close, thread_sensitive=True)()
@@ -0,0 +1,268 @@
+from django.db.models import Avg, CharField, Count, F, FloatField, Max, Min, Sum
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import Cast, Lower
+from .entities import canonical_name
+from .knowledge import company_index
+from .models import Company, KnownCompany
+from .normalize import COUNT, DATE, TEXT, YEAR, parse_value
+from .storage import COMPANY_COLUMNS, _column_key
+
+DEFAULT_ROWS_LIMIT = 50
+MAX_ROWS_LIMIT = 200
+
+# Query parameters that are not column filters
+RESERVED_PARAMS = {'sort', 'limit', 'offset', 'format', 'group_by', 'metrics'}
+
+FILTER_LOOKUPS = ('gte', 'lte', 'gt', 'lt', 'contains')
+AGGREGATES = {'sum': Sum, 'avg': Avg, 'min': Min, 'max': Max}
+
+
+def _column(result_set, name):
+    """The stored column a client names, matched like storage matches fields"""
+    key = _column_key(name)
+    for column in result_set.columns:
+        if _column_key(column) == key:
+            return column
+    raise ValueError(f'Unknown column: {name}')
+
+
+def _kind(result_set, column):
+    return result_set.column_types.get(column, TEXT)
+
+
+def _expression(result_set, column):
+    """Database expression of a column: its parsed number, or its text"""
+    if _kind(result_set, column) != TEXT:
+        return Cast(KeyTextTransform(column, 'values'), FloatField())
+    key = _column_key(column)
+    if key in COMPANY_COLUMNS:
+        return F(key)
+    if key == 'established_year':
+        return Cast('established_year', CharField())
+    return KeyTextTransform(column, 'extra')
+
+
+def _output(kind, value):
+    """A value read back through a float cast, as the integer it was stored as"""
+    if kind in (YEAR, COUNT, DATE) and isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _parse_int(params, name, default):
+    try:
+        return int(params.get(name, default))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'{name} must be an integer') from e
+
+
+def _page(params):
+    limit = max(1, min(_parse_int(params, 'limit', DEFAULT_ROWS_LIMIT), MAX_ROWS_LIMIT))
+    return limit, max(0, _parse_int(params, 'offset', 0))
+
+
+def filter_rows(result_set, params):
+    """Rows of a result set narrowed by ``<column>[__gte|__lte|__gt|__lt|__contains]=<value>``.
+
+    Values are parsed like the column, so ``funding_amount__gte=$5M`` and
+    ``Last Round__gte=2021-06`` compare typed values. Raises ValueError for
+    unknown columns or values that do not parse.
+    """
+    queryset = Company.objects.filter(result_set=result_set)
+    for index, (param, value) in enumerate(params.items()):
+        if param in RESERVED_PARAMS or value == '':
+            continue
+        name, _, lookup = param.rpartition('__')
+        if lookup not in FILTER_LOOKUPS:
+            name, lookup = param, 'exact'
+        column = _column(result_set, name)
+        kind = _kind(result_set, column)
+        if kind == TEXT:
+            lookup = {'contains': 'icontains', 'exact': 'iexact'}.get(lookup, lookup)
+        elif lookup == 'contains':
+            raise ValueError(f'Column {column} holds {kind} values; filter it with __gte or __lte')
+        alias = f'filter_{index}'
+        queryset = queryset.alias(**{alias: _expression(result_set, column)})
+        queryset = queryset.filter(**{f'{alias}__{lookup}': parse_value(kind, value)})
+    return queryset
+
+
+def _sort_keys(result_set, sort):
+    """(column, descending) pairs of a ``sort=-funding_amount,company_name`` parameter"""
+    keys = []
+    for item in (sort or '').split(','):
+        item = item.strip()
+        if item:
+            keys.append((_column(result_set, item.lstrip('-')), item.startswith('-')))
+    return keys
+
+
+def company_row(result_set, company):
+    """A stored company as the row the model returned"""
+    row = {}
+    for column in result_set.columns:
+        key = _column_key(column)
+        if key in COMPANY_COLUMNS:
+            row[column] = getattr(company, key)
+        elif key == 'established_year' and company.established_year is not None:
+            row[column] = str(company.established_year)
+        elif column in company.extra:
+            row[column] = company.extra[column]
+    return row
+
+
+def query_rows(result_set, params):
+    """One page of a result table, filtered and sorted on the typed values.
+
+    ``sort`` takes comma-separated columns, ``-`` for descending; rows
+    without a value sort last either way. ``limit`` and ``offset`` page
+    through the matches. Raises ValueError for malformed parameters.
+    """
+    limit, offset = _page(params)
+    sort_keys = _sort_keys(result_set, params.get('sort'))
+
+    queryset = filter_rows(result_set, params)
+    total = queryset.count()
+    ordering = []
+    for index, (column, descending) in enumerate(sort_keys):
+        alias = f'sort_{index}'
+        expression = _expression(result_set, column)
+        if _kind(result_set, column) == TEXT:
+            expression = Lower(expression)
+        queryset = queryset.alias(**{alias: expression})
+        ordering.append(F(alias).desc(nulls_last=True) if descending else F(alias).asc(nulls_last=True))
+    companies = list(queryset.order_by(*ordering, 'position')[offset:offset + limit])
+
+    return {
+        'table_name': result_set.table_name,
+        'columns': result_set.columns,
+        'column_types': result_set.column_types,
+        'total': total,
+        'limit': limit,
+        'offset': offset,
+        'companies': [company_row(result_set, company) for company in companies],
+        'values': [company.values for company in companies],
+    }
+
+
+def _metrics(result_set, spec):
+    """(output name, function, column) triples of ``metrics=sum:funding_amount,avg:Team Size``"""
+    metrics = []
+    for item in (spec or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        function, _, name = item.partition(':')
+        function = function.strip().lower()
+        if function not in AGGREGATES:
+            raise ValueError(f'Unknown aggregate: {function}; use one of {", ".join(AGGREGATES)}')
+        column = _column(result_set, name)
+        if _kind(result_set, column) == TEXT:
+            raise ValueError(f'Column {column} has no numeric values to aggregate')
+        metrics.append((f'{function}_{_column_key(column)}', function, column))
+    return metrics
+
+
+def query_groups(result_set, params):
+    """Aggregates of the (filtered) rows grouped by one column.
+
+    ``group_by`` names the column; ``metrics`` lists ``function:column``
+    pairs with function one of sum, avg, min or max over typed columns.
+    Each group has a ``count``; groups are sorted by ``sort`` (an output
+    name such as ``-sum_funding_amount``), largest count first by default.
+    """
+    if not params.get('group_by'):
+        raise ValueError('group_by is required')
+    column = _column(result_set, params['group_by'])
+    metrics = _metrics(result_set, params.get('metrics'))
+
+    annotations = {'count': Count('id')}
+    for output, function, metric_column in metrics:
+        annotations[output] = AGGREGATES[function](_expression(result_set, metric_column))
+    sort = (params.get('sort') or '-count').strip()
+    if sort.lstrip('-') not in ('key', *annotations):
+        raise ValueError(f'Unknown sort key: {sort.lstrip("-")}')
+    sort_field = F(sort.lstrip('-'))
+    ordering = sort_field.desc(nulls_last=True) if sort.startswith('-') else sort_field.asc(nulls_last=True)
+
+    groups = (
+        filter_rows(result_set, params)
+        .annotate(key=_expression(result_set, column))
+        .values('key')
+        .annotate(**annotations)
+        .order_by(ordering, 'key')
+    )
+    kinds = {'key': _kind(result_set, column)}
+    kinds.update((output, _kind(result_set, metric_column)) for output, function, metric_column in metrics
+                 if function != 'avg')
+    return {
+        'group_by': column,
+        'kind': kinds['key'],
+        'metrics': [output for output, _, _ in metrics],
+        'groups': [
+            {name: _output(kinds.get(name), value) for name, value in group.items()}
+            for group in groups
+        ],
+    }
+
+
+def query_entities(params):
+    """Companies across all stored result tables, one entry per entity.
+
+    Name variants such as "Razorpay" and "Razorpay Software Pvt Ltd" share
+    an entity key, so they are counted as one company. Entities are sorted
+    by mentions, most first; ``limit`` and ``offset`` page through them.
+    """
+    limit, offset = _page(params)
+    companies = Company.objects.exclude(entity_key='')
+    total = companies.values('entity_key').distinct().count()
+    entities = list(
+        companies.values('entity_key')
+        .annotate(
+            mentions=Count('id'),
+            messages=Count('result_set', distinct=True),
+            last_seen=Max('result_set__created_at'),
+        )
+        .order_by('-mentions', 'entity_key')[offset:offset + limit]
+    )
+    keys = [entity['entity_key'] for entity in entities]
+    names = dict(KnownCompany.objects.filter(normalized_name__in=keys).values_list('normalized_name', 'company_name'))
+    variants = {}
+    for key, name in companies.filter(entity_key__in=keys).values_list('entity_key', 'company_name').distinct():
+        variants.setdefault(key, set()).add(name)
+
+    for entity in entities:
+        key = entity['entity_key']
+        entity['variants'] = sorted(variants.get(key, ()))
+        entity['company_name'] = names.get(key) or entity['variants'][0]
+        entity['last_seen'] = entity['last_seen'].isoformat() if entity['last_seen'] else None
+    return {'total': total, 'limit': limit, 'offset': offset, 'entities': entities}
+
+
+def entity_mentions(name, params):
+    """Every row about the company a name resolves to, across all responses, newest first"""
+    limit, offset = _page(params)
+    key = company_index.match(name) or canonical_name(name)
+    if not key:
+        raise ValueError('name must contain letters or digits')
+    mentions = (
+        Company.objects.filter(entity_key=key)
+        .select_related('result_set')
+        .order_by('-result_set__created_at', 'position')
+    )
+    total = mentions.count()
+    return {
+        'entity_key': key,
+        'total': total,
+        'limit': limit,
+        'offset': offset,
+        'mentions': [
+            {
+                'message_id': company.result_set.chat_message_id,
+                'created_at': company.result_set.created_at.isoformat(),
+                'position': company.position,
+                'company': company_row(company.result_set, company),
+            }
+            for company in mentions[offset:offset + limit]
+        ],
+    }
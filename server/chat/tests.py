@@ -1,3 +1,916 @@
-from django.test import TestCase
+import io
+import os
+import json
+import time
+import asyncio
+import tempfile
+import zipfile
+import threading
+import subprocess
+from types import SimpleNamespace
+from unittest import mock
+from asgiref.sync import ThreadSensitiveContext
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+from .admission import AdmissionController, CircuitBreaker, CircuitOpen, RateLimited, TokenBucket
+from .cache import ResponseCache
+from .enrichment import Enrichment, has_query_content
+from .knowledge import CompanyIndex, company_index
+from .locks import FileLock, worker_lock
+from .metrics import Metrics, metrics
+from .models import ChatMessage, Company, KnownCompany, ResultSet
+from .normalize import COUNT, MONEY, TEXT, YEAR, normalize_table
+from .parsing import ResponseParseError, extract_json
+from .prompts import DEFAULT_FIELDS, render_system_prompt
+from .query_analysis import QueryAnalyzer, analyze_query
+from .resilience import Deadline
+from .search import match_terms, search_available
+from .segments import merge_companies, plan_segments
+from .services import GroqService
+from .singleflight import SingleFlight
+from .storage import record_exchange, record_exchanges
+from .streaming import CompanyStreamParser, iterate_in_thread
+from .usage import TokenUsage
 
-# Create your tests here.
+
+def table_response(*companies, summary='Startups'):
+    """A successful model response with a table of companies"""
+    return {
+        'status': 'success',
+        'data': {
+            'summary': summary,
+            'data': {'table_name': 'Startups', 'companies': list(companies)},
+        },
+    }
+
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def file_caches(test):
+    """Settings for a file-based cache and lock directory private to a test"""
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    return {
+        'CACHES': {'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': f'{directory.name}/cache',
+        }},
+        'CHAT_LOCK_DIR': f'{directory.name}/locks',
+    }
+
+
+def reset_metrics(test):
+    """Keep a test's metrics in process and start them from zero"""
+    patcher = mock.patch.object(metrics, 'directory', None)
+    patcher.start()
+    test.addCleanup(patcher.stop)
+    metrics.clear()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ResponseCacheTests(SimpleTestCase):
+    def setUp(self):
+        reset_metrics(self)
+        self.cache = ResponseCache(timeout=60)
+
+    def test_hit_pushes_expiry_back(self):
+        self.cache.set('key', {'status': 'success'})
+        with mock.patch.object(self.cache.cache, 'touch', wraps=self.cache.cache.touch) as touch:
+            self.assertEqual(self.cache.get('key'), {'status': 'success'})
+        touch.assert_called_once_with('groq:entry:key', 60)
+
+    def test_counters_are_kept_in_metrics(self):
+        self.assertIsNone(self.cache.get('missing'))
+        self.cache.set('key', {'status': 'success'})
+        self.cache.get('key')
+        self.cache.get('key')
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+        self.assertAlmostEqual(stats['hit_ratio'], 2 / 3)
+        self.assertIn('groq_cache_hits_total 2', metrics.render())
+
+    def test_delete(self):
+        self.cache.set('key', {'status': 'success'})
+        self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+
+
+class WorkerLockTests(SimpleTestCase):
+    def setUp(self):
+        self.settings = self.enterContext(override_settings(**file_caches(self)))
+
+    def test_file_based_cache_uses_file_lock(self):
+        lock = worker_lock(caches['default'], 'key', 10)
+        self.assertIsInstance(lock, FileLock)
+        self.assertTrue(lock.acquire())
+        other = worker_lock(caches['default'], 'key', 10)
+        self.assertFalse(other.acquire())
+        lock.release()
+        self.assertTrue(other.acquire())
+        other.release()
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        self.enterContext(override_settings(**file_caches(self)))
+
+    def test_follower_in_other_worker_gets_leader_result(self):
+        # Two instances stand in for two workers sharing the cache
+        leader, follower = SingleFlight(poll_interval=0.01), SingleFlight(poll_interval=0.01)
+        started, finish = threading.Event(), threading.Event()
+        results = {}
+
+        def lead():
+            started.set()
+            finish.wait(5)
+            return {'status': 'success', 'from': 'leader'}
+
+        thread = threading.Thread(target=lambda: results.setdefault('leader', leader.do('key', lead)))
+        thread.start()
+        started.wait(5)
+        upstream = mock.Mock(return_value={'status': 'success', 'from': 'follower'})
+        polled = threading.Event()
+        poll = follower._poll
+
+        def watch(*args):
+            result = poll(*args)
+            polled.set()
+            return result
+
+        waiter = threading.Thread(target=lambda: results.setdefault('follower', follower.do('key', upstream)))
+        with mock.patch.object(follower, '_poll', side_effect=watch):
+            waiter.start()
+            polled.wait(5)
+            finish.set()
+            thread.join(5)
+            waiter.join(5)
+
+        self.assertEqual(results['follower'], {'status': 'success', 'from': 'leader'})
+        upstream.assert_not_called()
+
+    def test_sequential_calls_do_not_share(self):
+        flight = SingleFlight(poll_interval=0.01)
+        self.assertEqual(flight.do('key', lambda: 1), 1)
+        # A fresh leader never reuses the previous call's result
+        self.assertEqual(flight.do('key', lambda: 2), 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BypassCacheTests(SimpleTestCase):
+    def test_bypass_cache_skips_coalescing(self):
+        service = GroqService()
+        response = {'status': 'success', 'data': {'companies': []}}
+        with mock.patch.object(service, 'find_enrichment', return_value=None), \
+                mock.patch.object(service, '_fetch_response', return_value=response) as fetch, \
+                mock.patch.object(service.singleflight, 'do') as do:
+            self.assertEqual(service.get_response('List startups in Berlin', bypass_cache=True), response)
+        do.assert_not_called()
+        fetch.assert_called_once()
+
+
+class StorageTests(TestCase):
+    def setUp(self):
+        reset_metrics(self)
+        self.response = table_response(
+            {'company_name': 'Acme Robotics', 'location': 'Berlin', 'industry': 'Robotics', 'funding_amount': '$12M'},
+        )
+
+    def test_saves_message_and_tables(self):
+        chat_message = record_exchange('Robotics startups in Berlin', self.response)
+        result_set = ResultSet.objects.get(chat_message=chat_message)
+        self.assertEqual(result_set.row_count, 1)
+        self.assertEqual(Company.objects.get(result_set=result_set).company_name, 'Acme Robotics')
+
+    def test_failing_index_keeps_message_and_tables(self):
+        with mock.patch('chat.storage.index_messages', side_effect=RuntimeError('fts down')), \
+                mock.patch.object(company_index, 'ingest', side_effect=RuntimeError('index down')):
+            chat_message = record_exchange('Robotics startups in Berlin', self.response)
+        self.assertTrue(ChatMessage.objects.filter(pk=chat_message.pk).exists())
+        self.assertEqual(ResultSet.objects.filter(chat_message=chat_message).count(), 1)
+        self.assertEqual(metrics.total('chat_errors_total', stage='search_index'), 1)
+        self.assertEqual(metrics.total('chat_errors_total', stage='knowledge_index'), 1)
+
+    def test_failing_tables_keep_messages(self):
+        with mock.patch('chat.storage._create_tables', side_effect=RuntimeError('disk full')):
+            chat_messages = record_exchanges([('one', self.response), ('two', self.response)])
+        self.assertEqual(ChatMessage.objects.filter(pk__in=[m.pk for m in chat_messages]).count(), 2)
+        self.assertFalse(ResultSet.objects.exists())
+
+    def test_knowledge_index_updates_on_commit(self):
+        response = table_response({'company_name': 'Quillfeather Labs', 'location': 'Berlin'})
+        with self.captureOnCommitCallbacks() as callbacks:
+            record_exchange('Startups in Berlin', response)
+            self.assertNotIn('quillfeather', company_index._records)
+        for callback in callbacks:
+            callback()
+        self.assertIn('quillfeather', company_index._records)
+
+
+class HistoryTests(TestCase):
+    url = '/api/chat/messages/get_history/'
+
+    def setUp(self):
+        self.messages = [
+            ChatMessage.objects.create(user_message=f'query {index}', bot_response='{}')
+            for index in range(5)
+        ]
+
+    def test_keyset_cursor_walks_all_pages(self):
+        seen, cursor = [], None
+        while True:
+            response = self.client.get(self.url, {'limit': 2, **({'cursor': cursor} if cursor else {})})
+            self.assertEqual(response.status_code, 200)
+            seen += [message['id'] for message in response.json()]
+            cursor = response.headers.get('X-Next-Cursor')
+            if not cursor:
+                break
+        self.assertEqual(seen, [message.pk for message in reversed(self.messages)])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_unchanged_page_is_not_modified(self):
+        etag = self.client.get(self.url).headers['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_edited_message_changes_etag(self):
+        etag = self.client.get(self.url).headers['ETag']
+        message = self.messages[-1]
+        message.user_message = 'edited'
+        message.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_stored_results_change_etag(self):
+        params = {'summary': 1}
+        etag = self.client.get(self.url, params).headers['ETag']
+        ResultSet.objects.create(chat_message=self.messages[-1], status='success', summary='Late results')
+        response = self.client.get(self.url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['summary'], 'Late results')
+
+
+class CompanyIndexLookupTests(TestCase):
+    fields = {'company_name', 'location', 'investors'}
+
+    def setUp(self):
+        for index in range(3):
+            KnownCompany.objects.create(
+                normalized_name=f'fin{index}', company_name=f'Fin {index}', location='Berlin, Germany',
+                industry='Fintech', funding_stage='Series A', investors='Index Ventures', established_year='2020',
+            )
+        KnownCompany.objects.create(
+            normalized_name='health', company_name='Health', location='Berlin, Germany',
+            industry='Healthtech', funding_stage='Seed', investors='Atomico', established_year='2018',
+        )
+        self.index = CompanyIndex(min_rows=3)
+
+    def lookup(self, message):
+        return self.index.lookup(message, analyze_query(message).location, self.fields)
+
+    def test_every_constraint_matches(self):
+        plan = self.lookup('List 3 fintech startups in Berlin, Germany founded in 2020')
+        self.assertTrue(plan.complete)
+        self.assertEqual([row['company_name'] for row in plan.rows], ['Fin 0', 'Fin 1', 'Fin 2'])
+
+    def test_unknown_industry_term_gets_no_plan(self):
+        self.assertIsNone(self.lookup('List 3 agritech startups in Berlin'))
+
+    def test_unmatched_qualifiers_filter_records(self):
+        self.assertIsNone(self.lookup('List 3 Series B fintech startups in Berlin'))
+        self.assertIsNone(self.lookup('List 3 fintech startups in Berlin founded in 2019'))
+        plan = self.lookup('List 3 seed startups in Berlin')
+        self.assertFalse(plan.complete)
+        self.assertEqual([row['company_name'] for row in plan.rows], ['Health'])
+
+    def test_concurrent_ingest_merges(self):
+        # Another worker creates the company between this ingest's read and its insert
+        KnownCompany.objects.create(normalized_name='quillfeather', company_name='Quillfeather', location='Berlin')
+        stale = mock.patch.object(KnownCompany.objects, 'in_bulk', side_effect=[{}, KnownCompany.objects.in_bulk(
+            ['quillfeather'], field_name='normalized_name'
+        )])
+        with stale, self.captureOnCommitCallbacks(execute=True):
+            self.index.ingest([{'company_name': 'Quillfeather', 'industry': 'Edtech'}])
+        company = KnownCompany.objects.get(normalized_name='quillfeather')
+        self.assertEqual((company.location, company.industry), ('Berlin', 'Edtech'))
+        self.assertEqual(self.index._records['quillfeather']['location'], 'Berlin')
+
+    def test_comparisons_get_no_plan(self):
+        self.assertIsNone(self.lookup('List 3 startups in Berlin founded after 2018'))
+        self.assertIsNone(self.lookup('List 3 startups in Berlin that raised over $10M'))
+
+    def test_no_row_count_wants_default_rows(self):
+        # Three known rows would be a third of the GROQ_DEFAULT_ROWS the model is asked for
+        with override_settings(GROQ_DEFAULT_ROWS=10):
+            plan = CompanyIndex(min_rows=3).lookup('Fintech startups in Berlin', 'Berlin', self.fields)
+        self.assertEqual((plan.wanted_rows, plan.complete), (10, False))
+        with override_settings(GROQ_DEFAULT_ROWS=2):
+            plan = CompanyIndex(min_rows=3).lookup('Fintech startups in Berlin', 'Berlin', self.fields)
+        self.assertEqual((len(plan.rows), plan.complete), (3, True))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class EnrichmentTargetTests(TestCase):
+    def setUp(self):
+        self.service = GroqService()
+        self.first = record_exchange('Fintech startups in Berlin', table_response({'company_name': 'Fin'}))
+        self.latest = record_exchange('AI startups in Paris', table_response({'company_name': 'Mistral'}))
+
+    def test_query_content(self):
+        self.assertFalse(has_query_content('Include CEO as CEO Name'))
+        self.assertFalse(has_query_content('Now also include total funding as Total Funding'))
+        self.assertTrue(has_query_content('AI startups in Berlin. Include CEO as CEO Name'))
+        self.assertTrue(has_query_content('List 10 startups, include CEO as CEO Name'))
+        self.assertTrue(has_query_content('Fintech startups, include CEO as CEO Name'))
+
+    def test_follow_up_enriches_latest_table(self):
+        enrichment = self.service.find_enrichment('Include CEO as CEO Name')
+        self.assertEqual(enrichment.message_id, self.latest.pk)
+        self.assertEqual(enrichment.column, {'content': 'CEO', 'name': 'CEO Name'})
+
+    def test_message_with_query_content_is_a_new_query(self):
+        self.assertIsNone(self.service.find_enrichment('Fintech startups in London. Include CEO as CEO Name'))
+
+    def test_explicit_previous_message(self):
+        message = 'Fintech startups in London. Include CEO as CEO Name'
+        enrichment = self.service.find_enrichment(message, previous_message_id=self.first.pk)
+        self.assertEqual(enrichment.message_id, self.first.pk)
+        # An explicit message without a table is not replaced by the latest one
+        self.assertIsNone(self.service.find_enrichment(message, previous_message_id=self.latest.pk + 100))
+
+    def test_batch_messages_are_not_follow_ups(self):
+        self.assertIsNone(self.service.find_enrichment('Include CEO as CEO Name', follow_up=False))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PromptTests(SimpleTestCase):
+    def setUp(self):
+        self.service = GroqService()
+
+    def fields(self, message):
+        return self.service.requested_fields(analyze_query(message))
+
+    def test_query_without_fields_gets_default_columns(self):
+        self.assertEqual(self.fields('List startups in Berlin'), set(DEFAULT_FIELDS))
+        prompt = render_system_prompt('Berlin', self.fields('List startups in Berlin'))
+        self.assertIn('"funding_stage":"Series A/B/C"', prompt)
+
+    def test_named_fields_narrow_the_columns(self):
+        self.assertEqual(
+            self.fields('Startups in Berlin with their funding'),
+            {'company_name', 'location', 'investors', 'funding_amount'}
+        )
+
+    def test_enrichment_prompt_is_compact(self):
+        enrichment = Enrichment(1, table_response({'company_name': 'Acme'}), {'name': 'CEO', 'content': 'the CEO'})
+        prompt = enrichment.build_prompt()
+        self.assertIn('provide the CEO.\n### COMPANIES:\n- Acme\n', prompt)
+        self.assertNotIn('  ', prompt)
+
+
+class MetricsSnapshotTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.metrics = Metrics(directory=self.directory)
+
+    def write_snapshot(self, pid, requests, in_flight):
+        with open(os.path.join(self.directory, f'{pid}.json'), 'w') as f:
+            json.dump({
+                'counters': [['chat_requests_total', [['route', 'chat']], requests]],
+                'histograms': [],
+                'gauges': [['chat_upstream_in_flight', [], in_flight]],
+            }, f)
+
+    def exited_pid(self):
+        process = subprocess.Popen(['true'])
+        process.wait()
+        return process.pid
+
+    def test_exited_workers_keep_counters_but_not_gauges(self):
+        self.write_snapshot(self.exited_pid(), requests=5, in_flight=3)
+        self.write_snapshot(os.getppid(), requests=2, in_flight=1)
+        body = self.metrics.render()
+        self.assertIn('chat_requests_total{route="chat"} 7', body)
+        self.assertIn('chat_upstream_in_flight 1', body)
+
+    def test_retire_folds_snapshot_into_totals(self):
+        first, second = self.exited_pid(), self.exited_pid()
+        self.write_snapshot(first, requests=5, in_flight=3)
+        self.write_snapshot(second, requests=4, in_flight=3)
+        self.metrics.retire(first)
+        self.metrics.retire(second)
+        self.assertEqual(sorted(os.listdir(self.directory)), ['retired.json'])
+        self.assertEqual(self.metrics.total('chat_requests_total', route='chat'), 9)
+        self.assertNotIn('chat_upstream_in_flight', self.metrics.render())
+
+
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        self.enterContext(override_settings(**file_caches(self)))
+
+    def bucket(self):
+        # 10 tokens refilling at one every 100 seconds
+        return TokenBucket('test', rate_per_minute=0.6, burst_seconds=1000, lock_wait=5)
+
+    def test_take_until_empty(self):
+        bucket = self.bucket()
+        self.assertEqual([bucket.take(4), bucket.take(4)], [0, 0])
+        self.assertGreater(bucket.take(4), 100)
+        bucket.refund(4)
+        self.assertEqual(bucket.take(4), 0)
+
+    def test_workers_never_overdraw_the_bucket(self):
+        # One bucket per thread stands in for the workers sharing the cache
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.bucket().take(1))) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(results.count(0), 10)
+
+
+class TokenUsageTests(SimpleTestCase):
+    def setUp(self):
+        reset_metrics(self)
+
+    def test_stats(self):
+        usage = TokenUsage()
+        usage.record({'prompt_tokens': 100, 'completion_tokens': 30, 'max_tokens': 60})
+        usage.record({'prompt_tokens': 50, 'completion_tokens': 30, 'max_tokens': 60})
+        stats = usage.stats()
+        self.assertEqual((stats['requests'], stats['prompt_tokens']), (2, 150))
+        self.assertEqual(stats['avg_completion_tokens'], 30)
+        self.assertEqual(stats['budget_utilization'], 0.5)
+
+
+class FakeStream:
+    """A Groq completion stream yielding the given pieces of text"""
+
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self.closed = False
+
+    def __iter__(self):
+        for piece in self.pieces:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))], x_groq=None)
+
+    def close(self):
+        self.closed = True
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StreamAdmissionTests(SimpleTestCase):
+    def setUp(self):
+        reset_metrics(self)
+        self.service = GroqService()
+        self.limiter = self.service.upstream.admission.limiter
+        self.stream = FakeStream([
+            '{"summary":"Startups","data":{"table_name":"Startups","companies":[',
+            '{"company_name":"Acme"},', '{"company_name":"Beta"}]}}',
+        ])
+        patcher = mock.patch.object(self.service.client.chat.completions, 'create', return_value=self.stream)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_slot_is_held_until_the_stream_is_consumed(self):
+        events = self.service.stream_response('List startups in Berlin', bypass_cache=True)
+        kind, company = next(events)
+        self.assertEqual((kind, company['company_name']), ('company', 'Acme'))
+        self.assertEqual(self.limiter.in_flight, 1)
+        self.assertEqual([kind for kind, _ in events], ['company', 'result'])
+        self.assertEqual(self.limiter.in_flight, 0)
+        self.assertTrue(self.stream.closed)
+
+    def test_closing_early_releases_slot(self):
+        events = self.service.stream_response('List startups in Berlin', bypass_cache=True)
+        next(events)
+        events.close()
+        self.assertEqual(self.limiter.in_flight, 0)
+        self.assertTrue(self.stream.closed)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        reset_metrics(self)
+        self.breaker = CircuitBreaker(
+            window=60, min_calls=4, error_rate=0.5, slow_call_seconds=10,
+            slow_call_rate=0.5, open_seconds=30, half_open_calls=1,
+        )
+        self.clock = 1000.0
+        patcher = mock.patch('chat.admission.time.monotonic', side_effect=lambda: self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def open(self):
+        for failed in (False, True, False, True):
+            self.breaker.before_call()
+            self.breaker.record(failed, 1.0)
+
+    def test_opens_on_error_rate(self):
+        self.open()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpen):
+            self.breaker.before_call()
+
+    def test_opens_on_slow_calls(self):
+        for _ in range(4):
+            self.breaker.record(False, 12.0)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_stays_closed_below_min_calls(self):
+        for _ in range(3):
+            self.breaker.record(True, 1.0)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_probe_closes(self):
+        self.open()
+        self.clock += 31
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        # Only one probe at a time
+        with self.assertRaises(CircuitOpen):
+            self.breaker.before_call()
+        self.breaker.record(False, 1.0)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_probe_reopens(self):
+        self.open()
+        self.clock += 31
+        self.breaker.before_call()
+        self.breaker.record(True, 1.0)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(metrics.total('chat_circuit_transitions_total', state='open'), 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class HalfOpenQuotaTests(SimpleTestCase):
+    def setUp(self):
+        reset_metrics(self)
+        caches['default'].clear()
+        self.controller = AdmissionController(
+            max_concurrent=1, max_queue=0, max_wait=1.0, breaker_enabled=True, requests_per_minute=1,
+        )
+        self.breaker = self.controller.breaker
+        self.clock = 1000.0
+        patcher = mock.patch('chat.admission.time.monotonic', side_effect=lambda: self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Open the breaker, then let it go half-open, with the one request of the quota used up
+        for _ in range(self.breaker.min_calls):
+            self.breaker.record(True, 1.0)
+        self.clock += self.breaker.open_seconds + 1
+        self.controller.request_quota.take(1)
+
+    def test_quota_refusal_gives_back_the_probe(self):
+        with self.assertRaises(RateLimited):
+            self.controller.before_attempt(Deadline(30))
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        # Once the quota refills, the next call gets to probe
+        with mock.patch('chat.admission.time.time', return_value=time.time() + 120):
+            self.controller.before_attempt(Deadline(30))
+
+    def test_async_quota_refusal_gives_back_the_probe(self):
+        with self.assertRaises(RateLimited):
+            asyncio.run(self.controller.abefore_attempt(Deadline(30)))
+        self.breaker.before_call()
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.message = record_exchange('Startups in Berlin', table_response(
+            {'company_name': 'Acme', 'location': 'Berlin', 'funding_amount': '$12M', 'CEO': 'Ada'},
+            {'company_name': '=HYPERLINK("x")', 'location': 'Berlin', 'funding_amount': '$1.2B', 'CEO': 'Bob'},
+        ))
+        self.url = f'/api/chat/messages/{self.message.pk}/export/'
+
+    def content(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_csv(self):
+        response = self.client.get(self.url, {'format': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment; filename="result-', response['Content-Disposition'])
+        lines = self.content(response).decode().splitlines()
+        self.assertEqual(lines[0], 'company_name,location,funding_amount,CEO')
+        self.assertEqual(lines[1], 'Acme,Berlin,$12M,Ada')
+        # Formulas from the model are not evaluated by spreadsheet apps
+        self.assertTrue(lines[2].startswith('"\'=HYPERLINK'))
+
+    def test_ndjson(self):
+        response = self.client.get(self.url, {'format': 'ndjson'})
+        rows = [json.loads(line) for line in self.content(response).decode().splitlines()]
+        self.assertEqual([row['CEO'] for row in rows], ['Ada', 'Bob'])
+
+    def test_xlsx(self):
+        response = self.client.get(self.url, {'format': 'xlsx'})
+        with zipfile.ZipFile(io.BytesIO(self.content(response))) as workbook:
+            sheet = workbook.read('xl/worksheets/sheet1.xml').decode()
+            self.assertIn('xl/workbook.xml', workbook.namelist())
+        self.assertEqual(sheet.count('<row>'), 3)
+        self.assertIn('>$1.2B</t>', sheet)
+
+    def test_history_export(self):
+        record_exchange('Failed query', {'status': 'error', 'message': 'boom'})
+        response = self.client.get('/api/chat/messages/export_history/', {'format': 'ndjson'})
+        records = [json.loads(line) for line in self.content(response).decode().splitlines()]
+        self.assertEqual([record['company_name'] for record in records[:2]], ['Acme', '=HYPERLINK("x")'])
+        self.assertEqual(json.loads(records[0]['extra']), {'CEO': 'Ada'})
+        # A message without rows still gets a record
+        self.assertEqual(records[2]['status'], 'error')
+
+    def test_errors_are_json(self):
+        response = self.client.get('/api/chat/messages/999999/export/', {'format': 'csv'})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.json()['status'], 'error')
+        response = self.client.get('/api/chat/messages/export_history/', {'format': 'xlsx', 'since': 'nope'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+
+class SendBatchTests(TestCase):
+    url = '/api/chat/messages/send_batch/'
+
+    def setUp(self):
+        service = mock.Mock()
+        service.get_response.side_effect = lambda message, **kwargs: table_response(
+            {'company_name': f'{message} Inc'}
+        )
+        patcher = mock.patch('chat.views.get_groq_service', return_value=service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, messages):
+        return self.client.post(self.url, {'messages': messages, 'concurrency': 1}, content_type='application/json')
+
+    def test_streams_and_saves(self):
+        response = self.post(['one', 'two', ''])
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(sorted(line['index'] for line in lines[:3]), [0, 1, 2])
+        self.assertEqual(lines[-1], {'done': True, 'count': 3, 'saved': 2})
+        self.assertEqual(
+            list(ChatMessage.objects.order_by('id').values_list('user_message', flat=True)), ['one', 'two']
+        )
+
+    def test_disconnect_still_saves_the_batch(self):
+        response = self.post(['one', 'two', 'three'])
+        next(iter(response.streaming_content))
+        # What the server does when the client goes away mid-batch
+        response.close()
+        self.assertEqual(ChatMessage.objects.count(), 3)
+        self.assertEqual(Company.objects.filter(company_name='three Inc').count(), 1)
+
+
+class IterateInThreadTests(SimpleTestCase):
+    def test_steps_of_a_response_share_a_thread(self):
+        def steps():
+            for _ in range(5):
+                yield threading.get_ident()
+
+        async def collect():
+            async with ThreadSensitiveContext():
+                return [item async for item in iterate_in_thread(steps())]
+
+        threads = asyncio.run(collect())
+        self.assertEqual(len(set(threads)), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())
+
+    def test_stopping_early_closes_the_iterator(self):
+        closed = []
+
+        def steps():
+            try:
+                yield 1
+                yield 2
+            finally:
+                closed.append(threading.get_ident())
+
+        async def first():
+            async with ThreadSensitiveContext():
+                stream = iterate_in_thread(steps())
+                item = await stream.__anext__()
+                await stream.aclose()
+                return item
+
+        self.assertEqual(asyncio.run(first()), 1)
+        self.assertEqual(len(closed), 1)
+
+
+class ExtractJsonTests(SimpleTestCase):
+    def test_code_fences_and_prose(self):
+        self.assertEqual(extract_json('Sure! Here it is:\n```json\n{"a": 1}\n```\nEnjoy.'), {'a': 1})
+
+    def test_trailing_commas(self):
+        self.assertEqual(
+            extract_json('{"a": [1, 2,], "b": {"c": "d",},}'),
+            {'a': [1, 2], 'b': {'c': 'd'}}
+        )
+
+    def test_truncated_output_keeps_complete_rows(self):
+        text = '{"data": {"companies": [{"n": "A"}, {"n": "B", "x": "unfinish'
+        self.assertEqual(extract_json(text), {'data': {'companies': [{'n': 'A'}]}})
+
+    def test_invalid_escapes_and_raw_newlines(self):
+        self.assertEqual(extract_json('{"funding\\_stage": "Seed"}'), {'funding_stage': 'Seed'})
+        self.assertEqual(extract_json('{"a": "line\nbreak"}'), {'a': 'line\nbreak'})
+
+    def test_nothing_to_recover(self):
+        with self.assertRaises(ResponseParseError):
+            extract_json('I cannot help with that.')
+
+    def test_stream_parser_emits_rows_as_they_close(self):
+        parser = CompanyStreamParser()
+        self.assertEqual(parser.feed('```json\n{"data":{"companies":[{"n":"A"'), [])
+        self.assertEqual(parser.feed('},{"n":"B"}]}}'), [{'n': 'A'}, {'n': 'B'}])
+
+
+class AnalyzeQueryTests(SimpleTestCase):
+    def test_fields_and_location(self):
+        analysis = analyze_query('List fintech startups in Berlin with their investors and funding')
+        self.assertEqual(analysis.fields, {'company_name', 'location', 'investors', 'funding_amount'})
+        self.assertEqual(analysis.location, 'Berlin')
+        self.assertIsNone(analysis.row_count)
+
+    def test_keywords_match_whole_words(self):
+        # "in" inside "fintech" is not a location keyword
+        self.assertEqual(analyze_query('fintech startups').fields, {'company_name'})
+
+    def test_row_count_and_multi_word_location(self):
+        analysis = analyze_query('Top 25 AI companies from San Francisco, founded after 2015')
+        self.assertEqual((analysis.row_count, analysis.location), (25, 'San Francisco'))
+        self.assertIn('established_year', analysis.fields)
+
+    def test_two_word_keywords(self):
+        self.assertIn('investors', analyze_query('Startups in Paris backed by Sequoia').fields)
+
+    def test_custom_column(self):
+        analysis = analyze_query('Startups in Bangalore. Include number of employees as Team Size')
+        self.assertEqual(analysis.custom_column, {'content': 'number of employees', 'name': 'Team Size'})
+        self.assertEqual(analysis.location, 'Bangalore')
+
+    def test_custom_keywords(self):
+        analyzer = QueryAnalyzer({'revenue': ['revenue', 'annual sales']})
+        self.assertEqual(analyzer.analyze('Annual sales of startups').fields, {'company_name', 'revenue'})
+
+
+class NormalizeTableTests(SimpleTestCase):
+    def test_column_kinds_and_values(self):
+        columns = ['company_name', 'funding_amount', 'established_year', 'Team Size', 'Team']
+        rows = [
+            {'company_name': 'Acme', 'funding_amount': '$1.2B', 'established_year': '2015',
+             'Team Size': '2,300', 'Team': 'Ada, Bob'},
+            {'company_name': 'Beta', 'funding_amount': '$12M', 'established_year': 'Founded in 2019',
+             'Team Size': '50-100', 'Team': 'Cy'},
+            {'company_name': 'Gamma', 'funding_amount': 'Undisclosed', 'established_year': None},
+        ]
+        column_types, values = normalize_table(columns, rows)
+        self.assertEqual(column_types, {
+            'company_name': TEXT, 'funding_amount': MONEY, 'established_year': YEAR,
+            'Team Size': COUNT, 'Team': TEXT,
+        })
+        self.assertEqual(values[0], {'funding_amount': 1.2e9, 'established_year': 2015, 'Team Size': 2300})
+        self.assertEqual(values[1], {'funding_amount': 12e6, 'established_year': 2019, 'Team Size': 75})
+        # Values that do not parse are left out
+        self.assertEqual(values[2], {})
+
+
+class RowsTests(TestCase):
+    def setUp(self):
+        self.message = record_exchange('Startups in Berlin', table_response(
+            {'company_name': 'Acme', 'funding_amount': '$12M', 'established_year': '2015'},
+            {'company_name': 'Beta', 'funding_amount': '$1.2B', 'established_year': '2019'},
+            {'company_name': 'Gamma', 'funding_amount': 'Undisclosed', 'established_year': '2012'},
+            {'company_name': 'Delta', 'funding_amount': '$500K', 'established_year': '2021'},
+        ))
+        self.url = f'/api/chat/messages/{self.message.pk}/rows/'
+
+    def names(self, params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return [row['company_name'] for row in response.json()['companies']]
+
+    def test_sorts_on_parsed_amounts(self):
+        # "$1.2B" is more than "$12M"; rows without a value come last either way
+        self.assertEqual(self.names({'sort': '-funding_amount'}), ['Beta', 'Acme', 'Delta', 'Gamma'])
+        self.assertEqual(self.names({'sort': 'funding_amount'}), ['Delta', 'Acme', 'Beta', 'Gamma'])
+
+    def test_filters_and_pages(self):
+        self.assertEqual(self.names({'funding_amount__gte': '$10M', 'sort': 'company_name'}), ['Acme', 'Beta'])
+        response = self.client.get(self.url, {'sort': '-established_year', 'limit': 2, 'offset': 1})
+        data = response.json()
+        self.assertEqual((data['total'], data['limit'], data['offset']), (4, 2, 1))
+        self.assertEqual([row['company_name'] for row in data['companies']], ['Beta', 'Acme'])
+        self.assertEqual(data['values'][0]['funding_amount'], 1.2e9)
+
+    def test_bad_parameters(self):
+        self.assertEqual(self.client.get(self.url, {'sort': 'revenue'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'funding_amount__gte': 'lots'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'funding_amount__contains': '$'}).status_code, 400)
+
+
+@override_settings(GROQ_SEGMENT_ROWS=10, GROQ_SEGMENT_OVERFETCH=0.2, GROQ_SEGMENT_MAX_ROWS=200)
+class SegmentTests(SimpleTestCase):
+    fields = {'company_name', 'location'}
+
+    def test_one_completion_needs_no_segments(self):
+        self.assertEqual(plan_segments('Startups in Berlin', self.fields, 10), [])
+        self.assertEqual(plan_segments('Startups in Berlin', self.fields, None), [])
+
+    def test_splits_on_first_open_dimension(self):
+        segments = plan_segments('Startups in Berlin', self.fields, 50)
+        # 50 rows and 20% more make 6 segments of at most 10 rows, one run of industries each
+        self.assertEqual(len(segments), 6)
+        self.assertTrue(all(segment.count == 6 and segment.rows == 10 for segment in segments))
+        self.assertEqual(segments[0].instruction, 'in fintech or healthtech or biotech')
+        self.assertEqual(segments[-1].instruction, 'in media, gaming or other sectors')
+        self.assertIn('Only include startups in fintech or healthtech or biotech.', segments[0].prompt_section())
+
+    def test_skips_dimensions_the_query_narrows(self):
+        segments = plan_segments('Fintech startups in Berlin founded after 2015', self.fields, 50)
+        self.assertTrue(all(segment.instruction.startswith('at ') for segment in segments))
+        self.assertFalse(any('founded' in segment.instruction for segment in segments))
+
+    def test_splits_further_on_next_dimension(self):
+        segments = plan_segments('Startups in Berlin', self.fields, 200)
+        self.assertEqual(len(segments), 30)
+        self.assertEqual(segments[0].instruction, 'in fintech and at pre-seed or seed or Series A')
+        self.assertEqual(len({segment.instruction for segment in segments}), 30)
+        self.assertGreaterEqual(sum(segment.rows for segment in segments), 200)
+
+    def test_merge_drops_name_variants(self):
+        merged = merge_companies([
+            [{'company_name': 'Razorpay'}, {'company_name': 'Acme'}],
+            [{'company_name': 'Razorpay Software Pvt Ltd'}, {'company_name': ''}, {'company_name': 'Beta'}],
+        ])
+        self.assertEqual([row['company_name'] for row in merged], ['Razorpay', 'Acme', 'Beta'])
+
+    def test_merge_stops_at_limit(self):
+        merged = merge_companies([[{'company_name': 'A'}, {'company_name': 'B'}], [{'company_name': 'C'}]], limit=2)
+        self.assertEqual([row['company_name'] for row in merged], ['A', 'B'])
+
+
+class SearchTests(TestCase):
+    url = '/api/chat/messages/search/'
+
+    def setUp(self):
+        self.health = record_exchange('Healthtech startups in Austin', table_response(
+            {'company_name': 'Everlywell', 'location': 'Austin', 'funding_stage': 'Series B'},
+            summary='Austin healthtech',
+        ))
+        self.fintech = record_exchange('Fintech startups in Berlin', table_response(
+            {'company_name': 'Trade Republic', 'location': 'Berlin', 'funding_stage': 'Series C'},
+            summary='Berlin <fintech>',
+        ))
+        record_exchange('Robotics companies in Tokyo', table_response({'company_name': 'Preferred Networks'}))
+
+    def search(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_index_is_available(self):
+        self.assertTrue(search_available())
+
+    def test_matches_questions_companies_and_details(self):
+        self.assertEqual([result['id'] for result in self.search(q='austin')['results']], [self.health.pk])
+        self.assertEqual([result['id'] for result in self.search(q='trade republic')['results']], [self.fintech.pk])
+        # "series b" is a phrase, so Series C does not match
+        self.assertEqual([result['id'] for result in self.search(q='"series b"')['results']], [self.health.pk])
+        self.assertEqual([result['id'] for result in self.search(q='health*')['results']], [self.health.pk])
+
+    def test_snippets_are_escaped_and_marked(self):
+        result = self.search(q='fintech')['results'][0]
+        self.assertIn('<mark>', result['snippet'])
+        self.assertNotIn('<fintech>', result['snippet'])
+        self.assertGreater(result['score'], 0)
+
+    def test_terms_in_most_messages_come_newest_first(self):
+        # "in" is in every message, which BM25 cannot rank
+        results = self.search(q='in')['results']
+        self.assertEqual([result['score'] for result in results], [0.0, 0.0, 0.0])
+        self.assertEqual(results[1]['id'], self.fintech.pk)
+
+    def test_match_terms(self):
+        self.assertEqual(match_terms('that query about "Series B" health* -x'), ['"Series B"', '"health"*', '"x"'])
+        self.assertEqual(match_terms('the'), ['"the"'])
+        with self.assertRaises(ValueError):
+            match_terms('?!')
+
+    def test_pages_and_errors(self):
+        data = self.search(q='startups', limit=2)
+        self.assertEqual(len(data['results']), 2)
+        self.assertEqual(data['next_offset'], 2)
+        self.assertIsNone(self.search(q='startups', limit=2, offset=2)['next_offset'])
+        self.assertEqual(self.client.get(self.url, {'q': ''}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'q': 'x', 'limit': 'many'}).status_code, 400)
+
+    def test_deleted_messages_leave_the_index(self):
+        self.health.delete()
+        self.assertEqual(self.search(q='austin')['results'], [])
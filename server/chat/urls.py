@@ -1,10 +1,12 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ChatMessageViewSet
+from .views import ChatMessageViewSet, get_history_async, send_message_async
 
 router = DefaultRouter()
 router.register(r'messages', ChatMessageViewSet)
 
 urlpatterns = [
+    path('async/messages/get_history/', get_history_async, name='get-history-async'),
+    path('async/messages/send_message/', send_message_async, name='send-message-async'),
     path('', include(router.urls)),
 ]
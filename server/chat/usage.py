@@ -0,0 +1,47 @@
+from .metrics import metrics
+
+# Usage counters and the metrics that hold them
+COUNTERS = {
+    'requests': 'groq_completions_total',
+    'prompt_tokens': 'groq_prompt_tokens_total',
+    'completion_tokens': 'groq_completion_tokens_total',
+    'max_tokens': 'groq_max_tokens_total',
+}
+
+
+def completion_usage(completion, max_tokens):
+    """Token usage of a Groq completion as a plain dict"""
+    usage = getattr(completion, 'usage', None)
+    return {
+        'prompt_tokens': getattr(usage, 'prompt_tokens', None) or 0,
+        'completion_tokens': getattr(usage, 'completion_tokens', None) or 0,
+        'max_tokens': max_tokens,
+    }
+
+
+class TokenUsage:
+    """Token counters, kept as metrics counters and summed over all workers.
+
+    Each worker counts in process, so recording never races another worker
+    the way a shared cache counter does. ``max_tokens`` sums the requested
+    budgets, so comparing it with ``completion_tokens`` shows how tight the
+    estimates are.
+    """
+
+    def record(self, usage):
+        """Add the usage dict of one completion to the counters"""
+        metrics.inc(COUNTERS['requests'])
+        for name, metric in COUNTERS.items():
+            if name != 'requests' and usage.get(name):
+                metrics.inc(metric, usage[name])
+
+    def stats(self):
+        """Return the token counters and per-request averages"""
+        totals = {name: metrics.total(metric) for name, metric in COUNTERS.items()}
+        requests = totals['requests']
+        totals['avg_prompt_tokens'] = totals['prompt_tokens'] / requests if requests else 0.0
+        totals['avg_completion_tokens'] = totals['completion_tokens'] / requests if requests else 0.0
+        totals['budget_utilization'] = (
+            totals['completion_tokens'] / totals['max_tokens'] if totals['max_tokens'] else 0.0
+        )
+        return totals
@@ -1,25 +1,134 @@
 import json
 import traceback
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
-from .models import ChatMessage
-from .serializers import ChatMessageSerializer
-from .services import GroqService
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections, connection
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from .admission import Overloaded
+from .export import EXPORT_FORMATS, HISTORY_COLUMNS, export_chunks, export_queryset, history_records, message_table
+from .models import ChatMessage, ResultSet
+from .metrics import metrics
+from .pagination import etag_matches, history_etag, history_page_keys, history_queryset, parse_history_params
+from .persistence import exchange_writer
+from .renderers import (
+    ColumnarJSONRenderer, CSVRenderer, EventStreamRenderer, NDJSONRenderer, XLSXRenderer, to_columnar, wants_columnar
+)
+from .search import search_messages
+from .serializers import ChatMessageSerializer, ChatMessageSummarySerializer, ResultSetSerializer
+from .services import get_groq_service
+from .storage import record_exchange, record_exchanges
+from .streaming import iterate_in_thread, sse_event
+from .tables import entity_mentions, query_entities, query_groups, query_rows
+
+
+def parse_previous_message_id(data):
+    """The optional ``previous_message_id`` of a request; raises ValueError if malformed"""
+    value = data.get('previous_message_id')
+    if value in (None, ''):
+        return None
+    return int(value)
+
+
+def overloaded_payload(error):
+    """Body of the 429/503 answer to a call refused by admission control"""
+    return {
+        'error': str(error),
+        'type': 'error',
+        'content': 'The AI service is busy right now. Please try again shortly.',
+        'retry_after': error.retry_after
+    }
+
+
+def export_response(request, export_format, chunks, filename):
+    """Stream export chunks as a file download"""
+    if isinstance(request._request, ASGIRequest):
+        chunks = iterate_in_thread(chunks)
+    response = StreamingHttpResponse(chunks, content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def history_page(params, if_none_match=None, representation='json'):
+    """Build one page of history.
+
+    Returns ``(data, headers)``; ``data`` is None when the client's ETag is
+    still current. ``representation`` is the negotiated format, part of the
+    ETag since the payload differs. Raises ValueError for malformed parameters.
+    """
+    limit, cursor, after, summary = parse_history_params(params)
+    queryset = history_queryset(after, summary=summary)
+
+    # Keys are read from the (timestamp, id) index and the result set ids,
+    # so checking the client's ETag does not load any message bodies
+    keys, next_cursor = history_page_keys(queryset, limit)
+    headers = {'ETag': history_etag(keys, limit, cursor, summary, representation)}
+    if next_cursor:
+        headers['X-Next-Cursor'] = next_cursor
+    if etag_matches(if_none_match, headers['ETag']):
+        return None, headers
+
+    serializer_class = ChatMessageSummarySerializer if summary else ChatMessageSerializer
+    return serializer_class(queryset[:limit], many=True).data, headers
+
 
 class ChatMessageViewSet(viewsets.ModelViewSet):
     queryset = ChatMessage.objects.all()
     serializer_class = ChatMessageSerializer
-    groq_service = GroqService()
-    
+    # ?format=columnar sends tables as columns plus rows
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [ColumnarJSONRenderer]
+
+    @property
+    def groq_service(self):
+        return get_groq_service()
+
     @action(detail=False, methods=['get'])
     def get_history(self, request):
-        """Get conversation history"""
+        """Get conversation history, newest first.
+
+        Pages are keyset-paginated on (timestamp, id): the cursor of the next
+        page is returned in the ``X-Next-Cursor`` and ``Link`` headers.
+        ``summary=1`` leaves out the response blobs. Responses carry an ETag
+        so unchanged pages can be answered with 304 Not Modified.
+        """
         try:
-            # Get the latest 50 messages
-            messages = ChatMessage.objects.all()[:50]
-            serializer = self.get_serializer(messages, many=True)
-            return Response(serializer.data)
+            try:
+                data, headers = history_page(
+                    request.query_params,
+                    request.headers.get('If-None-Match'),
+                    request.accepted_renderer.format
+                )
+            except ValueError as e:
+                return Response(
+                    {
+                        'status': 'error',
+                        'message': str(e)
+                    },
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            if data is None:
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                response = Response(data)
+            for header, value in headers.items():
+                response[header] = value
+            patch_vary_headers(response, ['Accept'])
+            if 'X-Next-Cursor' in headers:
+                next_url = replace_query_param(request.build_absolute_uri(), 'cursor', headers['X-Next-Cursor'])
+                response['Link'] = f'<{next_url}>; rel="next"'
+            return response
         except Exception as e:
             return Response(
                 {
@@ -29,6 +138,166 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=True, methods=['get'])
+    def result(self, request, pk=None):
+        """Get the stored result table of a message"""
+        try:
+            result_set = ResultSet.objects.prefetch_related('companies').get(chat_message_id=pk)
+        except ResultSet.DoesNotExist:
+            return Response(
+                {
+                    'status': 'error',
+                    'message': 'No result table stored for this message'
+                },
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(ResultSetSerializer(result_set).data)
+
+    def _table_query(self, pk, query, params):
+        """Answer a query over the stored result table of a message"""
+        try:
+            result_set = ResultSet.objects.get(chat_message_id=pk)
+        except (ResultSet.DoesNotExist, ValueError):
+            return Response(
+                {
+                    'status': 'error',
+                    'message': 'No result table stored for this message'
+                },
+                status=status.HTTP_404_NOT_FOUND
+            )
+        try:
+            return Response(query(result_set, params))
+        except ValueError as e:
+            return Response(
+                {
+                    'status': 'error',
+                    'message': str(e)
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+    @action(detail=True, methods=['get'])
+    def rows(self, request, pk=None):
+        """Get one page of a stored result table, sorted and filtered server-side.
+
+        ``sort=-funding_amount,company_name`` sorts on parsed values, so
+        "$1.2B" comes before "$12M"; ``<column>__gte``, ``__lte``, ``__gt``,
+        ``__lt``, ``__contains`` or ``<column>=`` filter; ``limit`` and
+        ``offset`` page through the matches.
+        """
+        return self._table_query(pk, query_rows, request.query_params)
+
+    @action(detail=True, methods=['get'])
+    def groups(self, request, pk=None):
+        """Aggregate a stored result table, e.g. ``?group_by=location&metrics=sum:funding_amount``"""
+        return self._table_query(pk, query_groups, request.query_params)
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Full-text search over the history, e.g. ``?q=series b healthtech austin``.
+
+        Searches questions, summaries, company names and company details,
+        best match first, with a highlighted snippet per message. ``"..."``
+        matches a phrase and ``word*`` a prefix; ``limit`` and ``offset``
+        page through the matches.
+        """
+        try:
+            return Response(search_messages(request.query_params))
+        except ValueError as e:
+            return Response(
+                {
+                    'status': 'error',
+                    'message': str(e)
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+    @action(detail=False, methods=['get'])
+    def companies(self, request):
+        """Companies across all responses, with name variants resolved to one entity.
+
+        Lists entities by number of mentions; ``?name=Razorpay`` instead
+        lists every row about that company, whichever variant of its name a
+        response used. ``limit`` and ``offset`` page through either.
+        """
+        params = request.query_params
+        try:
+            if params.get('name'):
+                return Response(entity_mentions(params['name'], params))
+            return Response(query_entities(params))
+        except ValueError as e:
+            return Response(
+                {
+                    'status': 'error',
+                    'message': str(e)
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+    @action(detail=True, methods=['get'], renderer_classes=[CSVRenderer, NDJSONRenderer, XLSXRenderer])
+    def export(self, request, pk=None):
+        """Download the result table of a message; ``?format=csv|ndjson|xlsx``, CSV by default"""
+        try:
+            columns, rows = message_table(pk)
+        except (ChatMessage.DoesNotExist, ValueError):
+            # Plain JSON: the negotiated renderer is the export format
+            return JsonResponse(
+                {
+                    'status': 'error',
+                    'message': 'Message not found'
+                },
+                status=status.HTTP_404_NOT_FOUND
+            )
+        export_format = request.accepted_renderer.format
+        return export_response(request, export_format, export_chunks(export_format, columns, rows), f'result-{pk}')
+
+    @action(detail=False, methods=['get'], renderer_classes=[CSVRenderer, NDJSONRenderer, XLSXRenderer])
+    def export_history(self, request):
+        """Download the whole history, one row per company, oldest first.
+
+        ``since`` and ``until`` (ISO dates) narrow it down. Messages are read
+        in chunks and written out as they are read, so memory stays flat and
+        the download starts right away however long the history is.
+        """
+        try:
+            queryset = export_queryset(request.query_params)
+        except ValueError as e:
+            return JsonResponse(
+                {
+                    'status': 'error',
+                    'message': str(e)
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        export_format = request.accepted_renderer.format
+        records = history_records(queryset, getattr(settings, 'CHAT_EXPORT_CHUNK_SIZE', 500))
+        return export_response(
+            request,
+            export_format,
+            export_chunks(export_format, HISTORY_COLUMNS, records, 'History'),
+            'history'
+        )
+
+    @action(detail=False, methods=['get'])
+    def cache_stats(self, request):
+        """Get response cache hit/miss counters"""
+        return Response(self.groq_service.cache.stats())
+
+    @action(detail=False, methods=['get'])
+    def persistence_stats(self, request):
+        """Get write-behind queue depth and counters"""
+        return Response(exchange_writer.stats())
+
+    @action(detail=False, methods=['get'])
+    def token_stats(self, request):
+        """Get prompt and completion token counters"""
+        return Response(self.groq_service.usage.stats())
+
+    @action(detail=False, methods=['get'])
+    def upstream_stats(self, request):
+        """Get upstream call, hedge and latency threshold counters"""
+        return Response(self.groq_service.upstream.stats())
+
     @action(detail=False, methods=['post'])
     def send_message(self, request):
         try:
@@ -44,12 +313,36 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
+            try:
+                previous_message_id = parse_previous_message_id(request.data)
+            except (TypeError, ValueError):
+                return Response(
+                    {
+                        'error': 'previous_message_id must be an integer',
+                        'type': 'error',
+                        'content': 'Please provide a valid previous message.'
+                    },
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
             # Get structured response from Groq
             print("\n=== Processing User Message ===\n", user_message)
             
             try:
-                response = self.groq_service.get_response(user_message)
+                bypass_cache = str(request.data.get('bypass_cache', '')).lower() in ('true', '1', 'yes')
+                response = self.groq_service.get_response(
+                    user_message,
+                    bypass_cache=bypass_cache,
+                    previous_message_id=previous_message_id
+                )
                 print("\n=== Groq Service Response ===\n", json.dumps(response, indent=2))
+            except Overloaded as e:
+                # Refused fast so the worker stays free for other requests
+                return Response(
+                    overloaded_payload(e),
+                    status=e.status_code,
+                    headers={'Retry-After': str(e.retry_after)}
+                )
             except Exception as e:
                 print("\n=== Error in Groq Service ===\n")
                 print(traceback.format_exc())
@@ -73,17 +366,14 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR
                 )
 
-            # Save the chat message to database
+            # Save the chat message to database, queued when write-behind is on
             try:
-                # Convert response to string for storage
-                bot_response = json.dumps(response)
-                ChatMessage.objects.create(
-                    user_message=user_message,
-                    bot_response=bot_response
-                )
+                with metrics.timer('db_save'):
+                    exchange_writer.save(user_message, response)
             except Exception as e:
                 print(f"Error saving chat message: {e}")
                 print(traceback.format_exc())
+                metrics.inc('chat_errors_total', stage='db_save')
                 # Continue even if saving fails
             
             # Create success response
@@ -102,3 +392,313 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=False, methods=['post'], renderer_classes=[JSONRenderer, EventStreamRenderer])
+    def stream_message(self, request):
+        """Stream company rows as server-sent events while the model generates them"""
+        user_message = request.data.get('message', '')
+        if not user_message:
+            return Response(
+                {
+                    'error': 'Message is required',
+                    'type': 'error',
+                    'content': 'Please provide a message.'
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            previous_message_id = parse_previous_message_id(request.data)
+        except (TypeError, ValueError):
+            return Response(
+                {
+                    'error': 'previous_message_id must be an integer',
+                    'type': 'error',
+                    'content': 'Please provide a valid previous message.'
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        bypass_cache = str(request.data.get('bypass_cache', '')).lower() in ('true', '1', 'yes')
+        try:
+            # Refuse before the event stream starts, while the status can still be set
+            self.groq_service.upstream.admission.check()
+        except Overloaded as e:
+            return Response(
+                overloaded_payload(e),
+                status=e.status_code,
+                headers={'Retry-After': str(e.retry_after)}
+            )
+
+        def events():
+            response = None
+            try:
+                for event, data in self.groq_service.stream_response(
+                    user_message,
+                    bypass_cache=bypass_cache,
+                    previous_message_id=previous_message_id
+                ):
+                    if event == 'result':
+                        response = data
+                    yield sse_event(event, data)
+            except Overloaded as e:
+                yield sse_event('result', {
+                    'status': 'error',
+                    'message': str(e),
+                    'retry_after': e.retry_after
+                })
+                yield sse_event('done', {})
+                return
+            except Exception as e:
+                print(traceback.format_exc())
+                response = {
+                    'status': 'error',
+                    'message': str(e)
+                }
+                yield sse_event('result', response)
+
+            # Save the chat message once the full result is known
+            try:
+                with metrics.timer('db_save'):
+                    exchange_writer.save(user_message, response)
+            except Exception as e:
+                print(f"Error saving chat message: {e}")
+                print(traceback.format_exc())
+                metrics.inc('chat_errors_total', stage='db_save')
+            yield sse_event('done', {})
+
+        stream = events()
+        if isinstance(request._request, ASGIRequest):
+            stream = iterate_in_thread(stream)
+        streaming_response = StreamingHttpResponse(stream, content_type='text/event-stream')
+        streaming_response['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the event stream
+        streaming_response['X-Accel-Buffering'] = 'no'
+        return streaming_response
+
+    @action(detail=False, methods=['post'], renderer_classes=[JSONRenderer, NDJSONRenderer])
+    def send_batch(self, request):
+        """Run a batch of messages concurrently, streaming NDJSON results as they finish"""
+        messages = request.data.get('messages')
+        max_size = getattr(settings, 'GROQ_BATCH_MAX_SIZE', 500)
+        if not isinstance(messages, list) or not messages:
+            return Response(
+                {
+                    'error': 'messages must be a non-empty list',
+                    'type': 'error',
+                    'content': 'Please provide a list of messages.'
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(messages) > max_size:
+            return Response(
+                {
+                    'error': f'At most {max_size} messages are allowed per batch',
+                    'type': 'error',
+                    'content': 'Please split the batch into smaller ones.'
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        max_concurrency = getattr(settings, 'GROQ_BATCH_CONCURRENCY', 8)
+        try:
+            concurrency = int(request.data.get('concurrency', max_concurrency))
+        except (TypeError, ValueError):
+            concurrency = max_concurrency
+        concurrency = max(1, min(concurrency, max_concurrency, len(messages)))
+        bypass_cache = str(request.data.get('bypass_cache', '')).lower() in ('true', '1', 'yes')
+
+        def run(user_message):
+            if not isinstance(user_message, str) or not user_message:
+                return {
+                    'status': 'error',
+                    'message': 'Message is required'
+                }
+            close_old_connections()
+            try:
+                # Batch messages are independent queries, not follow-ups to the latest table
+                return self.groq_service.get_response(user_message, bypass_cache=bypass_cache, follow_up=False)
+            except Overloaded as e:
+                return {
+                    'status': 'error',
+                    'message': str(e),
+                    'retry_after': e.retry_after
+                }
+            except Exception as e:
+                print(traceback.format_exc())
+                return {
+                    'status': 'error',
+                    'message': str(e)
+                }
+            finally:
+                # Pool threads end with the batch; don't leave their connections open
+                connection.close()
+
+        def save(futures):
+            """Save every finished exchange of the batch with bulk inserts; returns how many"""
+            exchanges = [
+                (messages[index], future.result())
+                for future, index in sorted(futures.items(), key=lambda item: item[1])
+                if future.done() and isinstance(messages[index], str) and messages[index]
+            ]
+            try:
+                return len(record_exchanges(exchanges))
+            except Exception as e:
+                print(f"Error saving chat messages: {e}")
+                print(traceback.format_exc())
+                return 0
+
+        def results():
+            futures = {}
+            try:
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    futures = {
+                        executor.submit(run, user_message): index
+                        for index, user_message in enumerate(messages)
+                    }
+                    for future in as_completed(futures):
+                        yield json.dumps({'index': futures[future], 'response': future.result()}) + '\n'
+            finally:
+                # A client that disconnects closes the generator at a yield; leaving
+                # the with block above waits for the calls still running, and
+                # their answers are saved rather than thrown away
+                saved = save(futures)
+            yield json.dumps({'done': True, 'count': len(messages), 'saved': saved}) + '\n'
+
+        stream = results()
+        if isinstance(request._request, ASGIRequest):
+            stream = iterate_in_thread(stream)
+        return StreamingHttpResponse(stream, content_type='application/x-ndjson')
+
+
+# Async views, served without tying up a worker while Groq generates
+# when the app runs under ASGI (see SERVER_MODE in docker/entrypoint.sh).
+
+@require_GET
+async def get_history_async(request):
+    """Get conversation history, paginated like ChatMessageViewSet.get_history"""
+    try:
+        try:
+            columnar = wants_columnar(request)
+            data, headers = await sync_to_async(history_page)(
+                request.GET,
+                request.headers.get('If-None-Match'),
+                ColumnarJSONRenderer.format if columnar else 'json'
+            )
+        except ValueError as e:
+            return JsonResponse(
+                {
+                    'status': 'error',
+                    'message': str(e)
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if data is None:
+            response = HttpResponseNotModified()
+        elif columnar:
+            response = JsonResponse(to_columnar(data), safe=False, content_type=ColumnarJSONRenderer.media_type)
+        else:
+            response = JsonResponse(data, safe=False)
+        for header, value in headers.items():
+            response[header] = value
+        patch_vary_headers(response, ['Accept'])
+        if 'X-Next-Cursor' in headers:
+            next_url = replace_query_param(request.build_absolute_uri(), 'cursor', headers['X-Next-Cursor'])
+            response['Link'] = f'<{next_url}>; rel="next"'
+        return response
+    except Exception as e:
+        return JsonResponse(
+            {
+                'status': 'error',
+                'message': str(e)
+            },
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@csrf_exempt
+@require_POST
+async def send_message_async(request):
+    try:
+        try:
+            payload = json.loads(request.body or b'{}')
+        except json.JSONDecodeError:
+            payload = {}
+        user_message = payload.get('message', '')
+        if not user_message:
+            return JsonResponse(
+                {
+                    'error': 'Message is required',
+                    'type': 'error',
+                    'content': 'Please provide a message.'
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            previous_message_id = parse_previous_message_id(payload)
+        except (TypeError, ValueError):
+            return JsonResponse(
+                {
+                    'error': 'previous_message_id must be an integer',
+                    'type': 'error',
+                    'content': 'Please provide a valid previous message.'
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        bypass_cache = str(payload.get('bypass_cache', '')).lower() in ('true', '1', 'yes')
+        try:
+            response = await get_groq_service().aget_response(
+                user_message,
+                bypass_cache=bypass_cache,
+                previous_message_id=previous_message_id
+            )
+        except Overloaded as e:
+            response = JsonResponse(overloaded_payload(e), status=e.status_code)
+            response['Retry-After'] = str(e.retry_after)
+            return response
+        except Exception as e:
+            print(traceback.format_exc())
+            return JsonResponse(
+                {
+                    'error': 'Failed to get response from AI service',
+                    'type': 'error',
+                    'content': 'Sorry, I encountered an error while processing your request. Please try again.',
+                    'details': str(e)
+                },
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        if not isinstance(response, dict):
+            return JsonResponse(
+                {
+                    'status': 'error',
+                    'message': 'Invalid response structure from AI service'
+                },
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        try:
+            with metrics.timer('db_save'):
+                if not exchange_writer.offer(user_message, response):
+                    await sync_to_async(record_exchange)(user_message, response)
+        except Exception as e:
+            print(f"Error saving chat message: {e}")
+            print(traceback.format_exc())
+            metrics.inc('chat_errors_total', stage='db_save')
+
+        if wants_columnar(request):
+            return JsonResponse(to_columnar(response), content_type=ColumnarJSONRenderer.media_type)
+        return JsonResponse(response, status=status.HTTP_200_OK)
+
+    except Exception as e:
+        return JsonResponse(
+            {'error': str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@require_GET
+def metrics_view(request):
+    """Pipeline metrics of all workers in the Prometheus text format"""
+    body = metrics.render()
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -8,9 +8,17 @@ https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 """
 
 import os
+import time
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
+started = time.perf_counter()
 application = get_asgi_application()
+
+from chat.startup import record_phase, with_lifespan  # noqa: E402
+
+record_phase('django_setup', started)
+# Warms up the async Groq client once the worker's event loop runs
+application = with_lifespan(application)
@@ -46,6 +46,8 @@ if DEBUG:
     INSTALLED_APPS += ['debug_toolbar']
 
 MIDDLEWARE = [
+    'chat.middleware.RequestMetricsMiddleware',
+    'chat.middleware.CompressionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -92,13 +94,182 @@ import os
 # Ensure database directory exists
 os.makedirs(os.path.join(BASE_DIR, 'data'), exist_ok=True)
 
-DATABASES = {
+# DATABASE_ENGINE=postgresql switches to PostgreSQL, configured by the
+# POSTGRES_* variables. SQLite runs in WAL mode with the pragmas below,
+# applied to every new connection (see chat/db.py).
+DATABASE_ENGINE = os.getenv('DATABASE_ENGINE', 'sqlite').lower()
+
+if DATABASE_ENGINE in ('postgres', 'postgresql'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('POSTGRES_DB', 'prospectpro'),
+            'USER': os.getenv('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+            'HOST': os.getenv('POSTGRES_HOST', 'localhost'),
+            'PORT': os.getenv('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.getenv('DATABASE_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('SQLITE_PATH', os.path.join(BASE_DIR, 'data', 'db.sqlite3')),
+            # Seconds a connection waits for a lock before "database is locked"
+            'OPTIONS': {'timeout': float(os.getenv('SQLITE_BUSY_TIMEOUT', '20'))},
+            'CONN_MAX_AGE': int(os.getenv('DATABASE_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+
+# SQLITE_TUNING=False keeps SQLite's defaults (rollback journal, FULL sync)
+SQLITE_TUNING = os.getenv('SQLITE_TUNING', 'True').lower() in ('true', '1', 'yes')
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(float(os.getenv('SQLITE_BUSY_TIMEOUT', '20')) * 1000),
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+    'cache_size': -20000,  # KiB
+    'temp_store': 'MEMORY',
+}
+
+
+# Cache
+# Shared by all gunicorn workers. Point CACHE_BACKEND/CACHE_LOCATION at
+# Redis or Memcached when running more than one container.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'data', 'db.sqlite3'),
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', os.path.join(BASE_DIR, 'data', 'cache')),
+        'TIMEOUT': int(os.getenv('CACHE_TIMEOUT', '3600')),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '5000')),
+        },
     }
 }
 
+# Groq response cache
+GROQ_CACHE_ENABLED = os.getenv('GROQ_CACHE_ENABLED', 'True').lower() in ('true', '1', 'yes')
+GROQ_CACHE_ALIAS = 'default'
+GROQ_CACHE_TTL = int(os.getenv('GROQ_CACHE_TTL', '3600'))
+
+# Coalescing of identical in-flight Groq requests, within and across workers
+GROQ_SINGLEFLIGHT_ENABLED = os.getenv('GROQ_SINGLEFLIGHT_ENABLED', 'True').lower() in ('true', '1', 'yes')
+GROQ_SINGLEFLIGHT_LOCK_TIMEOUT = int(os.getenv('GROQ_SINGLEFLIGHT_LOCK_TIMEOUT', '120'))
+GROQ_SINGLEFLIGHT_WAIT_TIMEOUT = int(os.getenv('GROQ_SINGLEFLIGHT_WAIT_TIMEOUT', '120'))
+GROQ_SINGLEFLIGHT_RESULT_TTL = int(os.getenv('GROQ_SINGLEFLIGHT_RESULT_TTL', '10'))
+GROQ_SINGLEFLIGHT_POLL_INTERVAL = float(os.getenv('GROQ_SINGLEFLIGHT_POLL_INTERVAL', '0.1'))
+
+# Locks shared by the workers of one host, used instead of cache entries when
+# the cache backend's add() is not atomic (the file-based cache)
+CHAT_LOCK_DIR = os.getenv('CHAT_LOCK_DIR', os.path.join(BASE_DIR, 'data', 'locks'))
+
+# Groq API endpoint; point it at benchmarks/fake_groq.py for load tests
+GROQ_BASE_URL = os.getenv('GROQ_BASE_URL') or None
+
+# Upstream resilience: every request has a deadline that bounds all retries
+GROQ_REQUEST_DEADLINE = float(os.getenv('GROQ_REQUEST_DEADLINE', '60'))
+GROQ_RETRY_MAX_ATTEMPTS = int(os.getenv('GROQ_RETRY_MAX_ATTEMPTS', '3'))
+GROQ_RETRY_BASE_DELAY = float(os.getenv('GROQ_RETRY_BASE_DELAY', '0.5'))
+GROQ_RETRY_MAX_DELAY = float(os.getenv('GROQ_RETRY_MAX_DELAY', '8'))
+GROQ_HEDGE_ENABLED = os.getenv('GROQ_HEDGE_ENABLED', 'False').lower() in ('true', '1', 'yes')
+GROQ_HEDGE_QUANTILE = float(os.getenv('GROQ_HEDGE_QUANTILE', '0.95'))
+GROQ_HEDGE_MIN_DELAY = float(os.getenv('GROQ_HEDGE_MIN_DELAY', '1.0'))
+GROQ_HEDGE_MAX_EXTRA_RATIO = float(os.getenv('GROQ_HEDGE_MAX_EXTRA_RATIO', '0.05'))
+GROQ_HEDGE_MIN_SAMPLES = int(os.getenv('GROQ_HEDGE_MIN_SAMPLES', '20'))
+GROQ_HEDGE_WINDOW = int(os.getenv('GROQ_HEDGE_WINDOW', '200'))
+GROQ_HEDGE_MAX_THREADS = int(os.getenv('GROQ_HEDGE_MAX_THREADS', '32'))
+
+# Admission control in front of Groq. Calls per worker are capped below the
+# gunicorn threads so cheap endpoints keep being served while Groq is slow;
+# excess calls wait in a short queue and are then refused with 503.
+GROQ_MAX_CONCURRENT_CALLS = int(os.getenv('GROQ_MAX_CONCURRENT_CALLS', '4'))
+GROQ_ADMISSION_MAX_QUEUE = int(os.getenv('GROQ_ADMISSION_MAX_QUEUE', '2'))
+GROQ_ADMISSION_MAX_WAIT = float(os.getenv('GROQ_ADMISSION_MAX_WAIT', '5'))
+
+# Circuit breaker, per worker: opens on the error or slow-call rate of the last window
+GROQ_BREAKER_ENABLED = os.getenv('GROQ_BREAKER_ENABLED', 'True').lower() in ('true', '1', 'yes')
+GROQ_BREAKER_WINDOW = float(os.getenv('GROQ_BREAKER_WINDOW', '60'))
+GROQ_BREAKER_MIN_CALLS = int(os.getenv('GROQ_BREAKER_MIN_CALLS', '10'))
+GROQ_BREAKER_ERROR_RATE = float(os.getenv('GROQ_BREAKER_ERROR_RATE', '0.5'))
+GROQ_BREAKER_SLOW_CALL_SECONDS = float(os.getenv('GROQ_BREAKER_SLOW_CALL_SECONDS', '30'))
+GROQ_BREAKER_SLOW_CALL_RATE = float(os.getenv('GROQ_BREAKER_SLOW_CALL_RATE', '0.5'))
+GROQ_BREAKER_OPEN_SECONDS = float(os.getenv('GROQ_BREAKER_OPEN_SECONDS', '30'))
+GROQ_BREAKER_HALF_OPEN_CALLS = int(os.getenv('GROQ_BREAKER_HALF_OPEN_CALLS', '1'))
+
+# Groq quotas shared by all workers through the cache; 0 turns a quota off.
+# Up to BURST_SECONDS worth of quota can be used at once, so set them a
+# little below the limits of the Groq plan.
+GROQ_RATE_LIMIT_RPM = int(os.getenv('GROQ_RATE_LIMIT_RPM', '0'))
+GROQ_RATE_LIMIT_TPM = int(os.getenv('GROQ_RATE_LIMIT_TPM', '0'))
+GROQ_RATE_LIMIT_BURST_SECONDS = float(os.getenv('GROQ_RATE_LIMIT_BURST_SECONDS', '10'))
+
+# Local company knowledge index answering repeat lookups
+GROQ_KNOWLEDGE_ENABLED = os.getenv('GROQ_KNOWLEDGE_ENABLED', 'True').lower() in ('true', '1', 'yes')
+GROQ_KNOWLEDGE_MAX_AGE_DAYS = int(os.getenv('GROQ_KNOWLEDGE_MAX_AGE_DAYS', '7'))
+GROQ_KNOWLEDGE_MIN_ROWS = int(os.getenv('GROQ_KNOWLEDGE_MIN_ROWS', '5'))
+GROQ_KNOWLEDGE_REFRESH_INTERVAL = int(os.getenv('GROQ_KNOWLEDGE_REFRESH_INTERVAL', '30'))
+# Similarity (1 - edits / length) from which two company names are the same entity
+GROQ_ENTITY_MATCH_THRESHOLD = float(os.getenv('GROQ_ENTITY_MATCH_THRESHOLD', '0.85'))
+
+# History search ranks at most this many of the newest matches of a query,
+# which bounds its cost however long the history gets
+SEARCH_MAX_RANKED = int(os.getenv('SEARCH_MAX_RANKED', '1000'))
+
+# "include X as Y" follow-ups only ask the model for the new column's values
+GROQ_ENRICHMENT_ENABLED = os.getenv('GROQ_ENRICHMENT_ENABLED', 'True').lower() in ('true', '1', 'yes')
+
+# Completion budgets are estimated from the requested rows and columns
+GROQ_DEFAULT_ROWS = int(os.getenv('GROQ_DEFAULT_ROWS', '10'))
+GROQ_MAX_TOKENS = int(os.getenv('GROQ_MAX_TOKENS', '4096'))
+GROQ_MIN_MAX_TOKENS = int(os.getenv('GROQ_MIN_MAX_TOKENS', '256'))
+GROQ_MAX_TOKENS_HEADROOM = float(os.getenv('GROQ_MAX_TOKENS_HEADROOM', '1.5'))
+
+# Write-behind saving of chat exchanges (see chat/persistence.py)
+CHAT_WRITE_BEHIND_ENABLED = os.getenv('CHAT_WRITE_BEHIND_ENABLED', 'False').lower() in ('true', '1', 'yes')
+CHAT_WRITE_BEHIND_QUEUE_SIZE = int(os.getenv('CHAT_WRITE_BEHIND_QUEUE_SIZE', '1000'))
+CHAT_WRITE_BEHIND_BATCH_SIZE = int(os.getenv('CHAT_WRITE_BEHIND_BATCH_SIZE', '50'))
+CHAT_WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv('CHAT_WRITE_BEHIND_FLUSH_INTERVAL', '0.5'))
+
+# brotli (when installed) or gzip for API responses above the threshold
+API_COMPRESSION_ENABLED = os.getenv('API_COMPRESSION_ENABLED', 'True').lower() in ('true', '1', 'yes')
+API_COMPRESSION_MIN_BYTES = int(os.getenv('API_COMPRESSION_MIN_BYTES', '1024'))
+API_COMPRESSION_GZIP_LEVEL = int(os.getenv('API_COMPRESSION_GZIP_LEVEL', '6'))
+API_COMPRESSION_BROTLI_QUALITY = int(os.getenv('API_COMPRESSION_BROTLI_QUALITY', '4'))
+
+# Messages fetched per query while streaming an export
+CHAT_EXPORT_CHUNK_SIZE = int(os.getenv('CHAT_EXPORT_CHUNK_SIZE', '500'))
+
+# Pipeline metrics served as Prometheus text at /api/metrics. Workers write
+# snapshots to METRICS_DIR, which must be shared by all of them.
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(BASE_DIR, 'data', 'metrics'))
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '1.0'))
+
+# Batch endpoint fan-out
+GROQ_BATCH_CONCURRENCY = int(os.getenv('GROQ_BATCH_CONCURRENCY', '8'))
+GROQ_BATCH_MAX_SIZE = int(os.getenv('GROQ_BATCH_MAX_SIZE', '500'))
+
+# Groq connection pools
+GROQ_MAX_CONNECTIONS = int(os.getenv('GROQ_MAX_CONNECTIONS', '200'))
+GROQ_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('GROQ_MAX_KEEPALIVE_CONNECTIONS', '50'))
+GROQ_KEEPALIVE_EXPIRY = float(os.getenv('GROQ_KEEPALIVE_EXPIRY', '30'))
+
+# Fan-out of large "list N startups" queries into parallel sub-queries by segment
+GROQ_SEGMENT_ENABLED = os.getenv('GROQ_SEGMENT_ENABLED', 'True').lower() in ('true', '1', 'yes')
+GROQ_SEGMENT_ROWS = int(os.getenv('GROQ_SEGMENT_ROWS', '20'))
+GROQ_SEGMENT_MAX_ROWS = int(os.getenv('GROQ_SEGMENT_MAX_ROWS', '200'))
+GROQ_SEGMENT_OVERFETCH = float(os.getenv('GROQ_SEGMENT_OVERFETCH', '0.2'))
+GROQ_SEGMENT_MAX_PARALLEL = int(os.getenv('GROQ_SEGMENT_MAX_PARALLEL', '4'))
+GROQ_SEGMENT_DIMENSIONS = os.getenv('GROQ_SEGMENT_DIMENSIONS', 'industry,funding_stage,established_year,company_name').split(',')
+
+# Worker warm-up: load the URLconf and open Groq connections before the first request
+GROQ_WARMUP_ENABLED = os.getenv('GROQ_WARMUP_ENABLED', 'True').lower() in ('true', '1', 'yes')
+GROQ_WARMUP_CONNECTIONS = int(os.getenv('GROQ_WARMUP_CONNECTIONS', '2'))
+GROQ_WARMUP_TIMEOUT = float(os.getenv('GROQ_WARMUP_TIMEOUT', '5'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -172,12 +343,20 @@ CORS_ALLOW_METHODS = [
     'PUT',
 ]
 
+# Let the client read pagination and caching headers
+CORS_EXPOSE_HEADERS = [
+    'etag',
+    'link',
+    'x-next-cursor',
+]
+
 CORS_ALLOW_HEADERS = [
     'accept',
     'accept-encoding',
     'authorization',
     'content-type',
     'dnt',
+    'if-none-match',
     'origin',
     'user-agent',
     'x-csrftoken',
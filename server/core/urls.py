@@ -19,10 +19,12 @@ from django.urls import path, include, re_path
 from django.conf import settings
 from django.views.generic import TemplateView
 from django.conf.urls.static import static
+from chat.views import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/chat/', include('chat.urls')),
+    path('api/metrics', metrics_view, name='metrics'),
     path('api/', TemplateView.as_view(template_name='api_root.html')),
 ]
 
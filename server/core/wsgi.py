@@ -8,9 +8,15 @@ https://docs.djangoproject.com/en/5.0/howto/deployment/wsgi/
 """
 
 import os
+import time
 
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
+started = time.perf_counter()
 application = get_wsgi_application()
+
+from chat.startup import record_phase  # noqa: E402
+
+record_phase('django_setup', started)
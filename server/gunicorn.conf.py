@@ -0,0 +1,51 @@
+# Gunicorn settings shared by the WSGI and ASGI modes of docker/entrypoint.sh
+import os
+
+# The master reads settings in on_starting, before any app is loaded
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+
+# Threads per worker for the WSGI mode. GROQ_MAX_CONCURRENT_CALLS keeps
+# some of them free of Groq calls for cheap endpoints like get_history.
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+
+
+def on_starting(server):
+    """Drop metric snapshots left by the workers of a previous run"""
+    try:
+        from chat.metrics import metrics
+    except Exception:
+        return
+    metrics.clear()
+
+
+def post_worker_init(worker):
+    """Load the app and open upstream connections before the worker takes requests.
+
+    Runs after the worker imported the application; post_fork would run
+    before Django is set up.
+    """
+    try:
+        from chat.startup import warm_up
+    except Exception:
+        return
+    warm_up()
+
+
+def worker_exit(server, worker):
+    """Save queued exchanges and a last metrics snapshot before the worker exits"""
+    try:
+        from chat.metrics import metrics
+        from chat.persistence import exchange_writer
+    except Exception:
+        return
+    exchange_writer.stop()
+    metrics.flush()
+
+
+def child_exit(server, worker):
+    """Fold the exited worker's metrics into the retired totals, in the master"""
+    try:
+        from chat.metrics import metrics
+    except Exception:
+        return
+    metrics.retire(worker.pid)